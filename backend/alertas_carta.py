@@ -0,0 +1,134 @@
+﻿import time
+
+UMBRAL_POR_DEFECTO = 0.5  # % de subida que dispara el aviso
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS alertas_carta (
+    impresion_id INTEGER NOT NULL REFERENCES impresiones (id),
+    chat_id INTEGER NOT NULL,
+    umbral REAL NOT NULL,
+    precio_ref REAL NOT NULL,
+    fecha_alta INTEGER NOT NULL,
+    PRIMARY KEY (impresion_id, chat_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_alertas_carta_chat ON alertas_carta (chat_id);
+'''
+
+def inicializar_esquema(conn):
+    """Crear la tabla de alertas por carta si no existe"""
+    conn.executescript(ESQUEMA)
+
+def guardar_alerta(conn, impresion_id, chat_id, precio_ref, umbral=UMBRAL_POR_DEFECTO):
+    """Registrar (o actualizar) una alerta en la base de datos (sin commit)"""
+    conn.execute('''
+        INSERT OR REPLACE INTO alertas_carta (impresion_id, chat_id, umbral, precio_ref, fecha_alta)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (impresion_id, chat_id, umbral, precio_ref, int(time.time())))
+
+def borrar_alerta(conn, impresion_id, chat_id):
+    """Eliminar una alerta de la base de datos (sin commit)"""
+    conn.execute("DELETE FROM alertas_carta WHERE impresion_id = ? AND chat_id = ?", (impresion_id, chat_id))
+
+def tiene_alerta(conn, chat_id, nombre):
+    """Comprobar si el chat tiene alguna alerta para una carta (cualquier edición)"""
+    return conn.execute('''
+        SELECT 1
+        FROM alertas_carta a
+        JOIN impresiones i ON i.id = a.impresion_id
+        WHERE a.chat_id = ? AND i.nombre = ? COLLATE NOCASE
+        LIMIT 1
+    ''', (chat_id, nombre)).fetchone() is not None
+
+def borrar_alertas_por_nombre(conn, chat_id, nombre):
+    """Eliminar las alertas de un chat para todas las ediciones de una carta (sin commit)
+
+    Devuelve los impresion_id eliminados.
+    """
+    ids = [fila[0] for fila in conn.execute('''
+        SELECT a.impresion_id
+        FROM alertas_carta a
+        JOIN impresiones i ON i.id = a.impresion_id
+        WHERE a.chat_id = ? AND i.nombre = ? COLLATE NOCASE
+    ''', (chat_id, nombre))]
+    conn.executemany("DELETE FROM alertas_carta WHERE impresion_id = ? AND chat_id = ?",
+                     [(impresion_id, chat_id) for impresion_id in ids])
+    return ids
+
+def actualizar_referencias(conn, avisos):
+    """Guardar como nueva referencia el precio ya avisado (sin commit)"""
+    conn.executemany("UPDATE alertas_carta SET precio_ref = ? WHERE impresion_id = ? AND chat_id = ?",
+                     [(precio, impresion_id, chat_id) for chat_id, impresion_id, _, precio, _ in avisos])
+
+class IndiceAlertas:
+    """Índice invertido impresion_id -> {chat_id: [umbral, precio_ref]}
+
+    Evaluar un lote de cambios de precio sólo toca las impresiones que cambiaron,
+    sin recorrer las suscripciones de todos los usuarios. El índice vive en
+    memoria; la tabla se actualiza con las funciones de este módulo.
+    """
+
+    def __init__(self):
+        self._por_impresion = {}
+        self.total = 0
+
+    @classmethod
+    def desde_db(cls, conn):
+        """Construir el índice con las alertas guardadas"""
+        indice = cls()
+        for impresion_id, chat_id, umbral, precio_ref in conn.execute(
+                "SELECT impresion_id, chat_id, umbral, precio_ref FROM alertas_carta"):
+            indice.agregar(impresion_id, chat_id, precio_ref, umbral)
+        return indice
+
+    def agregar(self, impresion_id, chat_id, precio_ref, umbral=UMBRAL_POR_DEFECTO):
+        """Añadir (o actualizar) una alerta en el índice"""
+        suscritos = self._por_impresion.setdefault(impresion_id, {})
+        if chat_id not in suscritos:
+            self.total += 1
+        suscritos[chat_id] = [umbral, precio_ref]
+
+    def quitar(self, impresion_id, chat_id):
+        """Quitar una alerta del índice; devuelve False si no existía"""
+        suscritos = self._por_impresion.get(impresion_id)
+        if not suscritos or chat_id not in suscritos:
+            return False
+        del suscritos[chat_id]
+        self.total -= 1
+        if not suscritos:
+            del self._por_impresion[impresion_id]
+        return True
+
+    def evaluar(self, cambios):
+        """Comprobar los umbrales de las impresiones cuyo precio cambió
+
+        `cambios` es un iterable de (impresion_id, precio). Devuelve una lista de
+        avisos (chat_id, impresion_id, precio_ref, precio, cambio_porcentaje).
+        """
+        avisos = []
+        for impresion_id, precio in cambios:
+            suscritos = self._por_impresion.get(impresion_id)
+            if not suscritos:
+                continue
+            for chat_id, (umbral, precio_ref) in suscritos.items():
+                if precio_ref <= 0:
+                    continue
+                cambio = (precio - precio_ref) / precio_ref * 100
+                if cambio >= umbral:
+                    avisos.append((chat_id, impresion_id, precio_ref, precio, cambio))
+        return avisos
+
+    def confirmar(self, avisos):
+        """Tomar el precio avisado como nueva referencia para no repetir el aviso"""
+        for chat_id, impresion_id, _, precio, _ in avisos:
+            suscritos = self._por_impresion.get(impresion_id, {})
+            if chat_id in suscritos:
+                suscritos[chat_id][1] = precio
+
+def cambios_desde(conn, desde_ts):
+    """Impresiones con un precio observado en o después de desde_ts: [(impresion_id, precio, ts)]
+
+    Se incluye el propio desde_ts para no perder observaciones del mismo segundo;
+    volver a evaluarlas no repite avisos porque la referencia ya se actualizó.
+    """
+    return conn.execute("SELECT impresion_id, precio, ts FROM precios_actuales WHERE ts >= ?", (desde_ts,)).fetchall()
@@ -0,0 +1,52 @@
+﻿import time
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS archivos_telegram (
+    clave TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    fecha_alta INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+def inicializar_esquema(conn):
+    """Crear la tabla de file_id de Telegram si no existe"""
+    conn.executescript(ESQUEMA)
+
+def guardar_file_id(conn, clave, file_id):
+    """Guardar el file_id de un archivo recién subido (sin commit)"""
+    conn.execute("INSERT OR REPLACE INTO archivos_telegram (clave, file_id, fecha_alta) VALUES (?, ?, ?)",
+                 (clave, file_id, int(time.time())))
+
+def borrar_file_id(conn, clave):
+    """Eliminar un file_id (sin commit)"""
+    conn.execute("DELETE FROM archivos_telegram WHERE clave = ?", (clave,))
+
+class RegistroFileIds:
+    """Memoria de los file_id devueltos por Telegram tras subir un archivo
+
+    Reenviar por file_id evita volver a subir los mismos bytes: la clave es
+    cualquier identificador estable del contenido (hash del gráfico, imagen...).
+    Sólo mantiene el diccionario en memoria; la persistencia se hace con
+    guardar_file_id / borrar_file_id.
+    """
+
+    def __init__(self, conn):
+        self._file_ids = dict(conn.execute("SELECT clave, file_id FROM archivos_telegram"))
+
+    def obtener(self, clave):
+        """file_id registrado para la clave, o None"""
+        return self._file_ids.get(clave)
+
+    def registrar(self, clave, file_id):
+        """Recordar el file_id; devuelve False si ya estaba registrado"""
+        if self._file_ids.get(clave) == file_id:
+            return False
+        self._file_ids[clave] = file_id
+        return True
+
+    def olvidar(self, clave):
+        """Descartar un file_id que Telegram ya no acepta; devuelve False si no existía"""
+        return self._file_ids.pop(clave, None) is not None
+
+    def __len__(self):
+        return len(self._file_ids)
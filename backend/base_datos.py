@@ -0,0 +1,148 @@
+import os
+import queue
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Acceso a SQLite: un escritor con commits por lotes y un pool de lectores en hilos
+LECTORES = int(os.getenv("DB_LECTORES", "4"))
+LOTE_ESCRITURA = 500  # operaciones máximas por transacción
+
+PRAGMAS = {
+    "synchronous": "NORMAL",     # con WAL sólo se sincroniza en los checkpoints
+    "mmap_size": 268435456,      # 256 MB mapeados en memoria para lecturas
+    "cache_size": -65536,        # 64 MB de caché de páginas por conexión
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000
+}
+
+def conectar(ruta, solo_lectura=False):
+    """Abrir una conexión con WAL y los pragmas del bot"""
+    conn = sqlite3.connect(ruta, check_same_thread=False)
+    if not solo_lectura:
+        conn.execute("PRAGMA journal_mode=WAL")
+    for pragma, valor in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={valor}")
+    if solo_lectura:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+class BaseDatos:
+    """Conexión de escritura única + lectores en un ThreadPoolExecutor
+
+    Las consultas se ejecutan fuera del event loop: `await db.leer(f, ...)` y
+    `await db.escribir(f, ...)` llaman a f(conn, ...) en un hilo. Las
+    escrituras pendientes se agrupan en una sola transacción (cada una en su
+    SAVEPOINT, así un error no deshace las demás), por lo que las funciones
+    de escritura no deben hacer commit.
+    """
+
+    def __init__(self, ruta, lectores=LECTORES):
+        self.ruta = ruta
+        self.escritor = conectar(ruta)
+        self._local = threading.local()
+        self._conexiones_lectura = []
+        self._lectores = ThreadPoolExecutor(max_workers=lectores, thread_name_prefix="db-lectura")
+        self._cola = queue.SimpleQueue()
+        self._hilo_escritor = None
+        self.transacciones = 0
+        self.escrituras = 0
+
+    def _conexion_lectura(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = conectar(self.ruta, solo_lectura=True)
+            self._local.conn = conn
+            self._conexiones_lectura.append(conn)
+        return conn
+
+    def _leer(self, funcion, args, kwargs):
+        return funcion(self._conexion_lectura(), *args, **kwargs)
+
+    async def leer(self, funcion, *args, **kwargs):
+        """Ejecutar funcion(conn, *args) con una conexión de lectura del pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._lectores, self._leer, funcion, args, kwargs)
+
+    async def escribir(self, funcion, *args, **kwargs):
+        """Encolar funcion(conn, *args) para el escritor y esperar a que se confirme"""
+        if self._hilo_escritor is None:
+            self._hilo_escritor = threading.Thread(target=self._bucle_escritor, name="db-escritura", daemon=True)
+            self._hilo_escritor.start()
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._cola.put(((funcion, args, kwargs), futuro, loop))
+        return await futuro
+
+    def _bucle_escritor(self):
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                return
+            lote = [tarea]
+            while len(lote) < LOTE_ESCRITURA:
+                try:
+                    tarea = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if tarea is None:
+                    self._cola.put(None)
+                    break
+                lote.append(tarea)
+            self._ejecutar_lote(lote)
+
+    def _ejecutar_lote(self, lote):
+        conn = self.escritor
+        resultados = []
+        try:
+            conn.execute("BEGIN")
+            for operacion, _, _ in lote:
+                conn.execute("SAVEPOINT operacion")
+                try:
+                    funcion, args, kwargs = operacion
+                    resultados.append((funcion(conn, *args, **kwargs), None))
+                    conn.execute("RELEASE operacion")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operacion")
+                    conn.execute("RELEASE operacion")
+                    resultados.append((None, e))
+            conn.commit()
+            self.transacciones += 1
+            self.escrituras += len(lote)
+        except Exception as e:
+            conn.rollback()
+            resultados = [(None, e)] * len(lote)
+
+        # Resolver los futuros sólo cuando el lote ya está confirmado
+        for (_, futuro, loop), (resultado, error) in zip(lote, resultados):
+            loop.call_soon_threadsafe(self._resolver, futuro, resultado, error)
+
+    @staticmethod
+    def _resolver(futuro, resultado, error):
+        if futuro.done():
+            return
+        if error is not None:
+            futuro.set_exception(error)
+        else:
+            futuro.set_result(resultado)
+
+    def estadisticas(self):
+        """Métricas de escritura por lotes"""
+        return {
+            "escrituras": self.escrituras,
+            "transacciones": self.transacciones,
+            "lectores": len(self._conexiones_lectura)
+        }
+
+    def cerrar(self):
+        """Terminar las escrituras pendientes y cerrar todas las conexiones"""
+        if self._hilo_escritor is not None:
+            self._cola.put(None)
+            self._hilo_escritor.join()
+            self._hilo_escritor = None
+        self._lectores.shutdown(wait=True)
+        for conn in self._conexiones_lectura:
+            conn.close()
+        self._conexiones_lectura.clear()
+        self.escritor.close()
@@ -0,0 +1,94 @@
+﻿import os
+import time
+import asyncio
+from backend import precios_db
+
+# Escritura diferida de las observaciones de precio de las consultas interactivas
+CUBETA = int(os.getenv("OBSERVACIONES_CUBETA_SEGUNDOS", "3600"))  # una observación por impresión y cubeta
+MAX_PENDIENTES = 500       # impresiones en memoria antes de forzar un volcado
+INTERVALO_VACIADO = 60     # segundos entre volcados periódicos
+
+class BufferObservaciones:
+    """Acumular observaciones de precio y guardarlas por lotes en una sola transacción
+
+    Cada consulta a Scryfall produce una observación; en lugar de escribirla al
+    momento, se guarda en memoria con la clave (impresión, cubeta de tiempo) y
+    sólo se conserva la última, con su ts real. Al volcar, un precio nuevo
+    reemplaza la fila que la impresión ya tuviera en la misma cubeta en lugar
+    de añadir otra, y un precio igual al último guardado no añade ninguna:
+    se marca como verificado. Se vuelca al llegar a MAX_PENDIENTES, en el trabajo periódico
+    y al apagar el bot.
+    """
+
+    def __init__(self, db, al_registrar=None, cubeta=CUBETA, max_pendientes=MAX_PENDIENTES):
+        self.db = db
+        self.al_registrar = al_registrar
+        self.cubeta = cubeta
+        self.max_pendientes = max_pendientes
+        self._pendientes = {}  # (impresión, cubeta) -> (observación, [cartas que esperan su impresion_id])
+        self._lock = asyncio.Lock()
+        self._tarea = None
+        self.recibidas = 0
+        self.escritas = 0
+        self.verificadas = 0   # precios sin cambios: sólo se anota que siguen vigentes
+        self.volcados = 0
+
+    def _clave(self, carta, ts):
+        impresion = carta.get("scryfall_id") or (carta["nombre"], carta.get("coleccion"))
+        return impresion, ts - ts % self.cubeta
+
+    def agregar(self, carta, ts=None):
+        """Anotar el precio de una carta para el próximo volcado"""
+        ts = int(time.time()) if ts is None else ts
+        clave = self._clave(carta, ts)
+        observacion = dict(carta, ts=ts)
+        anterior = self._pendientes.get(clave)
+        cartas = anterior[1] if anterior else []
+        cartas.append(carta)
+        self._pendientes[clave] = (observacion, cartas)
+        self.recibidas += 1
+
+        if len(self._pendientes) >= self.max_pendientes and (self._tarea is None or self._tarea.done()):
+            self._tarea = asyncio.ensure_future(self.vaciar())
+
+    async def vaciar(self):
+        """Guardar todas las observaciones pendientes en una sola operación del escritor"""
+        async with self._lock:
+            if not self._pendientes:
+                return 0
+            pendientes, self._pendientes = self._pendientes, {}
+            observaciones = [observacion for observacion, _ in pendientes.values()]
+            try:
+                filas, cambios = await self.db.escribir(precios_db.registrar_cambios, observaciones,
+                                                        cubeta=self.cubeta)
+            except Exception:
+                # Devolver al buffer lo que no se pudo guardar, sin pisar lo recibido mientras tanto
+                for clave, valor in pendientes.items():
+                    self._pendientes.setdefault(clave, valor)
+                raise
+
+            for (observacion, cartas), (impresion_id, _, _) in zip(pendientes.values(), filas):
+                for carta in cartas:
+                    carta["impresion_id"] = impresion_id
+                if self.al_registrar is not None:
+                    self.al_registrar(observacion, impresion_id)
+            self.escritas += len(cambios)
+            self.verificadas += len(filas) - len(cambios)
+            self.volcados += 1
+            return len(filas)
+
+    async def impresion_id(self, carta):
+        """impresion_id de una carta, volcando antes el buffer si aún está pendiente"""
+        if not carta.get("impresion_id"):
+            await self.vaciar()
+        return carta.get("impresion_id")
+
+    def estadisticas(self):
+        """Métricas de deduplicación y volcado"""
+        return {
+            "pendientes": len(self._pendientes),
+            "recibidas": self.recibidas,
+            "escritas": self.escritas,
+            "verificadas": self.verificadas,
+            "volcados": self.volcados
+        }
@@ -0,0 +1,74 @@
+﻿import json
+
+BLOQUE_LECTURA = 1 << 20  # 1 MB por lectura
+
+def iterar_cartas_bulk(ruta, tamano_bloque=BLOQUE_LECTURA):
+    """Recorrer un archivo bulk-data de Scryfall (lista JSON) carta a carta sin cargarlo entero"""
+    decoder = json.JSONDecoder()
+    with open(ruta, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        inicio_lista = False
+        fin_archivo = False
+
+        while True:
+            # Saltar espacios, el corchete inicial y las comas entre cartas
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ","):
+                pos += 1
+            if not inicio_lista and pos < len(buffer):
+                if buffer[pos] != "[":
+                    raise ValueError("El archivo bulk-data no es una lista JSON")
+                inicio_lista = True
+                pos += 1
+                continue
+            if inicio_lista and pos < len(buffer) and buffer[pos] == "]":
+                return
+
+            if pos < len(buffer):
+                try:
+                    carta, fin = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if fin_archivo:
+                        raise
+                else:
+                    pos = fin
+                    yield carta
+                    continue
+            elif fin_archivo:
+                if inicio_lista:
+                    raise ValueError("El archivo bulk-data está incompleto")
+                return
+
+            # Hace falta leer más datos: descartar lo ya procesado y añadir un bloque
+            bloque = f.read(tamano_bloque)
+            if not bloque:
+                fin_archivo = True
+            buffer = buffer[pos:] + bloque
+            pos = 0
+
+def precio_usd(card):
+    """Precio en USD de una carta de Scryfall, o None si no tiene"""
+    precios = card.get("prices") or {}
+    precio = precios.get("usd")
+    return float(precio) if precio else None
+
+def imagen_normal(card):
+    """URL de la imagen 'normal' (usa la cara frontal en cartas de dos caras)"""
+    if "image_uris" in card:
+        return card["image_uris"].get("normal", "")
+    caras = card.get("card_faces") or []
+    if caras and "image_uris" in caras[0]:
+        return caras[0]["image_uris"].get("normal", "")
+    return ""
+
+def observacion_desde_carta(card):
+    """Convertir una carta de Scryfall en una observación de precio"""
+    return {
+        "nombre": card["name"],
+        "edicion": card.get("set_name", "No disponible"),
+        "coleccion": card.get("set", "No disponible"),
+        "precio": precio_usd(card),
+        "image_url": imagen_normal(card),
+        "scryfall_id": card.get("id"),
+        "numero": card.get("collector_number")
+    }
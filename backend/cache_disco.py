@@ -0,0 +1,81 @@
+﻿import os
+from collections import OrderedDict
+
+class CacheDisco:
+    """Archivos en disco direccionados por clave, con desalojo LRU al superar max_bytes"""
+
+    def __init__(self, directorio, max_bytes, extension):
+        self.directorio = directorio
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self._archivos = OrderedDict()  # clave -> tamaño, del menos al más reciente
+        self._bytes = 0
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave + self.extension)
+
+    def _cargar(self):
+        """Reconstruir el índice LRU a partir de los archivos existentes (por fecha de acceso)"""
+        existentes = []
+        for entrada in os.scandir(self.directorio):
+            if entrada.is_file() and entrada.name.endswith(self.extension):
+                info = entrada.stat()
+                existentes.append((info.st_mtime, entrada.name[:-len(self.extension)], info.st_size))
+        for _, clave, tamano in sorted(existentes):
+            self._archivos[clave] = tamano
+            self._bytes += tamano
+        self._desalojar()
+
+    def leer(self, clave):
+        """Contenido del archivo, o None si no está en caché"""
+        if clave not in self._archivos:
+            self.fallos += 1
+            return None
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                contenido = f.read()
+            os.utime(ruta)
+        except OSError:
+            self._bytes -= self._archivos.pop(clave)
+            self.fallos += 1
+            return None
+        self._archivos.move_to_end(clave)
+        self.aciertos += 1
+        return contenido
+
+    def guardar(self, clave, contenido):
+        """Guardar un archivo y desalojar los menos usados si hace falta"""
+        ruta = self._ruta(clave)
+        temporal = ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+        self._bytes += len(contenido) - self._archivos.pop(clave, 0)
+        self._archivos[clave] = len(contenido)
+        self._desalojar()
+
+    def _desalojar(self):
+        while self._bytes > self.max_bytes and len(self._archivos) > 1:
+            clave, tamano = self._archivos.popitem(last=False)
+            self._bytes -= tamano
+            self.desalojos += 1
+            try:
+                os.remove(self._ruta(clave))
+            except OSError:
+                pass
+
+    def estadisticas(self):
+        """Métricas de uso de la caché"""
+        return {
+            "archivos": len(self._archivos),
+            "bytes": self._bytes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos
+        }
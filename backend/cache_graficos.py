@@ -0,0 +1,38 @@
+﻿import os
+import json
+import hashlib
+from datetime import date, datetime
+from backend.cache_disco import CacheDisco
+
+# Caché en disco de gráficos renderizados, direccionada por el contenido
+DIRECTORIO = os.path.join("data", "graficos")
+MAX_BYTES = int(os.getenv("GRAFICOS_CACHE_MB", "50")) * 1024 * 1024
+
+def _normalizar(valor):
+    """Valor serializable y estable para el hash (fechas al día, floats redondeados)"""
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, float):
+        return round(valor, 4)
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar(v) for v in valor]
+    if hasattr(valor, "tolist"):
+        return _normalizar(valor.tolist())
+    return valor
+
+def clave_grafico(funcion, *args):
+    """Hash del tipo de gráfico y de las series de entrada
+
+    Las fechas se agrupan por día: un gráfico pedido a distintas horas del mismo
+    día con los mismos precios comparte clave.
+    """
+    contenido = json.dumps([funcion.__name__, _normalizar(args)], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+class CacheGraficos(CacheDisco):
+    """PNG renderizados en disco con desalojo LRU al superar max_bytes"""
+
+    def __init__(self, directorio=DIRECTORIO, max_bytes=MAX_BYTES):
+        super().__init__(directorio, max_bytes, ".png")
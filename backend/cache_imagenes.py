@@ -0,0 +1,68 @@
+﻿import os
+import re
+import hashlib
+import httpx
+from urllib.parse import urlsplit
+from backend.cache_disco import CacheDisco
+from backend.vuelo_unico import VueloUnico
+from backend import scryfall_client
+
+# Caché local de imágenes de cartas (proxy de cards.scryfall.io)
+DIRECTORIO = os.path.join("data", "imagenes")
+MAX_BYTES = int(os.getenv("IMAGENES_CACHE_MB", "200")) * 1024 * 1024
+
+# https://cards.scryfall.io/normal/front/a/b/<id de Scryfall>.jpg?1675199280
+_ID_EN_URL = re.compile(r"/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.\w+$")
+
+def id_en_url(image_url):
+    """Id de Scryfall contenido en la URL de una imagen, o None"""
+    coincidencia = _ID_EN_URL.search(urlsplit(image_url or "").path)
+    return coincidencia.group(1) if coincidencia else None
+
+def clave_imagen(image_url, scryfall_id=None):
+    """Clave estable de una imagen: id de Scryfall, cara/tamaño y versión (?1675199280)
+
+    Si Scryfall publica una versión nueva de la imagen cambia el sufijo y con
+    él la clave, así que nunca se sirve una imagen obsoleta.
+    """
+    partes = urlsplit(image_url)
+    coincidencia = _ID_EN_URL.search(partes.path)
+    if coincidencia is None and scryfall_id is None:
+        return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+    carta_id = coincidencia.group(1) if coincidencia else scryfall_id
+    # normal/front, large/back...: una misma carta tiene varias imágenes
+    variante = "-".join(partes.path.strip("/").split("/")[:2]) or "normal"
+    return f"{carta_id}_{variante}_{partes.query or '0'}"
+
+class CacheImagenes(CacheDisco):
+    """Imágenes de cartas en disco con desalojo LRU y descargas sin duplicar"""
+
+    def __init__(self, directorio=DIRECTORIO, max_bytes=MAX_BYTES):
+        super().__init__(directorio, max_bytes, ".jpg")
+        self.descargas = VueloUnico()
+
+    async def obtener(self, image_url, scryfall_id=None):
+        """Bytes de la imagen, descargándola sólo si no está en disco"""
+        clave = clave_imagen(image_url, scryfall_id)
+        contenido = self.leer(clave)
+        if contenido is not None:
+            return contenido
+
+        # Peticiones simultáneas de la misma imagen comparten una única descarga
+        return await self.descargas.ejecutar(clave, self._descargar, clave, image_url)
+
+    async def _descargar(self, clave, image_url):
+        contenido = await scryfall_client.descargar(image_url)
+        self.guardar(clave, contenido)
+        return contenido
+
+    def obtener_bloqueante(self, image_url, scryfall_id=None):
+        """Versión síncrona de obtener() para la interfaz de escritorio"""
+        clave = clave_imagen(image_url, scryfall_id)
+        contenido = self.leer(clave)
+        if contenido is None:
+            response = httpx.get(image_url, headers={"User-Agent": scryfall_client.CABECERAS["User-Agent"]}, timeout=scryfall_client.TIMEOUT)
+            response.raise_for_status()
+            contenido = response.content
+            self.guardar(clave, contenido)
+        return contenido
@@ -0,0 +1,70 @@
+﻿import os
+import time
+from collections import OrderedDict
+
+# Configuración por variables de entorno
+CACHE_TTL = int(os.getenv("CACHE_TTL_SEGUNDOS", "900"))
+CACHE_MAX_CARTAS = int(os.getenv("CACHE_MAX_CARTAS", "5000"))
+
+def normalizar_clave(nombre, edicion=None):
+    """Clave de caché: nombre y edición en minúsculas y sin espacios extra"""
+    nombre = " ".join(str(nombre).lower().split())
+    edicion = " ".join(str(edicion).lower().split()) if edicion else ""
+    return (nombre, edicion)
+
+class CachePrecios:
+    """Caché en memoria con expiración (TTL) y desalojo LRU"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entradas=CACHE_MAX_CARTAS):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, nombre, edicion=None):
+        """Devolver una copia del resultado si sigue vigente, o None"""
+        clave = normalizar_clave(nombre, edicion)
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+
+        expira, resultado = entrada
+        if expira < time.monotonic():
+            del self._datos[clave]
+            self.fallos += 1
+            return None
+
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return dict(resultado)
+
+    def guardar(self, nombre, edicion, resultado):
+        """Guardar un resultado y desalojar el menos usado si hace falta"""
+        clave = normalizar_clave(nombre, edicion)
+        self._datos[clave] = (time.monotonic() + self.ttl, dict(resultado))
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
+
+    def invalidar(self, nombre, edicion=None):
+        """Eliminar una entrada de la caché"""
+        self._datos.pop(normalizar_clave(nombre, edicion), None)
+
+    def limpiar(self):
+        """Vaciar la caché"""
+        self._datos.clear()
+
+    def estadisticas(self):
+        """Contadores de uso de la caché"""
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._datos),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "tasa_aciertos": (self.aciertos / total * 100) if total else 0.0
+        }
@@ -0,0 +1,132 @@
+﻿import os
+import asyncio
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+# Servicio de gráficos: matplotlib (API orientada a objetos, backend Agg) en un pool de procesos
+ESTILO = "dark_background"
+TAMANO = (12, 6)
+DPI = 150
+WORKERS = int(os.getenv("GRAFICOS_WORKERS", "2"))
+
+_pool = None
+_figuras = {}
+
+def _inicializar_worker():
+    """Configurar matplotlib una sola vez por proceso del pool"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.style
+    matplotlib.style.use(ESTILO)
+
+def _figura(tamano=TAMANO):
+    """Reutilizar la figura del proceso en lugar de crear una nueva por gráfico"""
+    from matplotlib.figure import Figure
+    fig = _figuras.get(tamano)
+    if fig is None:
+        fig = Figure(figsize=tamano)
+        _figuras[tamano] = fig
+    else:
+        fig.clf()
+    return fig
+
+def _png(fig):
+    """Exportar la figura a bytes PNG en memoria"""
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=DPI, bbox_inches="tight")
+    return buffer.getvalue()
+
+def _ejes_fecha(fig, ax):
+    """Formato común de los gráficos con fechas en el eje X"""
+    ax.grid(True, linestyle='--', alpha=0.5)
+    for etiqueta in ax.get_xticklabels():
+        etiqueta.set_rotation(45)
+        etiqueta.set_fontsize(10)
+    for etiqueta in ax.get_yticklabels():
+        etiqueta.set_fontsize(10)
+    fig.tight_layout()
+
+def historial(fechas, precios, titulo):
+    """Gráfico de evolución de precios"""
+    fig = _figura()
+    ax = fig.add_subplot()
+    ax.plot(fechas, precios, label="Precio Real", marker='o', color="#00ffcc", linewidth=2, markersize=6)
+    ax.set_title(titulo, fontsize=14, pad=20)
+    ax.set_xlabel("Fecha", fontsize=12)
+    ax.set_ylabel("Precio USD", fontsize=12)
+    ax.legend(loc='upper left')
+    _ejes_fecha(fig, ax)
+    return _png(fig)
+
+def prediccion(fechas, precios, titulo):
+    """Gráfico de predicción de precios futuros"""
+    fig = _figura()
+    ax = fig.add_subplot()
+    ax.plot(fechas, precios, 'r--', label="Predicción", linewidth=2)
+    ax.set_title(titulo, fontsize=14, pad=20)
+    ax.set_xlabel("Fecha", fontsize=12)
+    ax.set_ylabel("Precio Estimado", fontsize=12)
+    ax.legend(loc='upper left')
+    _ejes_fecha(fig, ax)
+    return _png(fig)
+
+def comparativo(series, titulo):
+    """Gráfico comparativo; `series` es una lista de (etiqueta, fechas, precios)"""
+    fig = _figura()
+    ax = fig.add_subplot()
+    for etiqueta, fechas, precios in series:
+        ax.plot(fechas, precios, label=etiqueta, marker='o', linewidth=2)
+    ax.set_title(titulo, fontsize=14, pad=20)
+    ax.set_xlabel("Fecha", fontsize=12)
+    ax.set_ylabel("Precio USD", fontsize=12)
+    ax.legend()
+    _ejes_fecha(fig, ax)
+    return _png(fig)
+
+def portafolio(fechas, valores, costes, titulo):
+    """Gráfico del valor del portafolio frente a lo invertido"""
+    fig = _figura()
+    ax = fig.add_subplot()
+    ax.plot(fechas, valores, label="Valor", color="#00ffcc", linewidth=2)
+    ax.plot(fechas, costes, label="Coste", color="#ff9933", linestyle="--", linewidth=1.5)
+    ax.fill_between(fechas, valores, costes, color="#00ffcc", alpha=0.1)
+    ax.set_title(titulo, fontsize=14, pad=20)
+    ax.set_xlabel("Fecha", fontsize=12)
+    ax.set_ylabel("USD", fontsize=12)
+    ax.legend(loc='upper left')
+    _ejes_fecha(fig, ax)
+    return _png(fig)
+
+def oportunidades(nombres, precios, cambios, titulo):
+    """Gráfico de dispersión: porcentaje de subida frente a precio"""
+    fig = _figura()
+    ax = fig.add_subplot()
+    scatter = ax.scatter(precios, cambios, s=100, c=cambios, cmap="viridis", alpha=0.9)
+    ax.set_title(titulo, fontsize=14, pad=20)
+    ax.set_xlabel("Precio Actual (USD)", fontsize=12)
+    ax.set_ylabel("Cambio (%)", fontsize=12)
+    ax.grid(True, linestyle='--', alpha=0.5)
+    for i, nombre in enumerate(nombres):
+        ax.text(precios[i], cambios[i], nombre, fontsize=9, ha='right')
+    fig.colorbar(scatter, ax=ax, label="Cambio (%)")
+    fig.tight_layout()
+    return _png(fig)
+
+def obtener_pool():
+    """Pool de procesos compartido para renderizar gráficos"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_inicializar_worker)
+    return _pool
+
+async def renderizar(funcion, *args):
+    """Renderizar un gráfico fuera del event loop y devolver los bytes PNG"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obtener_pool(), funcion, *args)
+
+def cerrar_pool():
+    """Detener los procesos del pool de gráficos"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,255 @@
+﻿import numpy as np
+
+# Indicadores técnicos por impresión: RSI de Wilder, SMA/EMA y volatilidad
+PERIODO_RSI = 14
+PERIODO_MEDIA = 20                    # observaciones de la SMA, la EMA y la volatilidad
+ALFA_EMA = 2 / (PERIODO_MEDIA + 1)
+ANCHO = PERIODO_MEDIA + 2             # últimos precios guardados (uno de reserva para reemplazar el último)
+LOTE_IN = 900
+LOTE_RECONSTRUIR = 5000               # impresiones por bloque al recalcular desde el historial
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS indicadores (
+    impresion_id INTEGER PRIMARY KEY REFERENCES impresiones (id),
+    n INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    media_ganancia REAL NOT NULL,
+    media_perdida REAL NOT NULL,
+    ema REAL NOT NULL,
+    media_ganancia_ant REAL NOT NULL,
+    media_perdida_ant REAL NOT NULL,
+    ema_ant REAL NOT NULL,
+    ventana BLOB NOT NULL,
+    rsi REAL,
+    sma REAL,
+    volatilidad REAL
+);
+'''
+
+# Estado incremental de cada impresión; *_ant es el estado previo a la última observación
+CAMPOS = ("n", "ts", "media_ganancia", "media_perdida", "ema",
+          "media_ganancia_ant", "media_perdida_ant", "ema_ant")
+
+# Valores para una carta sin historial suficiente
+SIN_DATOS = {"rsi": None, "sma": None, "ema": None, "volatilidad": None}
+
+def inicializar_esquema(conn):
+    """Crear la tabla de indicadores y calcularlos si ya hay historial de precios"""
+    conn.executescript(ESQUEMA)
+    vacia = conn.execute("SELECT 1 FROM indicadores LIMIT 1").fetchone() is None
+    if vacia and conn.execute("SELECT 1 FROM precios LIMIT 1").fetchone() is not None:
+        reconstruir(conn)
+        conn.commit()
+
+def _estado_vacio(k):
+    """Estado de k impresiones sin observaciones"""
+    estado = {campo: np.zeros(k) for campo in CAMPOS}
+    estado["n"] = np.zeros(k, dtype=np.int64)
+    estado["ts"] = np.zeros(k, dtype=np.int64)
+    estado["ventana"] = np.full((k, ANCHO), np.nan)
+    return estado
+
+def _paso(estado, pos, ts, precios):
+    """Añadir una observación a cada impresión de `pos` (posiciones sin repetir)
+
+    Una observación con el mismo ts que la última la reemplaza, restaurando
+    el estado anterior. Devuelve las posiciones con observaciones más antiguas
+    que el estado, que sólo se pueden incorporar recalculando desde el historial.
+    """
+    n = estado["n"][pos]
+    atrasadas = (n > 0) & (ts < estado["ts"][pos])
+    igual = (n > 0) & (ts == estado["ts"][pos])
+    if igual.any():
+        i = pos[igual]
+        for campo in ("media_ganancia", "media_perdida", "ema"):
+            estado[campo][i] = estado[campo + "_ant"][i]
+        ventana = estado["ventana"]
+        ventana[i, 1:] = ventana[i, :-1]
+        ventana[i, 0] = np.nan
+        estado["n"][i] -= 1
+
+    validas = ~atrasadas
+    pos, ts, precios = pos[validas], ts[validas], precios[validas]
+    n = estado["n"][pos]
+    for campo in ("media_ganancia", "media_perdida", "ema"):
+        estado[campo + "_ant"][pos] = estado[campo][pos]
+
+    # Medias de Wilder: media simple durante los primeros PERIODO_RSI cambios y
+    # después m = m + (x - m) / PERIODO_RSI; n es el número de cambios tras este paso
+    cambio = np.where(n > 0, precios - estado["ventana"][pos, -1], 0.0)
+    peso = np.maximum(np.minimum(n, PERIODO_RSI), 1)
+    for campo, valor in (("media_ganancia", np.maximum(cambio, 0)), ("media_perdida", np.maximum(-cambio, 0))):
+        media = estado[campo][pos]
+        estado[campo][pos] = np.where(n > 0, media + (valor - media) / peso, 0.0)
+
+    ema = estado["ema"][pos]
+    estado["ema"][pos] = np.where(n > 0, ema + ALFA_EMA * (precios - ema), precios)
+
+    ventana = estado["ventana"]
+    ventana[pos, :-1] = ventana[pos, 1:]
+    ventana[pos, -1] = precios
+    estado["n"][pos] = n + 1
+    estado["ts"][pos] = ts
+    return np.flatnonzero(atrasadas)
+
+def avanzar(estado, pos, ts, precios):
+    """Incorporar observaciones (pueden repetir impresión) en orden cronológico
+
+    Cada ronda aplica un paso vectorizado a todas las impresiones que tienen
+    una observación pendiente. Devuelve el set de posiciones atrasadas.
+    """
+    orden = np.lexsort((ts, pos))
+    pos, ts, precios = pos[orden], ts[orden], precios[orden]
+    inicio_grupo = np.flatnonzero(np.r_[True, pos[1:] != pos[:-1]])
+    rango = np.arange(len(pos)) - np.repeat(inicio_grupo, np.diff(np.r_[inicio_grupo, len(pos)]))
+
+    atrasadas = set()
+    for ronda in range(int(rango.max()) + 1 if len(rango) else 0):
+        sel = rango == ronda
+        atrasadas.update(pos[sel][_paso(estado, pos[sel], ts[sel], precios[sel])].tolist())
+    return atrasadas
+
+def derivar(estado):
+    """RSI, SMA, EMA y volatilidad (% por observación) de cada impresión; NaN si no hay datos suficientes"""
+    n = estado["n"]
+    ganancia, perdida = estado["media_ganancia"], estado["media_perdida"]
+    total = ganancia + perdida
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rsi = np.where(total > 0, 100 * ganancia / total, 50.0)
+    rsi = np.where(n > PERIODO_RSI, rsi, np.nan)
+
+    ultimos = estado["ventana"][:, -PERIODO_MEDIA:]
+    sma = np.where(n >= PERIODO_MEDIA, ultimos.mean(axis=1), np.nan)
+    ema = np.where(n > 0, estado["ema"], np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ventana = estado["ventana"][:, -(PERIODO_MEDIA + 1):]
+        retornos = np.diff(np.log(np.where(ventana > 0, ventana, np.nan)), axis=1)
+        validos = ~np.isnan(retornos)
+        cuenta = validos.sum(axis=1)
+        media = np.where(validos, retornos, 0).sum(axis=1) / cuenta
+        varianza = np.where(validos, (retornos - media[:, None]) ** 2, 0).sum(axis=1) / (cuenta - 1)
+    volatilidad = np.where(cuenta >= 2, np.sqrt(varianza) * 100, np.nan)
+    return rsi, sma, ema, volatilidad
+
+def _cargar_estado(conn, impresion_ids):
+    """Estado guardado de las impresiones indicadas (vacío para las que no lo tienen)"""
+    estado = _estado_vacio(len(impresion_ids))
+    posiciones = {impresion_id: i for i, impresion_id in enumerate(impresion_ids)}
+    for i in range(0, len(impresion_ids), LOTE_IN):
+        lote = impresion_ids[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for fila in conn.execute(f'''
+                SELECT impresion_id, {", ".join(CAMPOS)}, ventana
+                FROM indicadores WHERE impresion_id IN ({marcadores})''', lote):
+            p = posiciones[fila[0]]
+            for campo, valor in zip(CAMPOS, fila[1:-1]):
+                estado[campo][p] = valor
+            estado["ventana"][p] = np.frombuffer(fila[-1], dtype=np.float64)
+    return estado
+
+def _nulo(valor):
+    return None if np.isnan(valor) else round(float(valor), 4)
+
+def _guardar_estado(conn, impresion_ids, estado):
+    """Escribir el estado y los indicadores derivados (sin commit)"""
+    rsi, sma, ema, volatilidad = derivar(estado)
+    columnas = [estado[campo].tolist() for campo in CAMPOS]
+    ventanas = estado["ventana"]
+    filas = (
+        (impresion_id, *(columna[i] for columna in columnas), ventanas[i].tobytes(),
+         _nulo(rsi[i]), _nulo(sma[i]), _nulo(volatilidad[i]))
+        for i, impresion_id in enumerate(impresion_ids)
+    )
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO indicadores
+            (impresion_id, {", ".join(CAMPOS)}, ventana, rsi, sma, volatilidad)
+        VALUES ({",".join("?" * (len(CAMPOS) + 5))})
+    ''', filas)
+
+def actualizar(conn, filas):
+    """Actualizar el estado con nuevas observaciones [(impresion_id, ts, precio)] (sin commit)
+
+    Coste O(1) por observación: sólo se lee y escribe la fila de estado de cada
+    impresión. Las observaciones anteriores al estado se recalculan desde el historial.
+    """
+    if not filas:
+        return
+    ids, ts, precios = zip(*filas)
+    impresion_ids = list(dict.fromkeys(ids))
+    posiciones = {impresion_id: i for i, impresion_id in enumerate(impresion_ids)}
+    estado = _cargar_estado(conn, impresion_ids)
+    atrasadas = avanzar(estado, np.fromiter((posiciones[i] for i in ids), dtype=np.int64, count=len(ids)),
+                        np.asarray(ts, dtype=np.int64), np.asarray(precios, dtype=np.float64))
+    _guardar_estado(conn, impresion_ids, estado)
+    if atrasadas:
+        reconstruir(conn, [impresion_ids[p] for p in atrasadas])
+
+def _reconstruir_bloque(conn, filas):
+    """Recalcular el estado desde filas (impresion_id, ts, precio, repeticiones, ts visto)
+
+    Cada fila cuenta 1 + repeticiones veces, como las observaciones iguales
+    que se verificaron sin guardar otra fila. Las observaciones se numeran en
+    orden para que las repeticiones no se tomen por reemplazos de la misma,
+    y el ts del estado es el último en que se vio cada precio.
+    """
+    if not filas:
+        return
+    ids, ts, precios, repeticiones, visto = (np.asarray(columna) for columna in zip(*filas))
+    unicos, pos = np.unique(ids, return_inverse=True)
+    ultimo = np.zeros(len(unicos), dtype=np.int64)
+    np.maximum.at(ultimo, pos, visto.astype(np.int64))
+
+    orden = np.lexsort((ts, ids))
+    veces = repeticiones[orden].astype(np.int64) + 1
+    pos, precios = np.repeat(pos[orden], veces), np.repeat(precios[orden], veces)
+    estado = _estado_vacio(len(unicos))
+    avanzar(estado, pos.astype(np.int64), np.arange(len(pos), dtype=np.int64), precios.astype(np.float64))
+    estado["ts"] = ultimo
+    _guardar_estado(conn, unicos.tolist(), estado)
+
+def reconstruir(conn, impresion_ids=None):
+    """Recalcular los indicadores desde el historial de precios (todas o las impresiones indicadas, sin commit)"""
+    if impresion_ids is None:
+        conn.execute("DELETE FROM indicadores")
+        ids = [fila[0] for fila in conn.execute("SELECT id FROM impresiones ORDER BY id")]
+    else:
+        ids = sorted(set(impresion_ids))
+
+    for i in range(0, len(ids), LOTE_RECONSTRUIR):
+        bloque = ids[i:i + LOTE_RECONSTRUIR]
+        filas = []
+        for j in range(0, len(bloque), LOTE_IN):
+            lote = bloque[j:j + LOTE_IN]
+            marcadores = ",".join("?" * len(lote))
+            filas.extend(conn.execute(f'''
+                SELECT p.impresion_id, p.ts, p.precio, p.repeticiones, MAX(p.ts, COALESCE(v.ts, 0))
+                FROM precios p LEFT JOIN verificaciones v ON v.impresion_id = p.impresion_id
+                WHERE p.impresion_id IN ({marcadores})''', lote))
+        _reconstruir_bloque(conn, filas)
+
+def _valores(fila):
+    if fila is None:
+        return dict(SIN_DATOS)
+    rsi, sma, ema, volatilidad, n = fila
+    return {
+        "rsi": None if rsi is None else round(rsi, 1),
+        "sma": None if sma is None else round(sma, 2),
+        "ema": round(ema, 2) if n else None,
+        "volatilidad": None if volatilidad is None else round(volatilidad, 2)
+    }
+
+def valores(conn, impresion_id):
+    """Indicadores ya calculados de una impresión: {"rsi", "sma", "ema", "volatilidad"}"""
+    return _valores(conn.execute("SELECT rsi, sma, ema, volatilidad, n FROM indicadores WHERE impresion_id = ?",
+                                 (impresion_id,)).fetchone())
+
+def valores_por_scryfall(conn, scryfall_id):
+    """Igual que valores(), buscando la impresión por su id de Scryfall"""
+    if not scryfall_id:
+        return dict(SIN_DATOS)
+    return _valores(conn.execute('''
+        SELECT d.rsi, d.sma, d.ema, d.volatilidad, d.n
+        FROM impresiones i JOIN indicadores d ON d.impresion_id = i.id
+        WHERE i.scryfall_id = ?
+    ''', (scryfall_id,)).fetchone())
@@ -0,0 +1,212 @@
+﻿import re
+import bisect
+import unicodedata
+import heapq
+from functools import lru_cache
+from collections import Counter
+from itertools import chain
+
+# Distancia de edición máxima admitida: 1 error cada 4 caracteres (mínimo 1)
+LETRAS_POR_ERROR = 4
+MAX_CANDIDATOS = 20  # nombres que se verifican con distancia de edición
+
+def normalizar(texto):
+    """Minúsculas, sin tildes ni signos de puntuación ("Urza's Saga" -> "urzas saga")"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"['’]", "", texto)
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texto).split())
+
+@lru_cache(maxsize=4096)
+def _palabras_edicion(edicion):
+    """Palabras normalizadas del nombre de una edición (hay pocas ediciones distintas)"""
+    return normalizar(edicion or "").split()
+
+def trigramas(texto):
+    """Trigramas de un texto normalizado, con relleno para puntuar principio y fin"""
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def distancia_edicion(a, b, maximo):
+    """Distancia de Levenshtein acotada: devuelve maximo + 1 en cuanto se supera"""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+class IndiceNombres:
+    """Índice local de nombres de carta y ediciones construido desde la tabla impresiones
+
+    - Array ordenado de nombres normalizados para autocompletar por prefijo.
+    - Índice de trigramas + distancia de edición para sugerir nombres con erratas.
+    - Impresiones de cada nombre para reconocer la edición al final de la consulta.
+
+    Sólo contiene las cartas ya guardadas, así que resolver() no corrige
+    erratas: un nombre que no está puede ser una carta real que aún no se ha
+    consultado. Las correcciones se ofrecen como sugerencias.
+    """
+
+    def __init__(self):
+        self._ordenados = []    # nombres normalizados, ordenados (búsqueda por prefijo)
+        self._nombres = {}      # normalizado -> nombre original
+        self._trigramas = {}    # trigrama -> set de nombres normalizados
+        self._impresiones = {}  # normalizado -> [(impresion_id, edicion, coleccion, scryfall_id)]
+
+    @classmethod
+    def desde_db(cls, conn):
+        """Construir el índice con todas las impresiones conocidas"""
+        indice = cls()
+        filas = conn.execute("SELECT id, nombre, edicion, coleccion, scryfall_id FROM impresiones ORDER BY nombre")
+        nombre_anterior = clave = None
+        for impresion_id, nombre, edicion, coleccion, scryfall_id in filas:
+            if nombre != nombre_anterior:
+                nombre_anterior, clave = nombre, normalizar(nombre)
+            indice._agregar(clave, impresion_id, nombre, edicion, coleccion, scryfall_id)
+        indice._ordenados.sort()
+        return indice
+
+    def _agregar(self, clave, impresion_id, nombre, edicion, coleccion, scryfall_id):
+        if not clave:
+            return False
+        nuevo = clave not in self._nombres
+        if nuevo:
+            self._nombres[clave] = nombre
+            self._ordenados.append(clave)
+            for trigrama in trigramas(clave):
+                self._trigramas.setdefault(trigrama, set()).add(clave)
+        impresiones = self._impresiones.setdefault(clave, [])
+        if all(fila[0] != impresion_id for fila in impresiones):
+            impresiones.append((impresion_id, edicion, coleccion, scryfall_id))
+        return nuevo
+
+    def agregar(self, impresion_id, nombre, edicion, coleccion, scryfall_id=None):
+        """Añadir una impresión recién registrada sin reconstruir el índice"""
+        clave = normalizar(nombre)
+        if self._agregar(clave, impresion_id, nombre, edicion, coleccion, scryfall_id):
+            self._ordenados.pop()
+            bisect.insort(self._ordenados, clave)
+
+    def __len__(self):
+        return len(self._nombres)
+
+    def autocompletar(self, prefijo, limite=10):
+        """Nombres que empiezan por el prefijo, en orden alfabético"""
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+        inicio = bisect.bisect_left(self._ordenados, prefijo)
+        resultados = []
+        for clave in self._ordenados[inicio:inicio + limite]:
+            if not clave.startswith(prefijo):
+                break
+            resultados.append(self._nombres[clave])
+        return resultados
+
+    def _candidatos(self, clave, maximo=None):
+        """Nombres que comparten más trigramas con la consulta
+
+        Cada error de tecleo altera como mucho 3 trigramas, así que un nombre a
+        distancia <= maximo comparte al menos uno de los 3 * maximo + 1 trigramas
+        menos frecuentes de la consulta: basta con recorrer esas listas.
+        """
+        consulta = trigramas(clave)
+        listas = sorted((self._trigramas.get(t, ()) for t in consulta), key=len)
+        if maximo is not None:
+            listas = listas[:3 * maximo + 1]
+        votos = Counter(chain.from_iterable(listas))
+        return heapq.nlargest(MAX_CANDIDATOS, votos, key=votos.get)
+
+    def _mas_cercano(self, clave):
+        """Nombre normalizado más cercano dentro de la tolerancia (distinto de la consulta), o None"""
+        maximo = max(1, len(clave) // LETRAS_POR_ERROR)
+        mejor = None
+        for candidato in self._candidatos(clave, maximo):
+            distancia = distancia_edicion(clave, candidato, maximo)
+            if 0 < distancia <= maximo and (mejor is None or (distancia, candidato) < mejor):
+                mejor = (distancia, candidato)
+        return mejor[1] if mejor else None
+
+    def sugerencias(self, consulta, limite=5):
+        """Nombres parecidos a la consulta ("¿quizás buscabas...?")
+
+        Primero el más cercano por distancia de edición, después los que
+        empiezan por la consulta y por último los que más trigramas comparten.
+        """
+        clave = normalizar(consulta)
+        if not clave:
+            return []
+        cercano = self._mas_cercano(clave)
+        resultados = [self._nombres[cercano]] if cercano else []
+        for nombre in self.autocompletar(clave, limite):
+            if len(resultados) < limite and nombre not in resultados:
+                resultados.append(nombre)
+        for candidato in self._candidatos(clave):
+            if len(resultados) >= limite:
+                break
+            if self._nombres[candidato] not in resultados:
+                resultados.append(self._nombres[candidato])
+        return resultados
+
+    def _impresion_por_edicion(self, clave, palabras_edicion):
+        """Impresión del nombre cuya edición encaja con las palabras indicadas
+
+        Encaja si las palabras son el código de la colección ("lea") o si cada
+        una es el principio de alguna palabra del nombre de la edición ("alpha"
+        -> "Limited Edition Alpha").
+        """
+        consulta = " ".join(palabras_edicion)
+        for impresion in self._impresiones.get(clave, ()):
+            _, edicion, coleccion, _ = impresion
+            if coleccion and coleccion.lower() == consulta:
+                return impresion
+            palabras = _palabras_edicion(edicion)
+            if palabras and all(any(p.startswith(q) for p in palabras) for q in palabras_edicion):
+                return impresion
+        return None
+
+    def resolver(self, consulta):
+        """Resolver "nombre [edición]" a una carta guardada sin salir a la red
+
+        El nombre tiene que coincidir exactamente (sin contar mayúsculas,
+        tildes ni signos). Devuelve un dict con nombre, edicion, coleccion,
+        impresion_id y scryfall_id (los cuatro últimos a None si no se
+        reconoce la edición), o None si no es el nombre de una carta guardada.
+        """
+        palabras = normalizar(consulta).split()
+        if not palabras:
+            return None
+        completo = " ".join(palabras)
+
+        # Si la consulta no es un nombre exacto, probar primero los cortes más
+        # largos del nombre que dejan una edición reconocible al final
+        for corte in range(len(palabras) - 1 if completo not in self._nombres else 0, 0, -1):
+            clave = " ".join(palabras[:corte])
+            if clave not in self._nombres:
+                continue
+            impresion = self._impresion_por_edicion(clave, palabras[corte:])
+            if impresion is not None:
+                impresion_id, edicion, coleccion, scryfall_id = impresion
+                return {
+                    "nombre": self._nombres[clave],
+                    "edicion": edicion,
+                    "coleccion": coleccion,
+                    "impresion_id": impresion_id,
+                    "scryfall_id": scryfall_id
+                }
+
+        if completo not in self._nombres:
+            return None
+        return {
+            "nombre": self._nombres[completo],
+            "edicion": None,
+            "coleccion": None,
+            "impresion_id": None,
+            "scryfall_id": None
+        }
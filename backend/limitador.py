@@ -0,0 +1,185 @@
+﻿import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+
+# Scryfall pide no superar ~10 peticiones por segundo a api.scryfall.com
+TASA_SCRYFALL = float(os.getenv("SCRYFALL_PETICIONES_SEGUNDO", "10"))
+
+# Prioridades: cuanto menor, antes se atiende
+INTERACTIVA = 0  # comandos de usuarios
+FONDO = 1        # trabajos programados, precarga de caché...
+
+MAX_REINTENTOS = 4
+ESPERA_BASE = 0.5  # segundos, se duplica en cada reintento
+ESPERA_MAX = 30.0
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+class LimiteExcedido(Exception):
+    """Scryfall sigue respondiendo 429 después de agotar los reintentos"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("Límite de peticiones de Scryfall excedido")
+        self.retry_after = retry_after
+
+def leer_retry_after(response):
+    """Segundos indicados en la cabecera Retry-After (número o fecha HTTP), o None"""
+    valor = response.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def espera_reintento(intento, retry_after=None):
+    """Retry-After si el servidor lo indica; si no, espera exponencial con jitter completo"""
+    if retry_after is not None:
+        return min(retry_after, ESPERA_MAX)
+    return random.uniform(0, min(ESPERA_MAX, ESPERA_BASE * 2 ** intento))
+
+class LimitadorTokens:
+    """Cubo de tokens asíncrono con cola de prioridad, compartido por todas las peticiones
+
+    Las peticiones que no encuentran token esperan en un heap ordenado por
+    (prioridad, llegada): una consulta interactiva adelanta a las de fondo.
+    """
+
+    def __init__(self, tasa=TASA_SCRYFALL, capacidad=None):
+        self.tasa = tasa
+        self.capacidad = capacidad or tasa
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._cola = []
+        self._turno = itertools.count()
+        self._despachador = None
+        self.peticiones = 0
+        self.esperas = 0
+        self.reintentos = 0
+        self.limitadas = 0
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def pausar(self, segundos):
+        """Dejar de emitir tokens durante unos segundos (p. ej. tras un Retry-After)"""
+        self._recargar()
+        # Un saldo negativo se recupera a ritmo `tasa`: equivale a una pausa global
+        self._tokens = min(self._tokens, -segundos * self.tasa)
+
+    async def adquirir(self, prioridad=INTERACTIVA):
+        """Esperar un token; con cola pendiente se respeta el orden de prioridad"""
+        self._recargar()
+        if not self._cola and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        self.esperas += 1
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._cola, (prioridad, next(self._turno), futuro))
+        if self._despachador is None or self._despachador.done():
+            self._despachador = asyncio.ensure_future(self._despachar())
+        await futuro
+
+    async def _despachar(self):
+        while self._cola:
+            self._recargar()
+            while self._cola and self._tokens >= 1:
+                _, _, futuro = heapq.heappop(self._cola)
+                # Las esperas canceladas no consumen token
+                if not futuro.done():
+                    futuro.set_result(None)
+                    self._tokens -= 1
+            if self._cola:
+                await asyncio.sleep((1 - self._tokens) / self.tasa)
+
+    async def ejecutar(self, peticion, prioridad=INTERACTIVA):
+        """Lanzar peticion() respetando el límite y reintentando 429/5xx con backoff
+
+        `peticion` es una función sin argumentos que devuelve la corrutina de la
+        petición HTTP. Lanza LimiteExcedido si el 429 persiste.
+        """
+        for intento in range(MAX_REINTENTOS + 1):
+            await self.adquirir(prioridad)
+            self.peticiones += 1
+            response = await peticion()
+            if response.status_code not in ESTADOS_REINTENTABLES:
+                return response
+
+            retry_after = leer_retry_after(response)
+            if response.status_code == 429:
+                self.limitadas += 1
+            if intento == MAX_REINTENTOS:
+                break
+            self.reintentos += 1
+            if response.status_code == 429:
+                # Pausa global: el resto de peticiones también esperan al adquirir token
+                self.pausar(espera_reintento(intento, retry_after))
+            else:
+                await asyncio.sleep(espera_reintento(intento, retry_after))
+
+        if response.status_code == 429:
+            raise LimiteExcedido(retry_after)
+        return response
+
+    def estadisticas(self):
+        """Métricas del limitador"""
+        return {
+            "peticiones": self.peticiones,
+            "esperas": self.esperas,
+            "reintentos": self.reintentos,
+            "limitadas": self.limitadas,
+            "en_cola": len(self._cola)
+        }
+
+class LimitadorBloqueante:
+    """Versión síncrona para scripts y la interfaz de escritorio (requests)"""
+
+    def __init__(self, tasa=TASA_SCRYFALL):
+        self.tasa = tasa
+        self._siguiente = 0.0
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloquear hasta que toque la siguiente petición"""
+        with self._lock:
+            ahora = time.monotonic()
+            espera = self._siguiente - ahora
+            self._siguiente = max(ahora, self._siguiente) + 1 / self.tasa
+        if espera > 0:
+            time.sleep(espera)
+
+    def pausar(self, segundos):
+        """Retrasar todas las peticiones siguientes"""
+        with self._lock:
+            self._siguiente = max(self._siguiente, time.monotonic() + segundos)
+
+    def ejecutar(self, peticion):
+        """Igual que LimitadorTokens.ejecutar, con peticion() síncrona"""
+        for intento in range(MAX_REINTENTOS + 1):
+            self.adquirir()
+            response = peticion()
+            if response.status_code not in ESTADOS_REINTENTABLES:
+                return response
+
+            retry_after = leer_retry_after(response)
+            if intento == MAX_REINTENTOS:
+                break
+            if response.status_code == 429:
+                self.pausar(espera_reintento(intento, retry_after))
+            else:
+                time.sleep(espera_reintento(intento, retry_after))
+
+        if response.status_code == 429:
+            raise LimiteExcedido(retry_after)
+        return response
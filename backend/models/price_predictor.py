@@ -0,0 +1,227 @@
+﻿import numpy as np
+
+# Predicción de precios: suavizado exponencial de Holt con tendencia amortiguada sobre precios diarios
+DIA = 86400
+ALFAS = (0.1, 0.2, 0.3, 0.5, 0.7, 0.9)     # suavizado del nivel
+BETAS = (0.01, 0.05, 0.1, 0.2, 0.3)        # suavizado de la tendencia
+AMORTIGUACION = 0.98                       # la tendencia se apaga poco a poco en horizontes largos
+ALFA_DEFECTO, BETA_DEFECTO = 0.3, 0.05     # mientras no haya días suficientes para ajustar
+MIN_DIAS = 7                               # días con precio necesarios para ajustar y predecir
+MAX_DIAS_AJUSTE = 365                      # historial usado al ajustar
+REAJUSTE = 30                              # días nuevos antes de volver a elegir alfa y beta
+MAX_HUECO = 90                             # días sin precio que se rellenan con el último conocido
+HORIZONTES = 6                             # predicciones mensuales
+DIAS_HORIZONTE = 30
+PRECIO_MINIMO = 0.01
+LOTE_IN = 900
+LOTE_AJUSTE = 5000                         # impresiones por bloque al ajustar
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS predicciones (
+    impresion_id INTEGER PRIMARY KEY REFERENCES impresiones (id),
+    alfa REAL NOT NULL,
+    beta REAL NOT NULL,
+    nivel REAL NOT NULL,
+    tendencia REAL NOT NULL,
+    nivel_ant REAL NOT NULL,
+    tendencia_ant REAL NOT NULL,
+    dia INTEGER NOT NULL,
+    precio REAL NOT NULL,
+    n INTEGER NOT NULL,
+    n_ajuste INTEGER NOT NULL
+);
+'''
+
+CAMPOS = ("alfa", "beta", "nivel", "tendencia", "nivel_ant", "tendencia_ant", "dia", "precio", "n", "n_ajuste")
+
+def inicializar_esquema(conn):
+    """Crear la tabla de parámetros y ajustarlos si ya hay historial de precios"""
+    conn.executescript(ESQUEMA)
+    vacia = conn.execute("SELECT 1 FROM predicciones LIMIT 1").fetchone() is None
+    if vacia and conn.execute("SELECT 1 FROM precios LIMIT 1").fetchone() is not None:
+        ajustar(conn)
+        conn.commit()
+
+def _paso(nivel, tendencia, alfa, beta, precio):
+    """Un día de Holt amortiguado; funciona con escalares o arrays"""
+    prevision = nivel + AMORTIGUACION * tendencia
+    nuevo = alfa * precio + (1 - alfa) * prevision
+    return nuevo, beta * (nuevo - nivel) + (1 - beta) * AMORTIGUACION * tendencia
+
+def _matriz_diaria(filas):
+    """Series diarias (último precio de cada día, huecos rellenados) de las filas (impresion_id, ts, precio)
+
+    Devuelve (ids, matriz, primero, ultimo_dia): una fila por impresión y una
+    columna por día, alineadas a la derecha en el último día con precio de cada
+    una; primero es la columna de su primer precio (NaN antes).
+    """
+    ids, ts, precios = (np.asarray(columna) for columna in zip(*filas))
+    dias = ts.astype(np.int64) // DIA
+    orden = np.lexsort((ts, ids))
+    ids, dias, precios = ids[orden], dias[orden], precios[orden].astype(np.float64)
+    # Si un día tiene varios precios queda el último
+    ultimo_del_dia = np.r_[(ids[1:] != ids[:-1]) | (dias[1:] != dias[:-1]), True]
+    ids, dias, precios = ids[ultimo_del_dia], dias[ultimo_del_dia], precios[ultimo_del_dia]
+
+    unicos, fila = np.unique(ids, return_inverse=True)
+    ultimo_dia = np.full(len(unicos), dias.min())
+    primer_dia = np.full(len(unicos), dias.max())
+    np.maximum.at(ultimo_dia, fila, dias)
+    np.minimum.at(primer_dia, fila, dias)
+    ancho = int(min(MAX_DIAS_AJUSTE, (ultimo_dia - primer_dia).max() + 1))
+    columna = dias - ultimo_dia[fila] + ancho - 1
+    recientes = columna >= 0
+
+    matriz = np.full((len(unicos), ancho), np.nan)
+    matriz[fila[recientes], columna[recientes]] = precios[recientes]
+    columnas = np.where(~np.isnan(matriz), np.arange(ancho), -1)
+    np.maximum.accumulate(columnas, axis=1, out=columnas)
+    primero = np.argmax(columnas >= 0, axis=1)
+    matriz = np.where(columnas >= 0, matriz[np.arange(len(unicos))[:, None], np.maximum(columnas, 0)], np.nan)
+    return unicos, matriz, primero, ultimo_dia
+
+def _ajustar_bloque(conn, filas):
+    """Elegir alfa y beta por impresión minimizando el error a un día, todas a la vez"""
+    if not filas:
+        return
+    ids, matriz, primero, ultimo_dia = _matriz_diaria(filas)
+    alfa, beta = (np.asarray(v, dtype=np.float64).ravel() for v in np.meshgrid(ALFAS, BETAS))
+    k, g = len(ids), len(alfa)
+
+    nivel = np.zeros((k, g))
+    tendencia = np.zeros((k, g))
+    nivel_ant = np.zeros((k, g))
+    tendencia_ant = np.zeros((k, g))
+    error = np.zeros((k, g))
+    for t in range(matriz.shape[1]):
+        precio = matriz[:, t][:, None]
+        inicio = (primero == t)[:, None]
+        activo = ~np.isnan(precio) & ~inicio
+        nivel = np.where(inicio, precio, nivel)
+        nuevo_nivel, nueva_tendencia = _paso(nivel, tendencia, alfa, beta, precio)
+        error += np.where(activo, (precio - nivel - AMORTIGUACION * tendencia) ** 2, 0)
+        nivel_ant = np.where(activo, nivel, nivel_ant)
+        tendencia_ant = np.where(activo, tendencia, tendencia_ant)
+        nivel = np.where(activo, nuevo_nivel, nivel)
+        tendencia = np.where(activo, nueva_tendencia, tendencia)
+
+    dias = matriz.shape[1] - primero
+    defecto = np.flatnonzero((alfa == ALFA_DEFECTO) & (beta == BETA_DEFECTO))[0]
+    mejor = np.where(dias >= MIN_DIAS, np.argmin(error, axis=1), defecto)
+    filas_k = np.arange(k)
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO predicciones (impresion_id, {", ".join(CAMPOS)})
+        VALUES ({",".join("?" * (len(CAMPOS) + 1))})
+    ''', zip(ids.tolist(), alfa[mejor].tolist(), beta[mejor].tolist(),
+             nivel[filas_k, mejor].tolist(), tendencia[filas_k, mejor].tolist(),
+             nivel_ant[filas_k, mejor].tolist(), tendencia_ant[filas_k, mejor].tolist(),
+             ultimo_dia.tolist(), matriz[:, -1].tolist(), dias.tolist(), dias.tolist()))
+
+def ajustar(conn, impresion_ids=None):
+    """Ajustar los parámetros desde el historial (todas o las impresiones indicadas, sin commit)
+
+    Una verificación posterior a la última fila cuenta como otra observación
+    del último precio, así que la serie diaria llega hasta ella.
+    """
+    if impresion_ids is None:
+        conn.execute("DELETE FROM predicciones")
+        ids = [fila[0] for fila in conn.execute("SELECT id FROM impresiones ORDER BY id")]
+    else:
+        ids = sorted(set(impresion_ids))
+
+    for i in range(0, len(ids), LOTE_AJUSTE):
+        bloque = ids[i:i + LOTE_AJUSTE]
+        filas = []
+        for j in range(0, len(bloque), LOTE_IN):
+            lote = bloque[j:j + LOTE_IN]
+            marcadores = ",".join("?" * len(lote))
+            filas.extend(conn.execute(f'''
+                SELECT impresion_id, ts, precio FROM precios WHERE impresion_id IN ({marcadores})
+                UNION ALL
+                SELECT v.impresion_id, v.ts, p.precio
+                FROM verificaciones v JOIN precios p ON p.impresion_id = v.impresion_id
+                WHERE v.impresion_id IN ({marcadores}) AND v.ts > p.ts
+                  AND p.ts = (SELECT MAX(ts) FROM precios WHERE impresion_id = v.impresion_id)''', lote + lote))
+        _ajustar_bloque(conn, filas)
+
+def actualizar(conn, filas):
+    """Incorporar nuevas observaciones [(impresion_id, ts, precio)] al estado guardado (sin commit)
+
+    Cada día nuevo es un paso de Holt con los parámetros ya ajustados; los
+    parámetros se vuelven a elegir cada REAJUSTE días, al ver una impresión por
+    primera vez o si llega un precio anterior al último día incorporado.
+    """
+    if not filas:
+        return
+    por_impresion = {}
+    for impresion_id, ts, precio in sorted(filas, key=lambda fila: fila[1]):
+        por_impresion.setdefault(impresion_id, {})[ts // DIA] = precio
+
+    estados = {}
+    ids = list(por_impresion)
+    for i in range(0, len(ids), LOTE_IN):
+        lote = ids[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for fila in conn.execute(
+                f"SELECT impresion_id, {', '.join(CAMPOS)} FROM predicciones WHERE impresion_id IN ({marcadores})", lote):
+            estados[fila[0]] = dict(zip(CAMPOS, fila[1:]))
+
+    reajustar = []
+    actualizados = []
+    for impresion_id, dias in por_impresion.items():
+        e = estados.get(impresion_id)
+        if e is None or min(dias) < e["dia"]:
+            reajustar.append(impresion_id)
+            continue
+        for dia, precio in sorted(dias.items()):
+            if dia == e["dia"] and e["n"] <= 1:
+                # Sólo hay un día: el nivel es el propio precio
+                e["nivel"], e["tendencia"] = precio, 0.0
+            else:
+                if dia == e["dia"]:
+                    # Otro precio del mismo día: rehacer el último paso
+                    e["nivel"], e["tendencia"] = e["nivel_ant"], e["tendencia_ant"]
+                else:
+                    for _ in range(min(dia - e["dia"] - 1, MAX_HUECO)):
+                        e["nivel"], e["tendencia"] = _paso(e["nivel"], e["tendencia"], e["alfa"], e["beta"], e["precio"])
+                        e["n"] += 1
+                    e["n"] += 1
+                e["nivel_ant"], e["tendencia_ant"] = e["nivel"], e["tendencia"]
+                e["nivel"], e["tendencia"] = _paso(e["nivel"], e["tendencia"], e["alfa"], e["beta"], precio)
+            e["dia"], e["precio"] = dia, precio
+        if e["n"] - e["n_ajuste"] >= REAJUSTE or (e["n_ajuste"] < MIN_DIAS <= e["n"]):
+            reajustar.append(impresion_id)
+        else:
+            actualizados.append((impresion_id, *(e[campo] for campo in CAMPOS)))
+
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO predicciones (impresion_id, {", ".join(CAMPOS)})
+        VALUES ({",".join("?" * (len(CAMPOS) + 1))})
+    ''', actualizados)
+    if reajustar:
+        ajustar(conn, reajustar)
+
+def _prevision(fila):
+    if fila is None:
+        return None
+    nivel, tendencia, n = fila
+    if n < MIN_DIAS:
+        return None
+    h = np.arange(1, HORIZONTES + 1) * DIAS_HORIZONTE
+    amortiguada = AMORTIGUACION * (1 - AMORTIGUACION ** h) / (1 - AMORTIGUACION)
+    return np.round(np.maximum(nivel + amortiguada * tendencia, PRECIO_MINIMO), 2).tolist()
+
+def prediccion(conn, impresion_id):
+    """Precios previstos a 30, 60... 180 días, o None si no hay historial suficiente"""
+    return _prevision(conn.execute("SELECT nivel, tendencia, n FROM predicciones WHERE impresion_id = ?",
+                                   (impresion_id,)).fetchone())
+
+def prediccion_por_scryfall(conn, scryfall_id):
+    """Igual que prediccion(), buscando la impresión por su id de Scryfall"""
+    if not scryfall_id:
+        return None
+    return _prevision(conn.execute('''
+        SELECT p.nivel, p.tendencia, p.n
+        FROM impresiones i JOIN predicciones p ON p.impresion_id = i.id
+        WHERE i.scryfall_id = ?
+    ''', (scryfall_id,)).fetchone())
@@ -0,0 +1,69 @@
+﻿import time
+import numpy as np
+from backend import precios_db
+
+# Ventanas de tiempo soportadas (en segundos)
+VENTANAS = precios_db.VENTANAS
+
+def cargar_arrays(conn, ventana, desde_ts):
+    """Cargar las filas materializadas de precios_actuales como arrays de NumPy
+
+    Devuelve (ids, inicio, fin, nombres, ediciones); nombres y ediciones son
+    diccionarios impresion_id -> texto.
+    """
+    filas = precios_db.cargar_actuales(conn, ventana, desde_ts)
+    if not filas:
+        vacio = np.empty(0)
+        return vacio.astype(np.int64), vacio, vacio, {}, {}
+
+    ids, nombres_col, ediciones_col, fin, inicio = zip(*filas)
+    nombres = dict(zip(ids, nombres_col))
+    ediciones = dict(zip(ids, ediciones_col))
+    return (np.asarray(ids, dtype=np.int64), np.asarray(inicio, dtype=np.float64),
+            np.asarray(fin, dtype=np.float64), nombres, ediciones)
+
+def calcular_cambios(ids, inicio, fin):
+    """Cambio porcentual entre el precio de referencia y el último precio
+
+    Descarta las impresiones con algún precio no positivo.
+    """
+    validos = (inicio > 0) & (fin > 0)
+    ids, inicio, fin = ids[validos], inicio[validos], fin[validos]
+    return ids, inicio, fin, (fin - inicio) / inicio * 100
+
+def rankear(ids, inicio, fin, cambio, nombres, ediciones, umbral=0.5, limite=None):
+    """Filtrar por umbral, ordenar por subida y quedarse con la mejor impresión de cada nombre"""
+    seleccion = np.flatnonzero(cambio >= umbral)
+    orden = seleccion[np.argsort(-cambio[seleccion], kind="stable")]
+
+    # Eliminar duplicados por nombre: como ya está ordenado, basta con la primera aparición
+    resultados = []
+    vistos = set()
+    for i in orden.tolist():
+        impresion_id = int(ids[i])
+        nombre = nombres[impresion_id]
+        if nombre in vistos:
+            continue
+        vistos.add(nombre)
+        resultados.append({
+            "impresion_id": impresion_id,
+            "nombre": nombre,
+            "edicion": ediciones[impresion_id],
+            "inicio": float(inicio[i]),
+            "fin": float(fin[i]),
+            "cambio": float(cambio[i])
+        })
+        if limite is not None and len(resultados) >= limite:
+            break
+    return resultados
+
+def calcular_movers(conn, ventana="7d", umbral=0.5, limite=None, ahora=None):
+    """Cartas con mayor subida en la ventana indicada ('24h', '7d' o '30d')
+
+    Sólo cuenta impresiones con un precio observado dentro de la ventana.
+    """
+    segundos = VENTANAS[ventana]
+    ahora = int(time.time()) if ahora is None else ahora
+    ids, inicio, fin, nombres, ediciones = cargar_arrays(conn, ventana, ahora - segundos)
+    ids, inicio, fin, cambio = calcular_cambios(ids, inicio, fin)
+    return rankear(ids, inicio, fin, cambio, nombres, ediciones, umbral, limite)
@@ -1,12 +1,37 @@
 ﻿import os
 import json
+import sqlite3
 from datetime import datetime
 import requests
+from backend import indicadores
+from backend.models import price_predictor
+from backend.limitador import LimitadorBloqueante, LimiteExcedido
+
+# Respetar el límite de ~10 peticiones/segundo de Scryfall
+limitador = LimitadorBloqueante()
+
+# Base de datos del bot, de donde se leen los indicadores y predicciones ya calculados
+DB_FILE = "mtg_cards.db"
+
+def analisis_local(scryfall_id):
+    """RSI, medias, volatilidad y predicción guardados para una impresión (vacíos si no hay base de datos)"""
+    vacio = dict(indicadores.SIN_DATOS, predicciones=None)
+    if not os.path.exists(DB_FILE):
+        return vacio
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        valores = indicadores.valores_por_scryfall(conn, scryfall_id)
+        valores["predicciones"] = price_predictor.prediccion_por_scryfall(conn, scryfall_id)
+        return valores
+    except sqlite3.Error:
+        return vacio
+    finally:
+        conn.close()
 
 def buscar_carta(nombre, edicion=None):
     """Buscar carta real desde Scryfall"""
     try:
-        response = requests.get(f"https://api.scryfall.com/cards/named?exact={nombre.replace(' ', '+')}")
+        response = limitador.ejecutar(lambda: requests.get("https://api.scryfall.com/cards/named", params={"exact": nombre}))
         if response.status_code != 200:
             return {"error": "Carta no encontrada"}
         
@@ -22,10 +47,11 @@ def buscar_carta(nombre, edicion=None):
             "precio": precio,
             "fechas": [datetime.now().strftime("%Y-%m-%d %H:%M")],
             "precios": [precio] * 5,
-            "predicciones": [precio * (1 + i*0.05) for i in range(6)],
-            "rsi": round((precio - 0.01) / (100 - 0.01) * 100, 1),
-            "image_url": image_url
+            "image_url": image_url,
+            **analisis_local(data.get("id"))
         }
+    except LimiteExcedido:
+        return {"error": "Scryfall está limitando las peticiones, inténtalo más tarde"}
     except Exception as e:
         print(f"❌ Error buscando carta: {e}")
         return {"error": "No disponible"}
@@ -33,7 +59,7 @@ def buscar_carta(nombre, edicion=None):
 def obtener_todas_ediciones(nombre):
     """Obtener todas las ediciones desde Scryfall"""
     try:
-        response = requests.get(f"https://api.scryfall.com/cards/search?q={nombre.replace(' ', '+')}")
+        response = limitador.ejecutar(lambda: requests.get("https://api.scryfall.com/cards/search", params={"q": nombre}))
         if response.status_code != 200:
             return []
         
@@ -0,0 +1,269 @@
+﻿import time
+import numpy as np
+from backend import precios_db
+from backend.cache_precios import CACHE_TTL
+
+# Motor de portafolio: lotes de compra con su coste, ventas FIFO, valoración contra precios_actuales
+# y una foto diaria del valor de cada portafolio
+DIA = 86400
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS lotes (
+    id INTEGER PRIMARY KEY,
+    usuario_id INTEGER NOT NULL,
+    carta_nombre TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    restante INTEGER NOT NULL,
+    precio_compra REAL NOT NULL,
+    ts INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_lotes_usuario ON lotes (usuario_id, carta_nombre);
+
+-- Cada venta guarda el coste de las unidades que consumió (FIFO) para la ganancia realizada
+CREATE TABLE IF NOT EXISTS ventas (
+    id INTEGER PRIMARY KEY,
+    usuario_id INTEGER NOT NULL,
+    carta_nombre TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    precio_venta REAL NOT NULL,
+    coste REAL NOT NULL,
+    ts INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_ventas_usuario ON ventas (usuario_id);
+
+-- Una foto diaria (solo se añaden filas) del valor y el coste de cada portafolio
+CREATE TABLE IF NOT EXISTS snapshots_portafolio (
+    usuario_id INTEGER NOT NULL,
+    dia INTEGER NOT NULL,
+    valor REAL NOT NULL,
+    coste REAL NOT NULL,
+    PRIMARY KEY (usuario_id, dia)
+) WITHOUT ROWID;
+'''
+
+def inicializar_esquema(conn):
+    """Crear las tablas de lotes, ventas y fotos diarias y pasar a lotes las posiciones que aún no los tienen"""
+    conn.executescript(ESQUEMA)
+    # Posiciones de versiones anteriores (una fila por carta en portafolio): un lote por posición
+    conn.execute('''
+        INSERT INTO lotes (usuario_id, carta_nombre, cantidad, restante, precio_compra, ts)
+        SELECT p.usuario_id, p.carta_nombre, p.cantidad, p.cantidad, COALESCE(p.precio_compra, 0),
+               COALESCE(CAST(strftime('%s', p.fecha_compra, 'utc') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+        FROM portafolio p
+        WHERE p.cantidad > 0 AND NOT EXISTS (
+            SELECT 1 FROM lotes l WHERE l.usuario_id = p.usuario_id AND l.carta_nombre = p.carta_nombre
+        )
+    ''')
+    conn.commit()
+
+def _sincronizar_posicion(conn, chat_id, nombre):
+    """Rehacer la fila de portafolio (cantidad y coste medio de lo que queda) a partir de los lotes"""
+    cantidad, coste, ts = conn.execute('''
+        SELECT TOTAL(restante), TOTAL(restante * precio_compra), MIN(ts)
+        FROM lotes WHERE usuario_id = ? AND carta_nombre = ? AND restante > 0
+    ''', (chat_id, nombre)).fetchone()
+    if not cantidad:
+        conn.execute("DELETE FROM portafolio WHERE usuario_id = ? AND carta_nombre = ?", (chat_id, nombre))
+        return
+    conn.execute('''
+        INSERT INTO portafolio (usuario_id, carta_nombre, cantidad, precio_compra, fecha_compra)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (usuario_id, carta_nombre) DO UPDATE SET
+            cantidad = excluded.cantidad,
+            precio_compra = excluded.precio_compra,
+            fecha_compra = excluded.fecha_compra
+    ''', (chat_id, nombre, int(cantidad), coste / cantidad, precios_db.ts_a_fecha(ts)))
+
+def comprar(conn, chat_id, nombre, cantidad, precio, ts=None):
+    """Añadir un lote de compra (sin commit); devuelve su id"""
+    ts = int(time.time()) if ts is None else ts
+    cur = conn.execute('''
+        INSERT INTO lotes (usuario_id, carta_nombre, cantidad, restante, precio_compra, ts)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (chat_id, nombre, cantidad, cantidad, precio, ts))
+    _sincronizar_posicion(conn, chat_id, nombre)
+    return cur.lastrowid
+
+def vender(conn, chat_id, nombre, cantidad, precio, ts=None):
+    """Vender unidades consumiendo primero los lotes más antiguos (sin commit)
+
+    Devuelve la ganancia realizada, o None (sin cambios) si no hay unidades suficientes.
+    """
+    ts = int(time.time()) if ts is None else ts
+    lotes = conn.execute('''
+        SELECT id, restante, precio_compra FROM lotes
+        WHERE usuario_id = ? AND carta_nombre = ? AND restante > 0
+        ORDER BY ts, id
+    ''', (chat_id, nombre)).fetchall()
+    if sum(restante for _, restante, _ in lotes) < cantidad:
+        return None
+
+    pendiente = cantidad
+    coste = 0.0
+    consumidos = []
+    for lote_id, restante, precio_compra in lotes:
+        usadas = min(restante, pendiente)
+        coste += usadas * precio_compra
+        consumidos.append((restante - usadas, lote_id))
+        pendiente -= usadas
+        if not pendiente:
+            break
+
+    conn.executemany("UPDATE lotes SET restante = ? WHERE id = ?", consumidos)
+    conn.execute('''
+        INSERT INTO ventas (usuario_id, carta_nombre, cantidad, precio_venta, coste, ts)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (chat_id, nombre, cantidad, precio, coste, ts))
+    _sincronizar_posicion(conn, chat_id, nombre)
+    return cantidad * precio - coste
+
+def valorar(conn, chat_id):
+    """Valoración del portafolio con el último precio guardado de cada carta
+
+    Agrupa los lotes por carta y calcula valor, coste y ganancia con NumPy.
+    Devuelve un dict con "cartas" (ordenadas por valor, cada una con nombre,
+    cantidad, coste, precio, valor, ganancia y porcentaje; precio None si no
+    hay ninguno guardado), los totales "valor", "coste", "no_realizada" y
+    "realizada", "sin_precio" (nombres) y "ts" (precio más reciente usado).
+    """
+    filas = conn.execute('''
+        SELECT carta_nombre, restante, precio_compra FROM lotes
+        WHERE usuario_id = ? AND restante > 0 ORDER BY id
+    ''', (chat_id,)).fetchall()
+    realizada = conn.execute("SELECT TOTAL(cantidad * precio_venta - coste) FROM ventas WHERE usuario_id = ?",
+                             (chat_id,)).fetchone()[0]
+    resumen = {"cartas": [], "valor": 0.0, "coste": 0.0, "no_realizada": 0.0,
+               "realizada": realizada, "sin_precio": [], "ts": 0}
+    if not filas:
+        return resumen
+
+    nombres_lote, restante, precio_compra = zip(*filas)
+    claves, fila = np.unique([nombre.lower() for nombre in nombres_lote], return_inverse=True)
+    restante = np.asarray(restante, dtype=np.float64)
+    cantidad = np.bincount(fila, weights=restante, minlength=len(claves))
+    coste = np.bincount(fila, weights=restante * np.asarray(precio_compra, dtype=np.float64), minlength=len(claves))
+
+    actuales = precios_db.precios_por_nombre(conn, claves.tolist())
+    precio = np.array([actuales.get(clave, (np.nan, 0))[0] for clave in claves.tolist()], dtype=np.float64)
+    valor = cantidad * precio
+    ganancia = valor - coste
+    with np.errstate(invalid="ignore", divide="ignore"):
+        porcentaje = np.where(coste > 0, ganancia / coste * 100, np.nan)
+
+    # Nombre tal como lo guardó el usuario (el primero de cada carta)
+    mostrar = {}
+    for nombre in nombres_lote:
+        mostrar.setdefault(nombre.lower(), nombre)
+
+    con_precio = ~np.isnan(precio)
+    for i in np.argsort(-np.where(con_precio, valor, -np.inf), kind="stable").tolist():
+        resumen["cartas"].append({
+            "nombre": mostrar[claves[i]],
+            "cantidad": int(cantidad[i]),
+            "coste": float(coste[i]),
+            "precio": float(precio[i]) if con_precio[i] else None,
+            "valor": float(valor[i]) if con_precio[i] else None,
+            "ganancia": float(ganancia[i]) if con_precio[i] else None,
+            "porcentaje": None if np.isnan(porcentaje[i]) else float(porcentaje[i])
+        })
+    resumen["valor"] = float(valor[con_precio].sum())
+    resumen["coste"] = float(coste[con_precio].sum())
+    resumen["no_realizada"] = resumen["valor"] - resumen["coste"]
+    resumen["sin_precio"] = [mostrar[clave] for clave in claves[~con_precio].tolist()]
+    resumen["ts"] = max((ts for _, ts in actuales.values()), default=0)
+    return resumen
+
+def registrar_snapshots(conn, reemplazar=True):
+    """Guardar la foto de hoy de todos los portafolios (sin commit); devuelve los usuarios guardados
+
+    Las posiciones de todos los usuarios se tratan como columnas (usuario,
+    carta, unidades, coste) y los precios como un vector por carta, así que
+    el valor de cada usuario es una suma ponderada con np.bincount. Las
+    cartas sin precio no cuentan ni en el valor ni en el coste, como en
+    valorar(). Sólo se fotografía el día en curso: los lotes y precios
+    actuales no sirven para valorar días pasados. La foto se sobrescribe si
+    hoy ya tenía una, salvo con reemplazar=False, que sólo la completa si falta.
+    """
+    dia = int(time.time()) // DIA
+    filas = conn.execute(
+        "SELECT usuario_id, carta_nombre, restante, precio_compra FROM lotes WHERE restante > 0").fetchall()
+    if not filas:
+        return 0
+
+    usuarios, nombres, restante, precio_compra = zip(*filas)
+    ids_usuario, fila = np.unique(np.asarray(usuarios, dtype=np.int64), return_inverse=True)
+    claves, columna = np.unique([nombre.lower() for nombre in nombres], return_inverse=True)
+    actuales = precios_db.precios_por_nombre(conn, claves.tolist())
+    precio_carta = np.array([actuales.get(clave, (np.nan, 0))[0] for clave in claves.tolist()], dtype=np.float64)
+
+    restante = np.asarray(restante, dtype=np.float64)
+    precio = precio_carta[columna]
+    con_precio = ~np.isnan(precio)
+    valor = np.bincount(fila, weights=np.where(con_precio, restante * precio, 0), minlength=len(ids_usuario))
+    coste = np.bincount(fila, weights=np.where(con_precio, restante * np.asarray(precio_compra, dtype=np.float64), 0),
+                        minlength=len(ids_usuario))
+    cur = conn.executemany(f'''
+        INSERT OR {"REPLACE" if reemplazar else "IGNORE"} INTO snapshots_portafolio (usuario_id, dia, valor, coste) VALUES (?, ?, ?, ?)
+    ''', zip(ids_usuario.tolist(), [dia] * len(ids_usuario), np.round(valor, 2).tolist(), np.round(coste, 2).tolist()))
+    return cur.rowcount
+
+def historial(conn, chat_id, desde_dia=0):
+    """Fotos diarias del portafolio de un usuario: [(dia, valor, coste)] ordenadas por día"""
+    return conn.execute('''
+        SELECT dia, valor, coste FROM snapshots_portafolio
+        WHERE usuario_id = ? AND dia >= ? ORDER BY dia
+    ''', (chat_id, desde_dia)).fetchall()
+
+class CacheValoraciones:
+    """Valoraciones de portafolio en memoria hasta que cambia el precio de alguna de sus cartas
+
+    Se invalidan al modificar el portafolio (invalidar) o al guardar un precio
+    nuevo de una de sus cartas (invalidar_carta); el TTL cubre los precios que
+    llegan por otros procesos, como descargar_cartas.py.
+    """
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._datos = {}      # chat_id -> (expira, resumen)
+        self._por_carta = {}  # nombre en minúsculas -> {chat_id}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, chat_id):
+        """Valoración vigente de un usuario, o None"""
+        entrada = self._datos.get(chat_id)
+        if entrada is None or entrada[0] < time.monotonic():
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return entrada[1]
+
+    def guardar(self, chat_id, resumen):
+        """Guardar la valoración de un usuario"""
+        self.invalidar(chat_id)
+        self._datos[chat_id] = (time.monotonic() + self.ttl, resumen)
+        for carta in resumen["cartas"]:
+            self._por_carta.setdefault(carta["nombre"].lower(), set()).add(chat_id)
+
+    def invalidar(self, chat_id):
+        """Descartar la valoración de un usuario"""
+        entrada = self._datos.pop(chat_id, None)
+        if entrada is None:
+            return
+        for carta in entrada[1]["cartas"]:
+            usuarios = self._por_carta.get(carta["nombre"].lower())
+            if usuarios is not None:
+                usuarios.discard(chat_id)
+                if not usuarios:
+                    del self._por_carta[carta["nombre"].lower()]
+
+    def invalidar_carta(self, nombre):
+        """Descartar las valoraciones que incluyen una carta"""
+        for chat_id in list(self._por_carta.get(nombre.lower(), ())):
+            self.invalidar(chat_id)
+
+    def estadisticas(self):
+        """Métricas de la caché de valoraciones"""
+        return {"entradas": len(self._datos), "aciertos": self.aciertos, "fallos": self.fallos}
@@ -0,0 +1,128 @@
+﻿import os
+import time
+from collections import Counter
+from backend.cache_precios import CACHE_TTL
+from backend.limitador import FONDO
+
+# Precarga de la caché con las cartas más buscadas por los usuarios
+PRECARGA_CARTAS = int(os.getenv("PRECARGA_CARTAS", "200"))  # cartas por ronda de precarga
+INTERVALO_PRECARGA = max(60, CACHE_TTL - 60)               # refrescar antes de que caduque la memoria
+VIDA_MEDIA = 7 * 86400                                      # una búsqueda pesa la mitad cada semana
+EPOCA = 1_700_000_000                                       # origen del escalado de las puntuaciones
+OLVIDO = 90 * 86400                                         # cartas sin búsquedas que dejan de contar
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS demanda (
+    nombre TEXT NOT NULL COLLATE NOCASE,
+    edicion TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    scryfall_id TEXT,
+    puntuacion REAL NOT NULL,
+    ultima INTEGER NOT NULL,
+    PRIMARY KEY (nombre, edicion)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_demanda_puntuacion ON demanda (puntuacion DESC);
+'''
+
+# Cartas conocidas para completar la precarga mientras no haya búsquedas suficientes
+CARTAS_INICIALES = (
+    "Black Lotus", "Ancestral Recall", "Time Walk", "Mox Emerald", "Mox Sapphire",
+    "Mox Ruby", "Mox Jet", "Mox Pearl", "Timetwister", "Jace, the Mind Sculptor",
+    "Liliana of the Veil", "Mana Crypt", "Sol Ring", "Mana Vault", "Mana Drain",
+    "Bazaar of Baghdad", "Library of Alexandria", "Mishra's Workshop", "Tolarian Academy",
+    "Underground Sea", "Volcanic Island", "Tundra", "Scrubland", "Taiga", "Badlands",
+    "Bayou", "Plateau", "Savannah", "Tropical Island", "Force of Will", "Brainstorm",
+    "Ponder", "Counterspell", "Daze", "Swords to Plowshares", "Tarmogoyf",
+    "Murktide Regent", "Wasteland", "Strip Mine", "Stoneforge Mystic",
+    "Sensei's Divining Top", "Deathrite Shaman", "Delver of Secrets",
+    "Thalia, Guardian of Thraben", "True-Name Nemesis", "Vendilion Clique",
+    "Chrome Mox", "Mox Diamond", "Grim Monolith", "Imperial Recruiter",
+    "Windswept Heath", "Verdant Catacombs", "Marsh Flats", "Arid Mesa",
+    "Scalding Tarn", "Polluted Delta", "Mana Confluence", "Command Tower",
+    "Birds of Paradise", "Elvish Spirit Guide", "Thoughtseize", "Inquisition of Kozilek",
+    "Fact or Fiction", "Counterbalance", "Spell Pierce", "Flusterstorm",
+    "Back to Basics", "Choke", "Red Elemental Blast", "Pyroblast", "Karakas",
+    "Ulamog, the Infinite Gyre", "Emrakul, the Aeons Torn", "Progenitus",
+    "Celestial Colonnade", "Mishra's Factory", "City in a Bottle", "Mana Reflection"
+)
+
+def inicializar_esquema(conn):
+    """Crear la tabla de demanda de cartas"""
+    conn.executescript(ESQUEMA)
+
+def _puntuacion(n, ts):
+    """n búsquedas en ts, escaladas a EPOCA para poder sumarlas sin recalcular las anteriores
+
+    Una puntuación guardada vale puntuacion / 2 ** ((ahora - EPOCA) / VIDA_MEDIA),
+    y como ese divisor es el mismo para todas las cartas basta con ordenar por ella.
+    """
+    return n * 2 ** ((ts - EPOCA) / VIDA_MEDIA)
+
+def registrar_demanda(conn, conteos, ahora=None):
+    """Sumar búsquedas {(nombre, edicion, scryfall_id): n} a la demanda (sin commit)"""
+    ahora = int(time.time()) if ahora is None else ahora
+    conn.executemany('''
+        INSERT INTO demanda (nombre, edicion, scryfall_id, puntuacion, ultima)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (nombre, edicion) DO UPDATE SET
+            scryfall_id = COALESCE(excluded.scryfall_id, scryfall_id),
+            puntuacion = puntuacion + excluded.puntuacion,
+            ultima = excluded.ultima
+    ''', [(nombre, edicion or "", scryfall_id, _puntuacion(n, ahora), ahora)
+          for (nombre, edicion, scryfall_id), n in conteos.items()])
+    conn.execute("DELETE FROM demanda WHERE ultima < ?", (ahora - OLVIDO,))
+
+def cartas_a_precargar(conn, limite=PRECARGA_CARTAS):
+    """Las `limite` cartas más buscadas como [(nombre, edicion, scryfall_id)], completadas con CARTAS_INICIALES"""
+    consultas = [(nombre, edicion or None, scryfall_id) for nombre, edicion, scryfall_id in conn.execute(
+        "SELECT nombre, edicion, scryfall_id FROM demanda ORDER BY puntuacion DESC LIMIT ?", (limite,))]
+    vistas = {nombre.lower() for nombre, edicion, _ in consultas if edicion is None}
+    for nombre in CARTAS_INICIALES:
+        if len(consultas) >= limite:
+            break
+        if nombre.lower() not in vistas:
+            vistas.add(nombre.lower())
+            consultas.append((nombre, None, None))
+    return consultas
+
+class ContadorDemanda:
+    """Contar en memoria las búsquedas de los usuarios y guardarlas de vez en cuando"""
+
+    def __init__(self):
+        self._conteos = Counter()
+
+    def anotar(self, nombre, edicion=None, scryfall_id=None):
+        """Anotar una búsqueda con éxito de una carta"""
+        self._conteos[(nombre, edicion, scryfall_id)] += 1
+
+    async def volcar(self, db):
+        """Sumar las búsquedas anotadas a la tabla de demanda"""
+        if not self._conteos:
+            return 0
+        conteos, self._conteos = self._conteos, Counter()
+        try:
+            await db.escribir(registrar_demanda, conteos)
+        except Exception:
+            self._conteos.update(conteos)
+            raise
+        return sum(conteos.values())
+
+    def __len__(self):
+        return len(self._conteos)
+
+async def precalentar(repositorio, db, limite=PRECARGA_CARTAS):
+    """Refrescar en memoria y en SQLite las cartas con más demanda
+
+    Las cartas se piden a /cards/collection en lotes de 75 concurrentes, con
+    prioridad de fondo en el limitador para no retrasar a los usuarios.
+    Devuelve (cartas precargadas, consultas que Scryfall no reconoce).
+    """
+    consultas = await db.leer(cartas_a_precargar, limite)
+    inicio = time.monotonic()
+    valores, faltantes, limitadas = await repositorio.obtener_varias(consultas, FONDO, forzar=True)
+    print(f"🔥 Precarga: {len(valores)} de {len(consultas)} cartas en {time.monotonic() - inicio:.1f}s")
+    if limitadas:
+        # Un 429 no significa que la carta no exista: se vuelven a pedir en la próxima precarga
+        print(f"⏳ Precarga: {len(limitadas)} cartas sin pedir por el límite de Scryfall")
+    for nombre, edicion, _ in faltantes:
+        print(f"⚠️ Precarga: Scryfall no reconoce `{nombre}`" + (f" ({edicion})" if edicion else ""))
+    return len(valores), faltantes
@@ -0,0 +1,461 @@
+﻿import time
+from datetime import datetime
+from backend import indicadores
+from backend.models import price_predictor
+
+# Esquema normalizado: una fila por impresión (carta + edición) y una por observación de precio
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS impresiones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scryfall_id TEXT UNIQUE,
+    nombre TEXT NOT NULL,
+    edicion TEXT,
+    coleccion TEXT,
+    numero TEXT,
+    image_url TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_impresiones_nombre ON impresiones (nombre COLLATE NOCASE, coleccion);
+
+CREATE TABLE IF NOT EXISTS precios (
+    impresion_id INTEGER NOT NULL REFERENCES impresiones (id),
+    ts INTEGER NOT NULL,
+    precio REAL NOT NULL,
+    repeticiones INTEGER NOT NULL DEFAULT 0,  -- observaciones posteriores con el mismo precio
+    PRIMARY KEY (impresion_id, ts)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_precios_ts ON precios (ts, impresion_id);
+
+-- Último precio de cada impresión (ts es su última observación en el historial) y referencias de hace 24h / 7d / 30d
+CREATE TABLE IF NOT EXISTS precios_actuales (
+    impresion_id INTEGER PRIMARY KEY REFERENCES impresiones (id),
+    precio REAL NOT NULL,
+    ts INTEGER NOT NULL,
+    precio_24h REAL,
+    ts_24h INTEGER,
+    precio_7d REAL,
+    ts_7d INTEGER,
+    precio_30d REAL,
+    ts_30d INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_precios_actuales_ts ON precios_actuales (ts);
+
+-- Última vez que se comprobó que el precio actual seguía igual (sin añadir otra fila a precios)
+CREATE TABLE IF NOT EXISTS verificaciones (
+    impresion_id INTEGER PRIMARY KEY REFERENCES impresiones (id),
+    ts INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- Archivos JSON de versiones anteriores ya importados (los archivos no se tocan)
+CREATE TABLE IF NOT EXISTS importaciones (
+    archivo TEXT PRIMARY KEY,
+    ts INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Ventanas de referencia materializadas en precios_actuales (en segundos)
+VENTANAS = {
+    "24h": 86400,
+    "7d": 7 * 86400,
+    "30d": 30 * 86400
+}
+
+FORMATO_FECHA = "%Y-%m-%d %H:%M"
+LOTE_IN = 900  # variables por consulta IN (...), por debajo del límite de SQLite
+
+def inicializar_esquema(conn):
+    """Crear las tablas e índices del historial de precios si no existen"""
+    conn.executescript(ESQUEMA)
+
+    # Bases de datos anteriores a las repeticiones de precios verificados
+    if "repeticiones" not in {fila[1] for fila in conn.execute("PRAGMA table_info(precios)")}:
+        conn.execute("ALTER TABLE precios ADD COLUMN repeticiones INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+
+    # Bases de datos anteriores a precios_actuales: materializar a partir del historial
+    vacia = conn.execute("SELECT 1 FROM precios_actuales LIMIT 1").fetchone() is None
+    if vacia and conn.execute("SELECT 1 FROM precios LIMIT 1").fetchone() is not None:
+        reconstruir_precios_actuales(conn)
+        conn.commit()
+
+    indicadores.inicializar_esquema(conn)
+    price_predictor.inicializar_esquema(conn)
+
+def fecha_a_ts(fecha):
+    """Convertir una fecha '%Y-%m-%d %H:%M' (hora local) a timestamp epoch"""
+    return int(datetime.strptime(fecha, FORMATO_FECHA).timestamp())
+
+def ts_a_fecha(ts):
+    """Convertir un timestamp epoch a '%Y-%m-%d %H:%M' (hora local)"""
+    return datetime.fromtimestamp(ts).strftime(FORMATO_FECHA)
+
+def obtener_impresion(conn, nombre, edicion, coleccion, image_url=None, scryfall_id=None, numero=None):
+    """Devolver el id de una impresión, creándola si no existe"""
+    if scryfall_id:
+        fila = conn.execute("SELECT id FROM impresiones WHERE scryfall_id = ?", (scryfall_id,)).fetchone()
+        if fila:
+            if image_url:
+                conn.execute("UPDATE impresiones SET image_url = ? WHERE id = ? AND image_url IS NOT ?",
+                             (image_url, fila[0], image_url))
+            return fila[0]
+
+        # Adoptar una impresión migrada del esquema antiguo (sin scryfall_id)
+        fila = conn.execute('''
+            SELECT id FROM impresiones
+            WHERE scryfall_id IS NULL AND nombre = ? AND coleccion IS ?
+            LIMIT 1
+        ''', (nombre, coleccion)).fetchone()
+        if fila:
+            conn.execute("UPDATE impresiones SET scryfall_id = ?, numero = ?, image_url = COALESCE(?, image_url) WHERE id = ?",
+                         (scryfall_id, numero, image_url or None, fila[0]))
+            return fila[0]
+    else:
+        fila = conn.execute('''
+            SELECT id FROM impresiones
+            WHERE nombre = ? AND coleccion IS ?
+            ORDER BY scryfall_id IS NULL
+            LIMIT 1
+        ''', (nombre, coleccion)).fetchone()
+        if fila:
+            return fila[0]
+
+    cur = conn.execute('''
+        INSERT INTO impresiones (scryfall_id, nombre, edicion, coleccion, numero, image_url)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (scryfall_id, nombre, edicion, coleccion, numero, image_url))
+    return cur.lastrowid
+
+def _ids_por_scryfall(conn, scryfall_ids):
+    """Resolver muchos scryfall_id a ids de impresión con consultas IN por lotes"""
+    ids = {}
+    scryfall_ids = list(scryfall_ids)
+    for i in range(0, len(scryfall_ids), LOTE_IN):
+        lote = scryfall_ids[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for scryfall_id, impresion_id in conn.execute(
+                f"SELECT scryfall_id, id FROM impresiones WHERE scryfall_id IN ({marcadores})", lote):
+            ids[scryfall_id] = impresion_id
+    return ids
+
+def _filas_observaciones(conn, observaciones, ts):
+    """Resolver (o crear) la impresión de cada observación: [(impresion_id, ts, precio)]"""
+    conocidos = _ids_por_scryfall(conn, {o["scryfall_id"] for o in observaciones if o.get("scryfall_id")})
+    filas = []
+    for o in observaciones:
+        impresion_id = conocidos.get(o.get("scryfall_id"))
+        if impresion_id is None:
+            impresion_id = obtener_impresion(conn, o["nombre"], o.get("edicion"), o.get("coleccion"),
+                                             o.get("image_url"), o.get("scryfall_id"), o.get("numero"))
+            if o.get("scryfall_id"):
+                conocidos[o["scryfall_id"]] = impresion_id
+        filas.append((impresion_id, o.get("ts", ts), o["precio"]))
+    return filas
+
+def registrar_observaciones(conn, observaciones, ts=None):
+    """Guardar observaciones de precio (sin commit; lo hace quien llama)
+
+    Cada observación es un dict con nombre, edicion, coleccion, precio, image_url
+    y opcionalmente scryfall_id, numero y ts. Devuelve [(impresion_id, ts, precio)].
+    """
+    if ts is None:
+        ts = int(time.time())
+    return registrar_precios(conn, _filas_observaciones(conn, observaciones, ts))
+
+def precios_vigentes(conn, impresion_ids):
+    """Último precio guardado de varias impresiones: {impresion_id: (precio, ts)}"""
+    vigentes = {}
+    impresion_ids = list(impresion_ids)
+    for i in range(0, len(impresion_ids), LOTE_IN):
+        lote = impresion_ids[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for impresion_id, precio, ts in conn.execute(
+                f"SELECT impresion_id, precio, ts FROM precios_actuales WHERE impresion_id IN ({marcadores})", lote):
+            vigentes[impresion_id] = (precio, ts)
+    return vigentes
+
+def registrar_cambios(conn, observaciones, ts=None, cubeta=None):
+    """Como registrar_observaciones(), pero guardando sólo los precios que han cambiado (sin commit)
+
+    Si el precio coincide con el último guardado no se añade otra fila al
+    historial: se anota en verificaciones que sigue vigente y, si la
+    observación es posterior a la última (en otra cubeta, si se indica), se
+    suma a las repeticiones de la fila y entra en los indicadores, la
+    predicción y las ventanas de referencia como una observación más. Con
+    `cubeta` (segundos), un precio nuevo reemplaza las filas anteriores de la
+    impresión en su misma cubeta de tiempo. Devuelve ([(impresion_id, ts,
+    precio)] de todas las observaciones, las filas guardadas).
+    """
+    if ts is None:
+        ts = int(time.time())
+    filas = _filas_observaciones(conn, observaciones, ts)
+    vigentes = precios_vigentes(conn, {fila[0] for fila in filas})
+
+    cambios = []
+    verificadas = []
+    repetidas = []
+    for impresion_id, ts_fila, precio in sorted(filas, key=lambda fila: fila[1]):
+        anterior = vigentes.get(impresion_id)
+        if anterior is not None and round(precio, 2) == round(anterior[0], 2):
+            verificadas.append((impresion_id, ts_fila))
+            if (ts_fila // cubeta > anterior[1] // cubeta) if cubeta else ts_fila > anterior[1]:
+                repetidas.append((impresion_id, ts_fila, anterior[0]))
+                vigentes[impresion_id] = (anterior[0], ts_fila)
+        else:
+            cambios.append((impresion_id, ts_fila, precio))
+            if anterior is None or ts_fila >= anterior[1]:
+                vigentes[impresion_id] = (precio, ts_fila)
+
+    reemplazadas = set()
+    if cubeta:
+        for impresion_id, ts_fila, _ in cambios:
+            if conn.execute("DELETE FROM precios WHERE impresion_id = ? AND ts >= ? AND ts < ?",
+                            (impresion_id, ts_fila - ts_fila % cubeta, ts_fila)).rowcount:
+                reemplazadas.add(impresion_id)
+
+    conn.executemany("INSERT OR REPLACE INTO precios (impresion_id, ts, precio) VALUES (?, ?, ?)", cambios)
+    conn.executemany('''
+        UPDATE precios SET repeticiones = repeticiones + 1
+        WHERE impresion_id = ? AND ts = (SELECT MAX(ts) FROM precios WHERE impresion_id = ? AND ts <= ?)
+    ''', [(impresion_id, impresion_id, ts_fila) for impresion_id, ts_fila, _ in repetidas])
+    conn.executemany('''
+        INSERT INTO verificaciones (impresion_id, ts) VALUES (?, ?)
+        ON CONFLICT (impresion_id) DO UPDATE SET ts = MAX(ts, excluded.ts)
+    ''', verificadas)
+    _actualizar_derivados(conn, cambios + repetidas, reemplazadas)
+    return filas, cambios
+
+def registrar_precios(conn, filas):
+    """Guardar filas (impresion_id, ts, precio) y actualizar los datos derivados (sin commit)"""
+    if not filas:
+        return filas
+    conn.executemany("INSERT OR REPLACE INTO precios (impresion_id, ts, precio) VALUES (?, ?, ?)", filas)
+    _actualizar_derivados(conn, filas)
+    return filas
+
+def _actualizar_derivados(conn, filas, reemplazadas=()):
+    """Incorporar observaciones ya guardadas a precios_actuales, indicadores y predicciones (sin commit)
+
+    Las impresiones de `reemplazadas` han perdido filas del historial, así que
+    sus indicadores y predicciones se recalculan en lugar de actualizarse.
+    """
+    if not filas:
+        return
+    actualizar_precios_actuales(conn, {fila[0] for fila in filas})
+    incrementales = [fila for fila in filas if fila[0] not in reemplazadas]
+    indicadores.actualizar(conn, incrementales)
+    price_predictor.actualizar(conn, incrementales)
+    if reemplazadas:
+        indicadores.reconstruir(conn, reemplazadas)
+        price_predictor.ajustar(conn, reemplazadas)
+
+def _referencia(conn, impresion_id, ts, ventana):
+    """Precio de referencia de hace `ventana` segundos respecto a ts
+
+    Es la última observación en o antes de ts - ventana; si no la hay, la primera
+    observación anterior a ts. Devuelve (precio, ts) o (None, None).
+    """
+    fila = conn.execute('''
+        SELECT precio, ts FROM precios
+        WHERE impresion_id = ? AND ts <= ?
+        ORDER BY ts DESC LIMIT 1
+    ''', (impresion_id, ts - ventana)).fetchone()
+    if fila is None:
+        fila = conn.execute('''
+            SELECT precio, ts FROM precios
+            WHERE impresion_id = ? AND ts < ?
+            ORDER BY ts LIMIT 1
+        ''', (impresion_id, ts)).fetchone()
+    return fila or (None, None)
+
+def actualizar_precios_actuales(conn, impresion_ids):
+    """Recalcular la fila materializada de las impresiones indicadas (sin commit)
+
+    El ts es la última observación del precio, contando las verificaciones,
+    y las referencias de cada ventana se toman respecto a él.
+    """
+    filas = []
+    for impresion_id in impresion_ids:
+        ultimo = conn.execute('''
+            SELECT p.precio, MAX(p.ts, COALESCE(v.ts, 0)) FROM precios p
+            LEFT JOIN verificaciones v ON v.impresion_id = p.impresion_id
+            WHERE p.impresion_id = ?
+            ORDER BY p.ts DESC LIMIT 1
+        ''', (impresion_id,)).fetchone()
+        if ultimo is None:
+            continue
+        precio, ts = ultimo
+        fila = [impresion_id, precio, ts]
+        for ventana in VENTANAS.values():
+            fila.extend(_referencia(conn, impresion_id, ts, ventana))
+        filas.append(fila)
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO precios_actuales
+            (impresion_id, precio, ts, precio_24h, ts_24h, precio_7d, ts_7d, precio_30d, ts_30d)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', filas)
+
+def reconstruir_precios_actuales(conn):
+    """Materializar precios_actuales para todas las impresiones (sin commit)"""
+    conn.execute("DELETE FROM precios_actuales")
+    ids = [fila[0] for fila in conn.execute("SELECT id FROM impresiones")]
+    actualizar_precios_actuales(conn, ids)
+
+def cargar_actuales(conn, ventana, desde_ts):
+    """Filas materializadas con precio reciente y referencia para la ventana indicada
+
+    Devuelve [(impresion_id, nombre, edicion, precio, precio_referencia)].
+    """
+    if ventana not in VENTANAS:
+        raise ValueError(f"Ventana desconocida: {ventana}")
+    return conn.execute(f'''
+        SELECT a.impresion_id, i.nombre, i.edicion, a.precio, a.precio_{ventana}
+        FROM precios_actuales a
+        JOIN impresiones i ON i.id = a.impresion_id
+        WHERE a.ts >= ? AND a.ts_{ventana} IS NOT NULL
+    ''', (desde_ts,)).fetchall()
+
+def historial_carta(conn, nombre, limite=10):
+    """Últimos precios guardados de una carta (todas sus ediciones)"""
+    return conn.execute('''
+        SELECT p.ts, p.precio, i.edicion
+        FROM impresiones i
+        JOIN precios p ON p.impresion_id = i.id
+        WHERE i.nombre = ? COLLATE NOCASE
+        ORDER BY p.ts DESC
+        LIMIT ?
+    ''', (nombre, limite)).fetchall()
+
+def cargar_series(conn, desde_ts=0):
+    """Observaciones desde un instante, ordenadas por impresión y fecha"""
+    return conn.execute('''
+        SELECT p.impresion_id, i.nombre, i.edicion, p.ts, p.precio
+        FROM precios p
+        JOIN impresiones i ON i.id = p.impresion_id
+        WHERE p.ts >= ?
+        ORDER BY p.impresion_id, p.ts
+    ''', (desde_ts,)).fetchall()
+
+def carta_actual(conn, nombre=None, edicion=None, scryfall_id=None):
+    """Impresión con su último precio guardado, o None
+
+    Con scryfall_id se busca esa impresión; si no, la del nombre (y edición o
+    código de colección, si se indica) con el precio más reciente. Devuelve
+    (impresion_id, nombre, edicion, coleccion, numero, image_url, scryfall_id, precio, ts);
+    ts es la última vez que se vio ese precio, aunque no se guardara otra fila.
+    """
+    consulta = '''
+        SELECT i.id, i.nombre, i.edicion, i.coleccion, i.numero, i.image_url, i.scryfall_id,
+               a.precio, MAX(a.ts, COALESCE(v.ts, 0))
+        FROM impresiones i
+        JOIN precios_actuales a ON a.impresion_id = i.id
+        LEFT JOIN verificaciones v ON v.impresion_id = i.id
+    '''
+    if scryfall_id:
+        fila = conn.execute(consulta + "WHERE i.scryfall_id = ?", (scryfall_id,)).fetchone()
+        if fila is not None or not nombre:
+            return fila
+    if edicion:
+        return conn.execute(consulta + '''
+            WHERE i.nombre = ? COLLATE NOCASE AND (i.coleccion = ? COLLATE NOCASE OR i.edicion = ? COLLATE NOCASE)
+            ORDER BY a.ts DESC LIMIT 1
+        ''', (nombre, edicion, edicion)).fetchone()
+    return conn.execute(consulta + "WHERE i.nombre = ? COLLATE NOCASE ORDER BY a.ts DESC LIMIT 1", (nombre,)).fetchone()
+
+def precios_por_nombre(conn, nombres):
+    """Último precio de varias cartas por nombre (sin distinguir mayúsculas): {nombre en minúsculas: (precio, ts)}
+
+    Igual que carta_actual() sin edición, se usa la impresión con el precio más reciente.
+    """
+    precios = {}
+    nombres = list(nombres)
+    for i in range(0, len(nombres), LOTE_IN):
+        lote = nombres[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for nombre, precio, ts in conn.execute(f'''
+                SELECT nombre, precio, ts FROM (
+                    SELECT i.nombre, a.precio, a.ts,
+                           ROW_NUMBER() OVER (PARTITION BY i.nombre COLLATE NOCASE ORDER BY a.ts DESC) AS orden
+                    FROM impresiones i
+                    JOIN precios_actuales a ON a.impresion_id = i.id
+                    WHERE i.nombre COLLATE NOCASE IN ({marcadores})
+                ) WHERE orden = 1''', lote):
+            precios[nombre.lower()] = (precio, ts)
+    return precios
+
+def nombres_impresiones(conn, impresion_ids):
+    """Nombre y edición de varias impresiones: {impresion_id: (nombre, edicion)}"""
+    datos = {}
+    impresion_ids = list(impresion_ids)
+    for i in range(0, len(impresion_ids), LOTE_IN):
+        lote = impresion_ids[i:i + LOTE_IN]
+        marcadores = ",".join("?" * len(lote))
+        for impresion_id, nombre, edicion in conn.execute(
+                f"SELECT id, nombre, edicion FROM impresiones WHERE id IN ({marcadores})", lote):
+            datos[impresion_id] = (nombre, edicion)
+    return datos
+
+def contar_impresiones(conn):
+    """Número de impresiones con al menos un precio guardado"""
+    return conn.execute("SELECT COUNT(*) FROM precios_actuales").fetchone()[0]
+
+def existe_tabla(conn, nombre):
+    """Comprobar si una tabla existe en la base de datos"""
+    fila = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nombre,)).fetchone()
+    return fila is not None
+
+def archivo_importado(conn, archivo):
+    """Comprobar si un archivo JSON antiguo ya se importó a SQLite"""
+    return conn.execute("SELECT 1 FROM importaciones WHERE archivo = ?", (archivo,)).fetchone() is not None
+
+def marcar_importado(conn, archivo):
+    """Anotar que un archivo JSON antiguo ya está importado (sin commit)"""
+    conn.execute("INSERT OR REPLACE INTO importaciones (archivo, ts) VALUES (?, strftime('%s', 'now'))", (archivo,))
+
+def migrar_cartas_legacy(conn, lote=10000):
+    """Pasar la tabla antigua 'cartas' al esquema normalizado y eliminarla
+
+    Devuelve el número de filas migradas (0 si no había nada que migrar).
+    """
+    if not existe_tabla(conn, "cartas"):
+        return 0
+
+    inicializar_esquema(conn)
+    total = 0
+    impresiones = {}
+    try:
+        filas = conn.execute('''
+            SELECT nombre, edicion, coleccion, precio, fecha, image_url
+            FROM cartas
+            WHERE precio IS NOT NULL AND fecha IS NOT NULL
+            ORDER BY id
+        ''')
+        while True:
+            bloque = filas.fetchmany(lote)
+            if not bloque:
+                break
+            observaciones = []
+            for nombre, edicion, coleccion, precio, fecha, image_url in bloque:
+                clave = (nombre, coleccion)
+                if clave not in impresiones:
+                    impresiones[clave] = obtener_impresion(conn, nombre, edicion, coleccion, image_url or None)
+                try:
+                    ts = fecha_a_ts(fecha)
+                except ValueError:
+                    continue
+                observaciones.append((impresiones[clave], ts, precio))
+            conn.executemany("INSERT OR REPLACE INTO precios (impresion_id, ts, precio) VALUES (?, ?, ?)", observaciones)
+            total += len(observaciones)
+        filas.close()
+
+        conn.execute("DROP TABLE cartas")
+        reconstruir_precios_actuales(conn)
+        indicadores.reconstruir(conn)
+        price_predictor.ajustar(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return total
@@ -0,0 +1,74 @@
+﻿import os
+import time
+from backend import precios_db
+from backend import scryfall_client
+from backend.bulk_data import observacion_desde_carta
+from backend.limitador import FONDO
+
+# Refresco incremental: sólo las impresiones que alguien sigue o ha consultado hace poco
+REFRESCO = int(os.getenv("REFRESCO_SEGUNDOS", str(12 * 3600)))  # antigüedad a partir de la que se vuelve a pedir un precio
+RECIENTES = 7 * 86400          # consultas de usuarios que cuentan como interés reciente
+INTERVALO_REFRESCO = 3600      # segundos entre rondas del trabajo periódico
+MAX_REFRESCO = 3000            # impresiones por ronda (40 peticiones a /cards/collection)
+
+def impresiones_a_refrescar(conn, ahora=None, limite=MAX_REFRESCO):
+    """scryfall_id de las impresiones seguidas o consultadas hace poco con el precio sin verificar desde hace REFRESCO
+
+    Cuentan las alertas por carta, los portafolios y la demanda de los últimos
+    RECIENTES segundos; las que sólo se conocen por nombre usan la impresión con
+    el precio más reciente. Las más antiguas van primero.
+    """
+    ahora = int(time.time()) if ahora is None else ahora
+    return [fila[0] for fila in conn.execute('''
+        WITH nombres (nombre) AS (
+            SELECT carta_nombre FROM portafolio
+            UNION
+            SELECT nombre FROM demanda WHERE ultima >= :recientes AND scryfall_id IS NULL
+        ),
+        seguidas (impresion_id) AS (
+            SELECT impresion_id FROM alertas_carta
+            UNION
+            SELECT (SELECT i.id FROM impresiones i JOIN precios_actuales a ON a.impresion_id = i.id
+                    WHERE i.nombre = n.nombre COLLATE NOCASE ORDER BY a.ts DESC LIMIT 1)
+            FROM nombres n
+            UNION
+            SELECT i.id FROM demanda d JOIN impresiones i ON i.scryfall_id = d.scryfall_id
+            WHERE d.ultima >= :recientes
+        )
+        SELECT i.scryfall_id, MAX(a.ts, COALESCE(v.ts, 0)) AS verificado
+        FROM seguidas s
+        JOIN impresiones i ON i.id = s.impresion_id
+        JOIN precios_actuales a ON a.impresion_id = i.id
+        LEFT JOIN verificaciones v ON v.impresion_id = i.id
+        WHERE i.scryfall_id IS NOT NULL AND verificado < :caducado
+        ORDER BY verificado
+        LIMIT :limite
+    ''', {"recientes": ahora - RECIENTES, "caducado": ahora - REFRESCO, "limite": limite})]
+
+async def refrescar(db, limite=MAX_REFRESCO, al_cambiar=None):
+    """Pedir a Scryfall los precios pendientes de refresco y guardar sólo los que han cambiado
+
+    Las impresiones se piden por id a /cards/collection en lotes de 75
+    concurrentes, con prioridad de fondo en el limitador. El tráfico depende
+    de cuántas cartas se siguen y las escrituras de cuántos precios cambian,
+    no del tamaño del catálogo. al_cambiar(observacion) se llama por cada
+    precio nuevo. Devuelve (pedidas, precios nuevos, sin cambios).
+    """
+    scryfall_ids = await db.leer(impresiones_a_refrescar, None, limite)
+    if not scryfall_ids:
+        return 0, 0, 0
+    cartas, _, _ = await scryfall_client.obtener_colecciones([{"id": i} for i in scryfall_ids], FONDO)
+    observaciones = [observacion_desde_carta(card) for card in cartas]
+    observaciones = [o for o in observaciones if o["precio"] is not None]
+    if not observaciones:
+        return len(scryfall_ids), 0, 0
+    filas, cambios = await db.escribir(precios_db.registrar_cambios, observaciones)
+    guardadas = len(cambios)
+    if al_cambiar is not None:
+        cambiadas = {fila[0] for fila in cambios}
+        for observacion, fila in zip(observaciones, filas):
+            if fila[0] in cambiadas:
+                al_cambiar(observacion)
+    print(f"🔁 Refresco: {len(scryfall_ids)} impresiones pedidas, {guardadas} precios nuevos, "
+          f"{len(filas) - guardadas} sin cambios")
+    return len(scryfall_ids), guardadas, len(filas) - guardadas
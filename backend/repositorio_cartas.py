@@ -0,0 +1,296 @@
+﻿import os
+import json
+import time
+import asyncio
+from datetime import datetime
+from backend import precios_db
+from backend import scryfall_client
+from backend import indicadores
+from backend.models import price_predictor
+from backend.cache_precios import CachePrecios, CACHE_TTL, normalizar_clave
+from backend.cache_imagenes import id_en_url
+from backend.bulk_data import precio_usd
+from backend.vuelo_unico import VueloUnico
+from backend.limitador import INTERACTIVA
+
+# Repositorio de cartas: memoria -> SQLite -> Scryfall, sirviendo datos locales si la red falla
+FRESCO = CACHE_TTL                                              # segundos en los que un precio local no se revalida
+ESPERA_RED = float(os.getenv("REPOSITORIO_ESPERA_RED", "3"))    # espera máxima a Scryfall si hay copia local
+
+PRECIO_SIN_DATOS = 0.01  # se muestra en las cartas sin precio en USD, pero nunca se guarda
+
+# Cachés JSON de versiones anteriores, que se importan una sola vez a SQLite
+ARCHIVOS_LEGADO = ("cartas_cache.json", os.path.join("data", "cache_cards.json"))
+
+def frescura(origen, actualizado, revalidando=False, ahora=None):
+    """Metadatos de frescura de un resultado: origen, fecha del precio y si está obsoleto"""
+    ahora = time.time() if ahora is None else ahora
+    antiguedad = max(0, int(ahora - actualizado))
+    return {
+        "origen": origen,
+        "actualizado": int(actualizado),
+        "antiguedad": antiguedad,
+        "estado": "fresco" if antiguedad < FRESCO else "obsoleto",
+        "revalidando": revalidando
+    }
+
+def resultado_desde_scryfall(data):
+    """Convertir una carta de Scryfall al formato de resultado del bot
+
+    Si Scryfall no tiene precio en USD el resultado lleva sin_precio=True y
+    PRECIO_SIN_DATOS como marcador; registrar() no lo guarda en SQLite.
+    """
+    usd = precio_usd(data)
+    precio = PRECIO_SIN_DATOS if usd is None else usd
+    return {
+        "nombre": data["name"],
+        "edicion": data.get("set_name", "No disponible"),
+        "coleccion": data.get("set", "No disponible"),
+        "precio": precio,
+        "fechas": [datetime.now().strftime("%Y-%m-%d")],
+        "precios": [precio * (1 + i*0.05) for i in range(6)],
+        "predicciones": None,
+        **indicadores.SIN_DATOS,
+        "image_url": data.get("image_uris", {}).get("normal", ""),
+        "scryfall_id": data.get("id"),
+        "numero": data.get("collector_number"),
+        "sin_precio": usd is None
+    }
+
+def analisis_guardado(conn, scryfall_id):
+    """Indicadores y predicción ya calculados de una impresión"""
+    valores = indicadores.valores_por_scryfall(conn, scryfall_id)
+    valores["predicciones"] = price_predictor.prediccion_por_scryfall(conn, scryfall_id)
+    return valores
+
+def analisis_guardados(conn, scryfall_ids):
+    """analisis_guardado() de varias impresiones en una sola lectura"""
+    return [analisis_guardado(conn, scryfall_id) for scryfall_id in scryfall_ids]
+
+def carta_local(conn, nombre, edicion=None, scryfall_id=None):
+    """Resultado en el formato del bot a partir de SQLite, o None si la carta no está guardada"""
+    fila = precios_db.carta_actual(conn, nombre, edicion, scryfall_id)
+    if fila is None:
+        return None
+    impresion_id, nombre, edicion, coleccion, numero, image_url, scryfall_id, precio, ts = fila
+    resultado = {
+        "nombre": nombre,
+        "edicion": edicion or "No disponible",
+        "coleccion": coleccion or "No disponible",
+        "precio": precio,
+        "fechas": [precios_db.ts_a_fecha(ts)],
+        "precios": [precio],
+        "predicciones": price_predictor.prediccion(conn, impresion_id),
+        "image_url": image_url or "",
+        "scryfall_id": scryfall_id,
+        "numero": numero,
+        "impresion_id": impresion_id,
+        "frescura": frescura("sqlite", ts)
+    }
+    resultado.update(indicadores.valores(conn, impresion_id))
+    return resultado
+
+def importar_json_legado(conn, archivos=ARCHIVOS_LEGADO):
+    """Importar una sola vez los precios de las cachés JSON antiguas
+
+    Cada archivo es un dict nombre -> carta o nombre -> [cartas]; el precio se
+    guarda con la fecha de modificación del archivo. Los archivos importados se
+    anotan en SQLite y no se tocan. Devuelve las cartas importadas.
+    """
+    total = 0
+    try:
+        for archivo in archivos:
+            if not os.path.exists(archivo) or precios_db.archivo_importado(conn, archivo):
+                continue
+            with open(archivo, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            ts = int(os.path.getmtime(archivo))
+            observaciones = []
+            for valor in datos.values():
+                for carta in (valor if isinstance(valor, list) else [valor]):
+                    if not carta.get("nombre") or carta.get("precio") is None:
+                        continue
+                    observaciones.append({
+                        "nombre": carta["nombre"],
+                        "edicion": carta.get("edicion"),
+                        "coleccion": carta.get("coleccion"),
+                        "precio": float(carta["precio"]),
+                        "image_url": carta.get("image_url") or None,
+                        "scryfall_id": carta.get("scryfall_id") or id_en_url(carta.get("image_url")),
+                        "ts": ts
+                    })
+            if observaciones:
+                precios_db.registrar_observaciones(conn, observaciones)
+            total += len(observaciones)
+            precios_db.marcar_importado(conn, archivo)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return total
+
+class RepositorioCartas:
+    """Punto único de acceso a los precios de las cartas
+
+    - Lectura: memoria (TTL + LRU), después SQLite y por último Scryfall.
+    - Escritura: lo que llega de la red se guarda en memoria y se encola en el
+      buffer de observaciones, que lo vuelca a SQLite.
+    - Stale-while-revalidate: si la copia local está obsoleta se pide a
+      Scryfall, pero si tarda más de ESPERA_RED o falla se responde con la copia
+      local y la petición sigue en segundo plano para refrescarla.
+    Cada resultado lleva en "frescura" su origen y antigüedad.
+    """
+
+    def __init__(self, db, observaciones, consultar_red, memoria=None, espera_red=ESPERA_RED):
+        self.db = db
+        self.observaciones = observaciones
+        self.consultar_red = consultar_red
+        self.memoria = memoria or CachePrecios()
+        self.espera_red = espera_red
+        self.consultas = VueloUnico()
+        self.peticiones_red = VueloUnico()
+        self._revalidaciones = set()
+        self.servidas_locales = 0
+        self.servidas_obsoletas = 0
+
+    def registrar(self, nombre, edicion, resultado):
+        """Guardar un resultado recién obtenido de la red en memoria y, vía buffer, en SQLite
+
+        Los resultados sin precio en USD sólo se guardan en memoria (con su TTL):
+        su precio es sólo un marcador y contaminaría el historial, los
+        indicadores y los portafolios, pero no hace falta volver a pedirlos.
+        """
+        resultado["frescura"] = frescura("scryfall", time.time())
+        if not resultado.get("sin_precio"):
+            self.observaciones.agregar(resultado)
+        self.memoria.guardar(nombre, edicion, resultado)
+
+    def en_memoria(self, nombre, edicion=None):
+        """Resultado vigente en memoria, o None"""
+        resultado = self.memoria.obtener(nombre, edicion)
+        if resultado is not None and "frescura" in resultado:
+            resultado["frescura"] = frescura("memoria", resultado["frescura"]["actualizado"])
+        return resultado
+
+    async def obtener(self, nombre, edicion=None, scryfall_id=None, prioridad=INTERACTIVA):
+        """Carta con su precio desde la capa más cercana que tenga datos válidos"""
+        resultado = self.en_memoria(nombre, edicion)
+        if resultado is not None:
+            return resultado
+        # Búsquedas simultáneas de la misma carta comparten una única consulta
+        return await self.consultas.ejecutar(normalizar_clave(nombre, edicion),
+                                             self._obtener, nombre, edicion, scryfall_id, prioridad)
+
+    async def _obtener(self, nombre, edicion, scryfall_id, prioridad):
+        local = await self.db.leer(carta_local, nombre, edicion, scryfall_id)
+        if local is not None and local["frescura"]["estado"] == "fresco":
+            self.servidas_locales += 1
+            self.memoria.guardar(nombre, edicion, local)
+            return local
+
+        red = asyncio.ensure_future(self.peticiones_red.ejecutar(
+            normalizar_clave(nombre, edicion), self._desde_red, nombre, edicion, scryfall_id, prioridad))
+        if local is None:
+            return await red
+
+        try:
+            resultado = await asyncio.wait_for(asyncio.shield(red), self.espera_red)
+        except asyncio.TimeoutError:
+            # Scryfall va lento: responder ya y dejar que la petición termine de refrescar los datos
+            self._revalidaciones.add(red)
+            red.add_done_callback(self._fin_revalidacion)
+            self.servidas_obsoletas += 1
+            local["frescura"]["revalidando"] = True
+            return local
+
+        if "error" in resultado:
+            self.servidas_obsoletas += 1
+            return local
+        return resultado
+
+    def _fin_revalidacion(self, tarea):
+        self._revalidaciones.discard(tarea)
+        if not tarea.cancelled():
+            tarea.exception()  # nadie más espera el resultado: no dejar la excepción sin recoger
+
+    async def obtener_varias(self, consultas, prioridad=INTERACTIVA, forzar=False):
+        """Resultados de muchas cartas [(nombre, edicion, scryfall_id)] pidiendo a /cards/collection en lotes de 75
+
+        Las que ya están en memoria no se piden salvo con forzar=True. Devuelve
+        (valores, faltantes, limitadas): dict consulta -> resultado, las consultas
+        que Scryfall no devolvió, para buscarlas una a una si hace falta, y las de
+        lotes que recibieron 429, que no conviene volver a pedir enseguida.
+        """
+        valores = {}
+        pendientes = []
+        for consulta in dict.fromkeys(consultas):
+            resultado = None if forzar else self.en_memoria(consulta[0], consulta[1])
+            if resultado is not None:
+                valores[consulta] = resultado
+            else:
+                pendientes.append(consulta)
+        if not pendientes:
+            return valores, [], []
+
+        identificadores = [{"id": scryfall_id} if scryfall_id else {"name": nombre}
+                           for nombre, _, scryfall_id in pendientes]
+        try:
+            cartas, _, sin_pedir = await scryfall_client.obtener_colecciones(identificadores, prioridad)
+        except Exception as e:
+            print(f"⚠️ Error consultando /cards/collection: {str(e)}")
+            cartas, sin_pedir = [], []
+        sin_pedir = {id(identificador) for identificador in sin_pedir}
+
+        # Relacionar cada carta devuelta con la consulta (incluye la cara frontal de cartas dobles)
+        por_id = {}
+        por_nombre = {}
+        for data in cartas:
+            por_id[data.get("id")] = data
+            por_nombre[data["name"].lower()] = data
+            por_nombre[data["name"].split(" // ")[0].lower()] = data
+
+        encontradas = []
+        faltantes = []
+        limitadas = []
+        for consulta, identificador in zip(pendientes, identificadores):
+            nombre, _, scryfall_id = consulta
+            data = por_id.get(scryfall_id) if scryfall_id else por_nombre.get(nombre.lower())
+            if data is None and id(identificador) in sin_pedir:
+                limitadas.append(consulta)
+            elif data is None:
+                faltantes.append(consulta)
+            else:
+                encontradas.append((consulta, resultado_desde_scryfall(data)))
+
+        # Indicadores y predicción del historial guardado, para que la copia en memoria esté completa
+        analisis = await self.db.leer(analisis_guardados, [resultado["scryfall_id"] for _, resultado in encontradas])
+        for (consulta, resultado), valores_guardados in zip(encontradas, analisis):
+            resultado.update(valores_guardados)
+            self.registrar(consulta[0], consulta[1], resultado)
+            valores[consulta] = resultado
+        return valores, faltantes, limitadas
+
+    async def impresion_id(self, resultado):
+        """Id de la impresión en SQLite, volcando el buffer o consultando la base de datos si hace falta"""
+        impresion_id = await self.observaciones.impresion_id(resultado)
+        if impresion_id is None and resultado.get("scryfall_id"):
+            fila = await self.db.leer(precios_db.carta_actual, scryfall_id=resultado["scryfall_id"])
+            impresion_id = fila[0] if fila else None
+        return impresion_id
+
+    async def _desde_red(self, nombre, edicion, scryfall_id, prioridad):
+        resultado = await self.consultar_red(nombre, scryfall_id, prioridad)
+        if "error" not in resultado and "nombre" in resultado:
+            self.registrar(nombre, edicion, resultado)
+        return resultado
+
+    def estadisticas(self):
+        """Métricas del repositorio y de su caché en memoria"""
+        return {
+            **self.memoria.estadisticas(),
+            "locales": self.servidas_locales,
+            "obsoletas": self.servidas_obsoletas,
+            "revalidando": len(self._revalidaciones),
+            "coalescidas": self.consultas.coalescidas,
+            "ejecutadas": self.consultas.ejecutadas
+        }
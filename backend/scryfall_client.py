@@ -0,0 +1,103 @@
+﻿import asyncio
+import httpx
+from backend.limitador import LimitadorTokens, LimiteExcedido, INTERACTIVA
+
+# Configuración del cliente de Scryfall
+SCRYFALL_API = "https://api.scryfall.com"
+TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+LIMITES = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+LOTE_COLECCION = 75  # máximo de identificadores por petición a /cards/collection
+CABECERAS = {
+    "User-Agent": "MTGValueBot/1.0",
+    "Accept": "application/json"
+}
+
+_cliente = None
+
+# Límite compartido por todas las llamadas a la API (no aplica a las imágenes de cards.scryfall.io)
+limitador = LimitadorTokens()
+
+def obtener_cliente():
+    """Obtener el cliente HTTP compartido (pool de conexiones keep-alive)"""
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = httpx.AsyncClient(
+            base_url=SCRYFALL_API,
+            timeout=TIMEOUT,
+            limits=LIMITES,
+            headers=CABECERAS
+        )
+    return _cliente
+
+async def get(ruta, params=None, timeout=None, prioridad=INTERACTIVA):
+    """Hacer una petición GET a Scryfall usando el pool compartido y el limitador"""
+    cliente = obtener_cliente()
+    if timeout is None:
+        return await limitador.ejecutar(lambda: cliente.get(ruta, params=params), prioridad)
+    return await limitador.ejecutar(lambda: cliente.get(ruta, params=params, timeout=timeout), prioridad)
+
+async def obtener_carta(nombre, prioridad=INTERACTIVA):
+    """Buscar una carta por nombre exacto"""
+    return await get("/cards/named", params={"exact": nombre}, prioridad=prioridad)
+
+async def obtener_carta_por_id(scryfall_id, prioridad=INTERACTIVA):
+    """Obtener una impresión concreta por su id de Scryfall"""
+    return await get(f"/cards/{scryfall_id}", prioridad=prioridad)
+
+async def buscar_cartas(consulta, prioridad=INTERACTIVA):
+    """Buscar cartas con la sintaxis de Scryfall"""
+    return await get("/cards/search", params={"q": consulta}, prioridad=prioridad)
+
+async def obtener_coleccion(identificadores, prioridad=INTERACTIVA):
+    """Resolver hasta 75 identificadores en una sola petición a /cards/collection"""
+    cliente = obtener_cliente()
+    response = await limitador.ejecutar(
+        lambda: cliente.post("/cards/collection", json={"identifiers": identificadores}), prioridad)
+    response.raise_for_status()
+    data = response.json()
+    return data.get("data", []), data.get("not_found", [])
+
+async def obtener_colecciones(identificadores, prioridad=INTERACTIVA):
+    """Resolver cualquier número de identificadores en lotes concurrentes de 75
+
+    Devuelve (cartas, no encontradas, limitadas): los identificadores de los
+    lotes que siguieron recibiendo 429 van aparte, porque no significa que
+    Scryfall no los reconozca.
+    """
+    lotes = [identificadores[i:i + LOTE_COLECCION] for i in range(0, len(identificadores), LOTE_COLECCION)]
+    respuestas = await asyncio.gather(*(obtener_coleccion(lote, prioridad) for lote in lotes), return_exceptions=True)
+
+    cartas = []
+    no_encontradas = []
+    limitadas = []
+    for lote, respuesta in zip(lotes, respuestas):
+        if isinstance(respuesta, LimiteExcedido):
+            limitadas.extend(lote)
+            continue
+        if isinstance(respuesta, Exception):
+            print(f"⚠️ Error en lote de /cards/collection: {str(respuesta)}")
+            no_encontradas.extend(lote)
+            continue
+        data, faltantes = respuesta
+        cartas.extend(data)
+        no_encontradas.extend(faltantes)
+    if limitadas:
+        print(f"⏳ Límite de Scryfall: {len(limitadas)} identificadores de /cards/collection sin pedir")
+    return cartas, no_encontradas, limitadas
+
+async def descargar(url, timeout=None):
+    """Descargar un recurso binario (por ejemplo, la imagen de una carta)
+
+    Las imágenes se sirven desde cards.scryfall.io, que no tiene límite de peticiones.
+    """
+    cliente = obtener_cliente()
+    response = await cliente.get(url, timeout=timeout or TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+async def cerrar_cliente():
+    """Cerrar el pool de conexiones"""
+    global _cliente
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
@@ -0,0 +1,40 @@
+﻿import time
+
+# Tipos de suscripción
+ALERTAS = "alertas"
+RESUMEN_DIARIO = "resumen_diario"
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS suscripciones (
+    chat_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    fecha_alta INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, tipo)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_suscripciones_tipo ON suscripciones (tipo, chat_id);
+'''
+
+def inicializar_esquema(conn):
+    """Crear la tabla de suscripciones si no existe"""
+    conn.executescript(ESQUEMA)
+
+def suscribir(conn, chat_id, tipo):
+    """Dar de alta una suscripción (sin commit); devuelve False si ya existía"""
+    cur = conn.execute("INSERT OR IGNORE INTO suscripciones (chat_id, tipo, fecha_alta) VALUES (?, ?, ?)",
+                       (chat_id, tipo, int(time.time())))
+    return cur.rowcount > 0
+
+def desuscribir(conn, chat_id, tipo):
+    """Dar de baja una suscripción (sin commit); devuelve False si no existía"""
+    cur = conn.execute("DELETE FROM suscripciones WHERE chat_id = ? AND tipo = ?", (chat_id, tipo))
+    return cur.rowcount > 0
+
+def esta_suscrito(conn, chat_id, tipo):
+    """Comprobar si un chat tiene una suscripción activa"""
+    fila = conn.execute("SELECT 1 FROM suscripciones WHERE chat_id = ? AND tipo = ?", (chat_id, tipo)).fetchone()
+    return fila is not None
+
+def suscriptores(conn, tipo):
+    """Lista de chats suscritos a un tipo de aviso"""
+    return [fila[0] for fila in conn.execute("SELECT chat_id FROM suscripciones WHERE tipo = ?", (tipo,))]
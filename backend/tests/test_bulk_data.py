@@ -0,0 +1,51 @@
+﻿import json
+import pytest
+from backend.bulk_data import iterar_cartas_bulk, precio_usd
+
+CARTAS = [
+    {"id": "a1", "name": "Black Lotus", "prices": {"usd": "25000.00"}},
+    {"id": "b2", "name": "Fire // Ice", "oracle_text": "Ñ, comas, [corchetes] y \"comillas\"", "prices": {"usd": None}},
+    {"id": "c3", "name": "Sol Ring", "prices": {"usd": "1.50"}, "legalities": {"vintage": "restricted"}}
+]
+
+def escribir(tmp_path, texto):
+    ruta = tmp_path / "bulk.json"
+    ruta.write_text(texto, encoding="utf-8")
+    return ruta
+
+@pytest.mark.parametrize("tamano_bloque", [1, 2, 3, 7, 16, 64, 1 << 20])
+def test_bloques_de_cualquier_tamano(tmp_path, tamano_bloque):
+    # Con bloques pequeños las cartas, las cadenas y los separadores quedan partidos entre lecturas
+    ruta = escribir(tmp_path, json.dumps(CARTAS, indent=1, ensure_ascii=False))
+    assert list(iterar_cartas_bulk(ruta, tamano_bloque)) == CARTAS
+
+@pytest.mark.parametrize("tamano_bloque", [1, 5, 1 << 20])
+def test_formato_compacto_y_lista_vacia(tmp_path, tamano_bloque):
+    ruta = escribir(tmp_path, json.dumps(CARTAS, separators=(",", ":")))
+    assert list(iterar_cartas_bulk(ruta, tamano_bloque)) == CARTAS
+    assert list(iterar_cartas_bulk(escribir(tmp_path, " [ ]\n"), tamano_bloque)) == []
+
+@pytest.mark.parametrize("corte", [1, 40, -2, -1])
+def test_archivo_truncado(tmp_path, corte):
+    texto = json.dumps(CARTAS, indent=1)
+    ruta = escribir(tmp_path, texto[:corte])
+    with pytest.raises(ValueError):
+        list(iterar_cartas_bulk(ruta, 8))
+
+def test_cartas_anteriores_al_corte(tmp_path):
+    texto = json.dumps(CARTAS)
+    ruta = escribir(tmp_path, texto[:texto.index('{"id": "c3"') + 5])
+    leidas = []
+    with pytest.raises(ValueError):
+        for carta in iterar_cartas_bulk(ruta, 4):
+            leidas.append(carta)
+    assert leidas == CARTAS[:2]
+
+def test_no_es_una_lista(tmp_path):
+    with pytest.raises(ValueError):
+        list(iterar_cartas_bulk(escribir(tmp_path, '{"object": "error"}')))
+
+def test_precio_usd():
+    assert precio_usd(CARTAS[0]) == 25000.0
+    assert precio_usd(CARTAS[1]) is None
+    assert precio_usd({"name": "Sin precios"}) is None
@@ -0,0 +1,93 @@
+﻿import math
+import random
+import sqlite3
+import numpy as np
+import pytest
+from backend import precios_db
+from backend import indicadores
+from backend.indicadores import PERIODO_RSI, PERIODO_MEDIA, ALFA_EMA
+
+def referencia(precios):
+    """RSI de Wilder, SMA, EMA y volatilidad calculados de la forma más directa posible"""
+    cambios = [b - a for a, b in zip(precios, precios[1:])]
+    rsi = None
+    if len(cambios) >= PERIODO_RSI:
+        ganancia = sum(max(c, 0) for c in cambios[:PERIODO_RSI]) / PERIODO_RSI
+        perdida = sum(max(-c, 0) for c in cambios[:PERIODO_RSI]) / PERIODO_RSI
+        for c in cambios[PERIODO_RSI:]:
+            ganancia = (ganancia * (PERIODO_RSI - 1) + max(c, 0)) / PERIODO_RSI
+            perdida = (perdida * (PERIODO_RSI - 1) + max(-c, 0)) / PERIODO_RSI
+        rsi = 50.0 if ganancia + perdida == 0 else 100 * ganancia / (ganancia + perdida)
+
+    sma = sum(precios[-PERIODO_MEDIA:]) / PERIODO_MEDIA if len(precios) >= PERIODO_MEDIA else None
+    ema = precios[0]
+    for precio in precios[1:]:
+        ema += ALFA_EMA * (precio - ema)
+
+    retornos = [math.log(b / a) for a, b in zip(precios, precios[1:])][-PERIODO_MEDIA:]
+    volatilidad = None
+    if len(retornos) >= 2:
+        media = sum(retornos) / len(retornos)
+        volatilidad = math.sqrt(sum((r - media) ** 2 for r in retornos) / (len(retornos) - 1)) * 100
+    return rsi, sma, ema, volatilidad
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    precios_db.inicializar_esquema(conn)
+    for i in range(4):
+        precios_db.obtener_impresion(conn, f"Carta {i}", "Edición", "set", scryfall_id=f"id-{i}")
+    yield conn
+    conn.close()
+
+def estado(conn):
+    return conn.execute(f"SELECT impresion_id, {', '.join(indicadores.CAMPOS)}, ventana, rsi, sma, volatilidad "
+                        "FROM indicadores ORDER BY impresion_id").fetchall()
+
+def test_valores_conocidos(conn):
+    # Sube de uno en uno: sin pérdidas el RSI es 100 y la SMA de 1..20 es 10.5
+    precios_db.registrar_precios(conn, [(1, 1000 + i, float(i)) for i in range(1, 21)])
+    valores = indicadores.valores(conn, 1)
+    assert valores["rsi"] == 100.0
+    assert valores["sma"] == 10.5
+
+    # Precio plano: RSI neutro y volatilidad cero
+    precios_db.registrar_precios(conn, [(2, 1000 + i, 7.0) for i in range(20)])
+    assert indicadores.valores(conn, 2) == {"rsi": 50.0, "sma": 7.0, "ema": 7.0, "volatilidad": 0.0}
+
+@pytest.mark.parametrize("n", [1, 2, PERIODO_RSI, PERIODO_RSI + 1, PERIODO_MEDIA, 60])
+def test_coincide_con_la_referencia(conn, n):
+    aleatorio = random.Random(n)
+    precios = [round(aleatorio.uniform(5, 50), 2) for _ in range(n)]
+    for i, precio in enumerate(precios):
+        precios_db.registrar_precios(conn, [(1, 1000 + 3600 * i, precio)])
+
+    # Los valores guardados están redondeados: basta con que coincidan en el último decimal
+    valores = indicadores.valores(conn, 1)
+    for clave, esperado in zip(("rsi", "sma", "ema", "volatilidad"), referencia(precios)):
+        if esperado is None:
+            assert valores[clave] is None
+        else:
+            assert valores[clave] == pytest.approx(esperado, abs=0.1 if clave == "rsi" else 0.01)
+
+def test_incremental_igual_que_reconstruir(conn):
+    aleatorio = random.Random(7)
+    filas = [(impresion_id, 1000 + 60 * t, round(aleatorio.uniform(1, 30), 2))
+             for impresion_id in range(1, 5) for t in range(aleatorio.randint(3, 50))]
+    aleatorio.shuffle(filas)
+    # Lotes desordenados entre impresiones, alguno con observaciones atrasadas y un reemplazo del mismo ts
+    filas.sort(key=lambda fila: (fila[1] // 600, aleatorio.random()))
+    for i in range(0, len(filas), 17):
+        precios_db.registrar_precios(conn, filas[i:i + 17])
+    impresion_id, ts, _ = max(filas, key=lambda fila: fila[1])
+    precios_db.registrar_precios(conn, [(impresion_id, ts, 99.0)])
+
+    incremental = estado(conn)
+    indicadores.reconstruir(conn)
+    reconstruido = estado(conn)
+    assert len(incremental) == 4
+    for a, b in zip(incremental, reconstruido):
+        assert a[:3] == b[:3]  # impresion_id, n, ts
+        assert a[-3:] == pytest.approx(b[-3:], nan_ok=True)
+        assert a[3:-4] == pytest.approx(b[3:-4])
+        assert np.frombuffer(a[-4]) == pytest.approx(np.frombuffer(b[-4]), nan_ok=True)
@@ -0,0 +1,26 @@
+﻿from backend.indice_nombres import IndiceNombres
+
+def indice():
+    indice = IndiceNombres()
+    for impresion_id, (nombre, edicion, coleccion) in enumerate([
+            ("Lightning Blast", "Tempest", "tmp"), ("Fireball", "Limited Edition Alpha", "lea"),
+            ("Counterspell", "Limited Edition Alpha", "lea"), ("Urza's Saga", "Urza's Saga", "usg")], 1):
+        indice.agregar(impresion_id, nombre, edicion, coleccion)
+    return indice
+
+def test_resolver_solo_nombres_exactos():
+    # Cartas reales que aún no están guardadas no se cambian por otra parecida
+    for consulta in ("Lightning Bolt", "Firebolt", "Countersquall", "Countrspell"):
+        assert indice().resolver(consulta) is None
+
+def test_resolver_nombre_y_edicion():
+    carta = indice().resolver("urzas saga")
+    assert (carta["nombre"], carta["edicion"]) == ("Urza's Saga", None)
+    carta = indice().resolver("Counterspell alpha")
+    assert (carta["nombre"], carta["coleccion"], carta["impresion_id"]) == ("Counterspell", "lea", 3)
+    assert indice().resolver("Countrspell alpha") is None
+
+def test_sugerencias_empiezan_por_la_mas_cercana():
+    assert indice().sugerencias("Countersquall")[0] == "Counterspell"
+    assert indice().sugerencias("Firebal")[0] == "Fireball"
+    assert indice().sugerencias("") == []
@@ -0,0 +1,60 @@
+﻿import asyncio
+from backend.limitador import LimitadorTokens, INTERACTIVA, FONDO
+
+def test_prioridad_interactiva_adelanta_a_fondo():
+    async def escenario():
+        limitador = LimitadorTokens(tasa=50, capacidad=1)
+        await limitador.adquirir()  # agotar el cubo para que todas esperen en la cola
+        orden = []
+
+        async def pedir(etiqueta, prioridad):
+            await limitador.adquirir(prioridad)
+            orden.append(etiqueta)
+
+        # Las de fondo llegan antes, pero las interactivas se atienden primero y cada grupo en orden de llegada
+        await asyncio.gather(pedir("fondo-1", FONDO), pedir("fondo-2", FONDO), pedir("usuario-1", INTERACTIVA),
+                             pedir("fondo-3", FONDO), pedir("usuario-2", INTERACTIVA))
+        return orden, limitador.estadisticas()
+
+    orden, estadisticas = asyncio.run(escenario())
+    assert orden == ["usuario-1", "usuario-2", "fondo-1", "fondo-2", "fondo-3"]
+    assert estadisticas["esperas"] == 5
+    assert estadisticas["en_cola"] == 0
+
+def test_espera_cancelada_no_bloquea_la_cola():
+    async def escenario():
+        limitador = LimitadorTokens(tasa=50, capacidad=1)
+        await limitador.adquirir()
+        orden = []
+
+        async def pedir(etiqueta, prioridad):
+            await limitador.adquirir(prioridad)
+            orden.append(etiqueta)
+
+        cancelada = asyncio.ensure_future(pedir("cancelada", INTERACTIVA))
+        fondo = asyncio.ensure_future(pedir("fondo", FONDO))
+        await asyncio.sleep(0)
+        cancelada.cancel()
+        await asyncio.wait_for(fondo, 1)
+        return orden, limitador.estadisticas()
+
+    orden, estadisticas = asyncio.run(escenario())
+    assert orden == ["fondo"]
+    assert estadisticas["en_cola"] == 0
+
+def test_lotes_con_429_no_cuentan_como_no_encontrados(monkeypatch):
+    from backend import scryfall_client
+    from backend.limitador import LimiteExcedido
+
+    async def obtener_coleccion(lote, prioridad):
+        if lote[0]["name"] == "limitada":
+            raise LimiteExcedido(5)
+        return [{"name": "Fireball"}], [{"name": "no existe"}]
+
+    monkeypatch.setattr(scryfall_client, "LOTE_COLECCION", 1)
+    monkeypatch.setattr(scryfall_client, "obtener_coleccion", obtener_coleccion)
+    cartas, no_encontradas, limitadas = asyncio.run(
+        scryfall_client.obtener_colecciones([{"name": "Fireball"}, {"name": "limitada"}]))
+    assert cartas == [{"name": "Fireball"}]
+    assert no_encontradas == [{"name": "no existe"}]
+    assert limitadas == [{"name": "limitada"}]
@@ -0,0 +1,87 @@
+﻿import sqlite3
+import pytest
+from backend import precios_db
+from backend import usuarios_db
+from backend import portafolio
+
+CHAT = 42
+T0 = 1_700_000_000
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    precios_db.inicializar_esquema(conn)
+    usuarios_db.inicializar_esquema(conn)
+    portafolio.inicializar_esquema(conn)
+    yield conn
+    conn.close()
+
+def precio(conn, nombre, valor, ts=T0):
+    precios_db.registrar_observaciones(conn, [{"nombre": nombre, "edicion": "Alpha", "coleccion": "lea",
+                                               "precio": valor, "scryfall_id": nombre.lower()}], ts=ts)
+
+def restantes(conn, nombre):
+    return conn.execute("SELECT restante FROM lotes WHERE usuario_id = ? AND carta_nombre = ? ORDER BY id",
+                        (CHAT, nombre)).fetchall()
+
+def test_venta_fifo(conn):
+    portafolio.comprar(conn, CHAT, "sol ring", 2, 1.0, ts=T0)
+    portafolio.comprar(conn, CHAT, "sol ring", 3, 4.0, ts=T0 + 10)
+    portafolio.comprar(conn, CHAT, "sol ring", 1, 10.0, ts=T0 - 10)  # el lote más antiguo, aunque se anote el último
+
+    # 4 unidades a 5: salen 1 a 10, 2 a 1 y 1 a 4
+    assert portafolio.vender(conn, CHAT, "sol ring", 4, 5.0, ts=T0 + 20) == pytest.approx(4 * 5.0 - (10.0 + 2 * 1.0 + 4.0))
+    assert restantes(conn, "sol ring") == [(0,), (2,), (0,)]
+    assert conn.execute("SELECT cantidad, precio_compra FROM portafolio WHERE usuario_id = ?", (CHAT,)).fetchone() == (2, 4.0)
+
+    # Sin unidades suficientes no cambia nada
+    assert portafolio.vender(conn, CHAT, "sol ring", 3, 5.0) is None
+    assert restantes(conn, "sol ring") == [(0,), (2,), (0,)]
+
+    assert portafolio.vender(conn, CHAT, "sol ring", 2, 3.0) == pytest.approx(2 * 3.0 - 2 * 4.0)
+    assert conn.execute("SELECT 1 FROM portafolio WHERE usuario_id = ?", (CHAT,)).fetchone() is None
+    assert portafolio.valorar(conn, CHAT)["realizada"] == pytest.approx(4.0 - 2.0)
+
+def test_valorar(conn):
+    precio(conn, "Sol Ring", 3.0)
+    precio(conn, "Black Lotus", 100.0, ts=T0 + 60)
+    portafolio.comprar(conn, CHAT, "sol ring", 2, 1.5, ts=T0)
+    portafolio.comprar(conn, CHAT, "black lotus", 1, 80.0, ts=T0)
+    portafolio.comprar(conn, CHAT, "carta inventada", 1, 9.0, ts=T0)
+
+    resumen = portafolio.valorar(conn, CHAT)
+    assert [carta["nombre"] for carta in resumen["cartas"]] == ["black lotus", "sol ring", "carta inventada"]
+    assert resumen["valor"] == pytest.approx(106.0)
+    assert resumen["coste"] == pytest.approx(83.0)  # las cartas sin precio no cuentan
+    assert resumen["no_realizada"] == pytest.approx(23.0)
+    assert resumen["sin_precio"] == ["carta inventada"]
+    assert resumen["ts"] == T0 + 60
+    sol_ring = resumen["cartas"][1]
+    assert (sol_ring["cantidad"], sol_ring["valor"], sol_ring["porcentaje"]) == (2, 6.0, pytest.approx(100.0))
+
+def test_lotes_sin_coste(conn):
+    precio(conn, "Sol Ring", 2.0)
+    portafolio.comprar(conn, CHAT, "sol ring", 3, 0.0, ts=T0)  # cartas regaladas o abiertas en sobres
+
+    carta = portafolio.valorar(conn, CHAT)["cartas"][0]
+    assert (carta["coste"], carta["valor"], carta["ganancia"]) == (0.0, 6.0, 6.0)
+    assert carta["porcentaje"] is None
+
+    assert portafolio.vender(conn, CHAT, "sol ring", 1, 2.5) == pytest.approx(2.5)
+    resumen = portafolio.valorar(conn, CHAT)
+    assert resumen["realizada"] == pytest.approx(2.5)
+    assert resumen["cartas"][0]["porcentaje"] is None
+
+def test_snapshot_solo_de_hoy(conn):
+    precio(conn, "Sol Ring", 3.0)
+    portafolio.comprar(conn, CHAT, "sol ring", 2, 1.0, ts=T0)
+    assert portafolio.registrar_snapshots(conn) == 1
+    hoy = conn.execute("SELECT dia FROM snapshots_portafolio").fetchone()[0]
+    assert portafolio.historial(conn, CHAT) == [(hoy, 6.0, 2.0)]
+
+    # Al arrancar no se pisa la foto ya guardada; el trabajo diario sí la actualiza
+    precio(conn, "Sol Ring", 5.0, ts=T0 + 10)
+    portafolio.registrar_snapshots(conn, reemplazar=False)
+    assert portafolio.historial(conn, CHAT) == [(hoy, 6.0, 2.0)]
+    portafolio.registrar_snapshots(conn)
+    assert portafolio.historial(conn, CHAT) == [(hoy, 10.0, 2.0)]
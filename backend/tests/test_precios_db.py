@@ -0,0 +1,88 @@
+﻿import sqlite3
+import pytest
+from backend import precios_db
+from backend import indicadores
+from backend.models import price_predictor
+
+HORA = 3600
+DIA = 86400
+T0 = 1_700_000_000 - 1_700_000_000 % DIA
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    precios_db.inicializar_esquema(conn)
+    yield conn
+    conn.close()
+
+def observacion(precio, ts, scryfall_id="id-1"):
+    return {"nombre": "Sol Ring", "edicion": "Alpha", "coleccion": "lea", "precio": precio,
+            "scryfall_id": scryfall_id, "ts": ts}
+
+def historial(conn):
+    return conn.execute("SELECT ts - ?, precio, repeticiones FROM precios ORDER BY ts, impresion_id", (T0,)).fetchall()
+
+def test_precio_igual_solo_se_verifica(conn):
+    filas, cambios = precios_db.registrar_cambios(conn, [observacion(10.0, T0)])
+    assert cambios == filas == [(1, T0, 10.0)]
+
+    filas, cambios = precios_db.registrar_cambios(conn, [observacion(10.001, T0 + HORA)])
+    assert filas == [(1, T0 + HORA, 10.001)] and cambios == []
+    assert historial(conn) == [(0, 10.0, 1)]
+    assert conn.execute("SELECT ts FROM verificaciones WHERE impresion_id = 1").fetchone() == (T0 + HORA,)
+    assert conn.execute("SELECT precio, ts FROM precios_actuales").fetchone() == (10.0, T0 + HORA)
+    assert conn.execute("SELECT n, ts FROM indicadores").fetchone() == (2, T0 + HORA)
+
+def test_precio_distinto_se_guarda(conn):
+    precios_db.registrar_cambios(conn, [observacion(10.0, T0)])
+    filas, cambios = precios_db.registrar_cambios(conn, [observacion(12.0, T0 + 2 * DIA), observacion(5.0, T0, "id-2")])
+    assert filas == [(1, T0 + 2 * DIA, 12.0), (2, T0, 5.0)]
+    assert sorted(cambios) == filas
+    assert historial(conn) == [(0, 10.0, 0), (0, 5.0, 0), (2 * DIA, 12.0, 0)]
+    # Referencia de 24h: la última observación de hace al menos un día
+    assert conn.execute("SELECT precio, precio_24h FROM precios_actuales WHERE impresion_id = 1").fetchone() == (12.0, 10.0)
+
+def test_verificacion_antigua_no_cuenta_como_observacion(conn):
+    precios_db.registrar_cambios(conn, [observacion(10.0, T0 + DIA)])
+    filas, cambios = precios_db.registrar_cambios(conn, [observacion(10.0, T0)])
+    assert cambios == []
+    assert historial(conn) == [(DIA, 10.0, 0)]
+    assert conn.execute("SELECT n FROM indicadores").fetchone() == (1,)
+
+def test_precio_estable_alimenta_indicadores_y_prediccion(conn):
+    for k in range(40):
+        precios_db.registrar_cambios(conn, [observacion(5.0, T0 + k * DIA)])
+    assert historial(conn) == [(0, 5.0, 39)]
+    assert indicadores.valores(conn, 1) == {"rsi": 50.0, "sma": 5.0, "ema": 5.0, "volatilidad": 0.0}
+    assert price_predictor.prediccion(conn, 1) == [5.0] * price_predictor.HORIZONTES
+    # Las ventanas se miden desde la última verificación, no desde la única fila guardada
+    assert conn.execute("SELECT ts, precio_7d, precio_30d FROM precios_actuales").fetchone() == (T0 + 39 * DIA, 5.0, 5.0)
+
+def test_repeticiones_igual_que_reconstruir(conn):
+    precios = [10, 11, 11, 11, 12, 12, 9, 9, 9, 9, 10, 13, 13] * 3
+    for k, precio in enumerate(precios):
+        precios_db.registrar_cambios(conn, [observacion(float(precio), T0 + k * 12 * HORA)])
+    consulta = f"SELECT {', '.join(indicadores.CAMPOS)}, rsi, sma, volatilidad FROM indicadores"
+    incremental = conn.execute(consulta).fetchone()
+    assert incremental[0] == len(precios)
+
+    indicadores.reconstruir(conn)
+    assert conn.execute(consulta).fetchone() == pytest.approx(incremental)
+
+def test_cubeta(conn):
+    precios_db.registrar_cambios(conn, [observacion(10.0, T0 + 10 * 60)], cubeta=HORA)
+    # Mismo precio en la misma cubeta: se verifica pero no es otra observación
+    precios_db.registrar_cambios(conn, [observacion(10.0, T0 + 20 * 60)], cubeta=HORA)
+    assert historial(conn) == [(10 * 60, 10.0, 0)]
+    assert conn.execute("SELECT n FROM indicadores").fetchone() == (1,)
+
+    # Precio nuevo en la misma cubeta: reemplaza la fila, con su propio ts
+    precios_db.registrar_cambios(conn, [observacion(12.0, T0 + 50 * 60)], cubeta=HORA)
+    assert historial(conn) == [(50 * 60, 12.0, 0)]
+    assert conn.execute("SELECT precio, ts FROM precios_actuales").fetchone() == (12.0, T0 + 50 * 60)
+    assert conn.execute("SELECT n, ts FROM indicadores").fetchone() == (1, T0 + 50 * 60)
+
+    # En la cubeta siguiente vuelve a contar
+    precios_db.registrar_cambios(conn, [observacion(12.0, T0 + 70 * 60)], cubeta=HORA)
+    assert historial(conn) == [(50 * 60, 12.0, 1)]
+    assert conn.execute("SELECT n FROM indicadores").fetchone() == (2,)
@@ -0,0 +1,70 @@
+﻿import random
+import sqlite3
+import pytest
+from backend import precios_db
+from backend.models import price_predictor
+from backend.models.price_predictor import AMORTIGUACION, DIA, MIN_DIAS
+
+def holt(serie, alfa, beta):
+    """Holt amortiguado sobre una serie diaria completa: (nivel, tendencia) tras el último día"""
+    nivel, tendencia = serie[0], 0.0
+    for precio in serie[1:]:
+        nuevo = alfa * precio + (1 - alfa) * (nivel + AMORTIGUACION * tendencia)
+        nivel, tendencia = nuevo, beta * (nuevo - nivel) + (1 - beta) * AMORTIGUACION * tendencia
+    return nivel, tendencia
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    precios_db.inicializar_esquema(conn)
+    precios_db.obtener_impresion(conn, "Carta", "Edición", "set", scryfall_id="id-1")
+    yield conn
+    conn.close()
+
+def parametros(conn):
+    return conn.execute("SELECT alfa, beta, nivel, tendencia, dia, n, n_ajuste FROM predicciones WHERE impresion_id = 1").fetchone()
+
+def test_sin_historial_suficiente(conn):
+    for dia in range(MIN_DIAS - 1):
+        precios_db.registrar_precios(conn, [(1, dia * DIA + 3600, 10.0 + dia)])
+    assert price_predictor.prediccion(conn, 1) is None
+
+def test_incremental_igual_que_reajuste_con_alfa_y_beta_fijos(conn):
+    aleatorio = random.Random(3)
+    serie = {}
+    for dia in range(40):
+        if dia in (15, 16, 17):
+            continue  # días sin precio: se rellenan con el último conocido
+        precio = round(20 + dia * 0.3 + aleatorio.uniform(-2, 2), 2)
+        precios_db.registrar_precios(conn, [(1, dia * DIA + 3600, precio)])
+        if dia == 20:
+            # Otro precio del mismo día: rehace el último paso
+            precio = round(precio + 1.5, 2)
+            precios_db.registrar_precios(conn, [(1, dia * DIA + 7200, precio)])
+        serie[dia] = precio
+
+    alfa, beta, nivel, tendencia, ultimo_dia, n, n_ajuste = parametros(conn)
+    assert ultimo_dia == 39 and n == 40
+    assert n_ajuste < n  # los últimos días se han incorporado sin reajustar
+
+    diaria = []
+    for dia in range(40):
+        diaria.append(serie.get(dia, diaria[-1] if diaria else None))
+    esperado_nivel, esperado_tendencia = holt(diaria, alfa, beta)
+    assert nivel == pytest.approx(esperado_nivel)
+    assert tendencia == pytest.approx(esperado_tendencia)
+
+    h = price_predictor.DIAS_HORIZONTE
+    esperado = round(esperado_nivel + AMORTIGUACION * (1 - AMORTIGUACION ** h) / (1 - AMORTIGUACION) * esperado_tendencia, 2)
+    assert price_predictor.prediccion(conn, 1)[0] == pytest.approx(esperado, abs=0.01)
+
+def test_precio_atrasado_reajusta_desde_el_historial(conn):
+    for dia in range(10):
+        precios_db.registrar_precios(conn, [(1, dia * DIA + 3600, 10.0 + dia)])
+    precios_db.registrar_precios(conn, [(1, 4 * DIA + 7200, 30.0)])
+    alfa, beta, nivel, tendencia, ultimo_dia, n, n_ajuste = parametros(conn)
+    assert n == n_ajuste == 10
+
+    diaria = [10.0 + dia for dia in range(10)]
+    diaria[4] = 30.0
+    assert (nivel, tendencia) == pytest.approx(holt(diaria, alfa, beta))
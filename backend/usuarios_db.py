@@ -0,0 +1,88 @@
+﻿import os
+import json
+from datetime import datetime
+from backend.precios_db import FORMATO_FECHA, archivo_importado, marcar_importado
+
+# Archivos JSON que se usaban antes de guardar usuarios y portafolios en SQLite
+USUARIOS_FILE = "usuarios_activos.json"
+PORTAFOLIO_FILE = "usuarios_portafolio.json"
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS usuarios (
+    chat_id INTEGER PRIMARY KEY,
+    username TEXT,
+    fecha_registro TEXT
+);
+
+CREATE TABLE IF NOT EXISTS portafolio (
+    usuario_id INTEGER,
+    carta_nombre TEXT,
+    cantidad INTEGER,
+    precio_compra REAL,
+    fecha_compra TEXT
+);
+'''
+
+def inicializar_esquema(conn):
+    """Crear las tablas de usuarios y portafolio y la clave única de cada posición"""
+    conn.executescript(ESQUEMA)
+    # Las filas duplicadas de versiones antiguas impedirían crear el índice único
+    conn.execute('''
+        DELETE FROM portafolio WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM portafolio GROUP BY usuario_id, carta_nombre
+        )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_portafolio_usuario_carta ON portafolio (usuario_id, carta_nombre)")
+    conn.commit()
+
+def registrar_usuario(conn, chat_id, username=None):
+    """Dar de alta un usuario (sin commit); devuelve False si ya estaba registrado"""
+    cur = conn.execute("INSERT OR IGNORE INTO usuarios (chat_id, username, fecha_registro) VALUES (?, ?, ?)",
+                       (chat_id, username, datetime.now().strftime(FORMATO_FECHA)))
+    return cur.rowcount > 0
+
+def contar_usuarios(conn):
+    """Número de usuarios registrados"""
+    return conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+
+def ultimos_usuarios(conn, limite=5):
+    """Usuarios registrados más recientemente: [(chat_id, username)]"""
+    return conn.execute("SELECT chat_id, username FROM usuarios ORDER BY fecha_registro DESC, rowid DESC LIMIT ?",
+                        (limite,)).fetchall()
+
+def importar_json(conn, usuarios_file=USUARIOS_FILE, portafolio_file=PORTAFOLIO_FILE):
+    """Importar una sola vez los archivos JSON antiguos
+
+    Devuelve (usuarios, cartas) importados. Las filas que ya existan en SQLite
+    no se sobrescriben. Cada importación se anota en la tabla importaciones
+    (de precios_db) en lugar de renombrar los archivos.
+    """
+    usuarios = cartas = 0
+    try:
+        if os.path.exists(usuarios_file) and not archivo_importado(conn, usuarios_file):
+            with open(usuarios_file, "r") as f:
+                chat_ids = json.load(f)
+            cur = conn.executemany("INSERT OR IGNORE INTO usuarios (chat_id, username, fecha_registro) VALUES (?, NULL, NULL)",
+                                   [(int(chat_id),) for chat_id in chat_ids])
+            usuarios = cur.rowcount
+            marcar_importado(conn, usuarios_file)
+
+        if os.path.exists(portafolio_file) and not archivo_importado(conn, portafolio_file):
+            with open(portafolio_file, "r") as f:
+                portafolios = json.load(f)
+            filas = [
+                (int(chat_id), nombre, datos.get("cantidad", 1), datos.get("precio_compra", 0), datos.get("fecha_compra"))
+                for chat_id, cartas_usuario in portafolios.items()
+                for nombre, datos in cartas_usuario.items()
+            ]
+            cur = conn.executemany('''
+                INSERT OR IGNORE INTO portafolio (usuario_id, carta_nombre, cantidad, precio_compra, fecha_compra)
+                VALUES (?, ?, ?, ?, ?)
+            ''', filas)
+            cartas = cur.rowcount
+            marcar_importado(conn, portafolio_file)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return usuarios, cartas
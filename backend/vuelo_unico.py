@@ -0,0 +1,39 @@
+﻿import asyncio
+
+class VueloUnico:
+    """Agrupar llamadas concurrentes con la misma clave en una sola ejecución
+
+    Mientras una consulta está en curso, el resto de peticiones con la misma
+    clave esperan su resultado en lugar de lanzar otra llamada a Scryfall y
+    otra escritura en la base de datos.
+    """
+
+    def __init__(self):
+        self._en_curso = {}
+        self.ejecutadas = 0
+        self.coalescidas = 0
+
+    async def ejecutar(self, clave, funcion, *args):
+        """Ejecutar funcion(*args) o esperar la ejecución pendiente con la misma clave"""
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            self.ejecutadas += 1
+            tarea = asyncio.ensure_future(funcion(*args))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(clave, t))
+        else:
+            self.coalescidas += 1
+        # shield: si un usuario cancela su petición, la compartida sigue para los demás
+        return await asyncio.shield(tarea)
+
+    def _terminar(self, clave, tarea):
+        if self._en_curso.get(clave) is tarea:
+            del self._en_curso[clave]
+
+    def estadisticas(self):
+        """Métricas de deduplicación"""
+        return {
+            "en_curso": len(self._en_curso),
+            "ejecutadas": self.ejecutadas,
+            "coalescidas": self.coalescidas
+        }
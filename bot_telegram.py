@@ -1,17 +1,36 @@
 ﻿import os
+import asyncio
+import time
 from dotenv import load_dotenv
 import logging
 from telegram.ext import Application, CommandHandler, ContextTypes, JobQueue
 from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
 import numpy as np
-import matplotlib.pyplot as plt
-from io import BytesIO
-from PIL import Image
-import requests
 from datetime import datetime, timedelta
-import sqlite3
-import json
+import multiprocessing
 import openai
+from backend import scryfall_client
+from backend.limitador import INTERACTIVA, FONDO, LimiteExcedido
+from backend import precios_db
+from backend import movers
+from backend import graficos
+from backend.cache_graficos import CacheGraficos, clave_grafico
+from backend.cache_imagenes import CacheImagenes, clave_imagen
+from backend.archivos_telegram import RegistroFileIds
+from backend import archivos_telegram
+from backend import suscripciones
+from backend import alertas_carta as alertas_carta_db
+from backend.indice_nombres import IndiceNombres
+from backend import usuarios_db
+from backend import indicadores
+from backend.models import price_predictor
+from backend.base_datos import BaseDatos
+from backend.buffer_observaciones import BufferObservaciones, INTERVALO_VACIADO
+from backend.repositorio_cartas import RepositorioCartas, importar_json_legado, resultado_desde_scryfall, analisis_guardado
+from backend import precarga
+from backend import refresco
+from backend import portafolio
 
 # Configurar logging
 logging.basicConfig(
@@ -22,118 +41,104 @@ logging.basicConfig(
 # Cargar variables de entorno
 load_dotenv()
 
-# Conectar a la base de datos SQLite
+# Base de datos SQLite (WAL): los handlers usan db.leer / db.escribir. Se abre en
+# arrancar() y no al importar el módulo, porque los procesos del pool de gráficos
+# vuelven a importar este script y no deben repetir migraciones ni importaciones
 DB_FILE = "mtg_cards.db"
-conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-cursor = conn.cursor()
-
-# Crear tablas si no existen
-cursor.execute('''CREATE TABLE IF NOT EXISTS cartas (
-                  id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  nombre TEXT NOT NULL,
-                  edicion TEXT,
-                  coleccion TEXT,
-                  precio REAL,
-                  fecha TEXT,
-                  image_url TEXT,
-                  rsi REAL
-               )''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS usuarios (
-                  chat_id INTEGER PRIMARY KEY,
-                  username TEXT,
-                  fecha_registro TEXT
-               )''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS portafolio (
-                  usuario_id INTEGER,
-                  carta_nombre TEXT,
-                  cantidad INTEGER,
-                  precio_compra REAL,
-                  fecha_compra TEXT
-               )''')
-
-conn.commit()
-
-# Archivos del sistema
-USUARIOS_FILE = "usuarios_activos.json"
-PORTAFOLIO_FILE = "usuarios_portafolio.json"
-
-# Registro de usuarios
-if not os.path.exists(USUARIOS_FILE):
-    with open(USUARIOS_FILE, 'w') as f:
-        json.dump([], f)
-
-with open(USUARIOS_FILE, 'r') as f:
-    usuarios_registrados = set(json.load(f))
-
-def guardar_usuarios():
-    """Guardar usuarios registrados en un archivo"""
-    with open(USUARIOS_FILE, 'w') as f:
-        json.dump(list(usuarios_registrados), f, indent=2)
-
-# Sistema de portafolio
-if not os.path.exists(PORTAFOLIO_FILE):
-    with open(PORTAFOLIO_FILE, 'w') as f:
-        json.dump({}, f)
-
-with open(PORTAFOLIO_FILE, 'r') as f:
-    portafolios = json.load(f)
-
-def guardar_portafolio():
-    """Guardar portafolios en archivo"""
-    with open(PORTAFOLIO_FILE, 'w') as f:
-        json.dump(portafolios, f, indent=2)
-
-def cargar_historial():
-    """Cargar historial desde SQLite"""
-    cursor.execute("SELECT nombre, precio, fecha FROM cartas ORDER BY fecha DESC LIMIT 1000")
-    registros = cursor.fetchall()
-    
-    historial = {}
-    for registro in registros:
-        nombre, precio, fecha = registro
-        if nombre not in historial:
-            historial[nombre] = []
-        historial[nombre].append({"fecha": fecha, "precio": precio})
-    return historial
-
-def guardar_carta_en_db(nombre, edicion, coleccion, precio, image_url):
-    """Guardar carta en SQLite"""
-    cursor.execute('''
-        INSERT INTO cartas (nombre, edicion, coleccion, precio, fecha, image_url, rsi)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (nombre, edicion, coleccion, precio, datetime.now().strftime("%Y-%m-%d %H:%M"), image_url, None))
-    conn.commit()
-
-def buscar_en_scryfall(nombre):
-    """Buscar carta real desde Scryfall"""
+db = None
+
+# Valoraciones de portafolio ya calculadas, hasta que cambia el precio de alguna de sus cartas
+cache_portafolios = portafolio.CacheValoraciones()
+
+def indexar_carta(carta, impresion_id):
+    """Añadir al índice de nombres una impresión recién guardada y descartar las valoraciones que la incluyen"""
+    indice_nombres.agregar(impresion_id, carta["nombre"], carta.get("edicion"), carta.get("coleccion"), carta.get("scryfall_id"))
+    cache_portafolios.invalidar_carta(carta["nombre"])
+
+# Observaciones de precio de las consultas: se agrupan y se guardan por lotes (se crea en arrancar())
+observaciones = None
+
+async def vaciar_observaciones(context: ContextTypes.DEFAULT_TYPE):
+    """Volcado periódico del buffer de observaciones"""
+    await observaciones.vaciar()
+
+# Búsquedas de los usuarios, para precargar las cartas más pedidas
+demanda = precarga.ContadorDemanda()
+
+async def precalentar_cache(context: ContextTypes.DEFAULT_TYPE):
+    """Guardar la demanda anotada y refrescar las cartas más buscadas (al arrancar y periódicamente)"""
+    await demanda.volcar(db)
+    await precarga.precalentar(repositorio, db)
+
+async def guardar_snapshots_portafolio(context: ContextTypes.DEFAULT_TYPE):
+    """Foto diaria del valor de todos los portafolios: la del trabajo de las 23:30 es la del día"""
+    usuarios = await db.escribir(portafolio.registrar_snapshots)
+    if usuarios:
+        print(f"💼 Guardado el valor diario de {usuarios} portafolios")
+
+async def completar_snapshots_portafolio(context: ContextTypes.DEFAULT_TYPE):
+    """Al arrancar, guardar la foto de hoy si falta (los días pasados no se rellenan con los precios de ahora)"""
+    usuarios = await db.escribir(portafolio.registrar_snapshots, reemplazar=False)
+    if usuarios:
+        print(f"💼 Completado el valor diario de {usuarios} portafolios")
+
+async def refrescar_precios(context: ContextTypes.DEFAULT_TYPE):
+    """Refrescar los precios de las cartas seguidas o consultadas hace poco (sólo se guardan los cambios)"""
+    await refresco.refrescar(db, al_cambiar=lambda carta: cache_portafolios.invalidar_carta(carta["nombre"]))
+
+def texto_frescura(resultado):
+    """Origen y antigüedad del precio mostrado"""
+    frescura = resultado.get("frescura")
+    if not frescura:
+        return "\n🟠 Precio estimado (fuente alternativa)"
+    origenes = {"scryfall": "Scryfall", "memoria": "caché", "sqlite": "mtg_cards.db"}
+    minutos = frescura["antiguedad"] // 60
+    antiguedad = f"hace {minutos} min" if minutos < 120 else f"hace {minutos // 60} h"
+    if frescura["estado"] == "fresco":
+        return f"\n🟢 Datos obtenidos desde {origenes[frescura['origen']]} ({antiguedad})"
+    texto = f"\n🟡 Precio guardado {antiguedad}: Scryfall no respondió a tiempo"
+    return texto + (", actualizando en segundo plano" if frescura["revalidando"] else "")
+
+def texto_precio(resultado):
+    """Línea del precio actual; las cartas sin precio en USD no muestran el marcador de 0.01"""
+    if resultado.get("sin_precio"):
+        return "💰 Precio Actual: sin precio en USD\n"
+    return f"💰 Precio Actual: ${round(float(resultado['precio']), 2):.2f}\n"
+
+def texto_indicadores(resultado):
+    """Líneas de RSI, medias y volatilidad para los mensajes de una carta"""
+    if resultado.get("rsi") is None and resultado.get("ema") is None:
+        return "📊 RSI: sin historial suficiente\n"
+    texto = f"📊 RSI ({indicadores.PERIODO_RSI}): {resultado['rsi'] if resultado.get('rsi') is not None else 'N/D'}\n"
+    if resultado.get("sma") is not None:
+        texto += f"📈 SMA/EMA ({indicadores.PERIODO_MEDIA}): ${resultado['sma']:.2f} / ${resultado['ema']:.2f}\n"
+    elif resultado.get("ema") is not None:
+        texto += f"📈 EMA ({indicadores.PERIODO_MEDIA}): ${resultado['ema']:.2f}\n"
+    if resultado.get("volatilidad") is not None:
+        texto += f"🌊 Volatilidad: {resultado['volatilidad']:.2f}% por observación\n"
+    return texto
+
+# Respuesta para el usuario cuando Scryfall devuelve 429 de forma persistente
+MENSAJE_LIMITE = "⏳ Scryfall está limitando las peticiones ahora mismo. Vuelve a intentarlo en unos segundos."
+
+async def buscar_en_scryfall(nombre, scryfall_id=None, prioridad=INTERACTIVA):
+    """Buscar carta real desde Scryfall (una impresión concreta si se conoce su id)"""
     try:
-        response = requests.get(f"https://api.scryfall.com/cards/named?exact={nombre.replace(' ', '+')}")
+        if scryfall_id:
+            response = await scryfall_client.obtener_carta_por_id(scryfall_id, prioridad)
+        else:
+            response = await scryfall_client.obtener_carta(nombre, prioridad)
         if response.status_code != 200:
             return {"error": "Carta no encontrada"}
-        
-        data = response.json()
-        nombre_completo = data["name"]
-        edicion = data.get("set_name", "No disponible")
-        coleccion = data.get("set", "No disponible")
-        precio = float(data["prices"].get("usd", 0.01)) if data["prices"] else 0.01
-        image_url = data.get("image_uris", {}).get("normal", "")
 
-        # Guardar en base de datos 
-        guardar_carta_en_db(nombre_completo, edicion, coleccion, precio, image_url)
+        resultado = resultado_desde_scryfall(response.json())
+        # Indicadores y predicción ya calculados sobre el historial guardado (se cachean con el resultado)
+        resultado.update(await db.leer(analisis_guardado, resultado["scryfall_id"]))
 
-        return {
-            "nombre": nombre_completo,
-            "edicion": edicion,
-            "coleccion": coleccion,
-            "precio": precio,
-            "fechas": [datetime.now().strftime("%Y-%m-%d")],
-            "precios": [precio * (1 + i*0.05) for i in range(6)],
-            "predicciones": [precio * (1 + i*0.05) for i in range(6)],
-            "rsi": round(np.random.uniform(20, 80), 1),
-            "image_url": image_url
-        }
+        return resultado
+    except LimiteExcedido:
+        # Un 429 no significa que la carta no exista
+        return {"error": "Límite de peticiones de Scryfall", "limite": True}
     except Exception as e:
         print(f"⚠️ Error buscando en Scryfall: {str(e)}")
         return {"error": "No disponible"}
@@ -151,7 +156,7 @@ def buscar_en_magiccards(nombre):
             "fechas": [datetime.now().strftime("%Y-%m-%d")],
             "precios": [round(np.random.uniform(1, 100), 2)] * 5,
             "predicciones": [round(np.random.uniform(1, 100), 2)] * 6,
-            "rsi": round(np.random.uniform(20, 80), 1),
+            **indicadores.SIN_DATOS,
             "image_url": ""
         }
     except Exception as e:
@@ -171,22 +176,103 @@ def buscar_en_tcgplayer(nombre):
             "fechas": [datetime.now().strftime("%Y-%m-%d")],
             "precios": [round(np.random.uniform(1, 100), 2)] * 5,
             "predicciones": [round(np.random.uniform(1, 100), 2)] * 6,
-            "rsi": round(np.random.uniform(20, 80), 1),
+            **indicadores.SIN_DATOS,
             "image_url": ""
         }
     except Exception as e:
         print(f"⚠️ No se pudo buscar en TCGPlayer: {str(e)}")
         return {"error": "No disponible"}
 
-def buscar_carta(nombre, edicion=None):
+# Repositorio de cartas: memoria, SQLite y Scryfall (stale-while-revalidate si la red falla)
+repositorio = None
+
+# Índice local de nombres y ediciones para /buscar (prefijos y erratas)
+indice_nombres = None
+
+# Gráficos ya renderizados, imágenes de cartas (disco) y file_id de Telegram de los ya subidos (se crean en arrancar())
+cache_graficos = None
+cache_imagenes = None
+file_ids = None
+
+async def registrar_file_id(clave, file_id):
+    """Recordar un file_id en memoria y persistirlo"""
+    if file_ids.registrar(clave, file_id):
+        await db.escribir(archivos_telegram.guardar_file_id, clave, file_id)
+
+async def olvidar_file_id(clave):
+    """Descartar un file_id caducado en memoria y en la base de datos"""
+    if file_ids.olvidar(clave):
+        await db.escribir(archivos_telegram.borrar_file_id, clave)
+
+async def enviar_imagen_carta(enviar, image_url, scryfall_id=None, caption=None):
+    """Enviar la imagen de una carta por file_id si ya se subió; si no, desde la caché local"""
+    clave = "imagen:" + clave_imagen(image_url, scryfall_id)
+    file_id = file_ids.obtener(clave)
+    if file_id:
+        try:
+            return await enviar(photo=file_id, caption=caption)
+        except BadRequest:
+            await olvidar_file_id(clave)
+
+    contenido = await cache_imagenes.obtener(image_url, scryfall_id)
+    mensaje = await enviar(photo=contenido, caption=caption)
+    await registrar_file_id(clave, mensaje.photo[-1].file_id)
+    return mensaje
+
+async def enviar_grafico(enviar, funcion, *args):
+    """Enviar un gráfico reutilizando, por este orden, su file_id, el PNG en disco o un render nuevo
+
+    `enviar` recibe el parámetro photo y devuelve el mensaje enviado
+    (p. ej. update.message.reply_photo).
+    """
+    clave = clave_grafico(funcion, *args)
+    file_id = file_ids.obtener(clave)
+    if file_id:
+        try:
+            return await enviar(photo=file_id)
+        except BadRequest:
+            await olvidar_file_id(clave)
+
+    png = cache_graficos.leer(clave)
+    if png is None:
+        png = await graficos.renderizar(funcion, *args)
+        cache_graficos.guardar(clave, png)
+    mensaje = await enviar(photo=png)
+    await registrar_file_id(clave, mensaje.photo[-1].file_id)
+    return mensaje
+
+async def buscar_carta(nombre, edicion=None, scryfall_id=None, prioridad=INTERACTIVA):
     """Buscar carta desde múltiples fuentes"""
-    resultado = buscar_en_scryfall(nombre)
-    if "error" in resultado or "nombre" not in resultado:
-        resultado = buscar_en_magiccards(nombre)
+    resultado = await repositorio.obtener(nombre, edicion, scryfall_id, prioridad)
+    if "error" not in resultado and "nombre" in resultado:
+        if prioridad == INTERACTIVA:
+            demanda.anotar(resultado["nombre"], edicion, scryfall_id)
+        return resultado
+    if resultado.get("limite"):
+        return resultado
+
+    resultado = buscar_en_magiccards(nombre)
     if "error" in resultado or "nombre" not in resultado:
         resultado = buscar_en_tcgplayer(nombre)
     return resultado
 
+async def valorar_cartas(nombres):
+    """Obtener el precio de muchas cartas a la vez usando /cards/collection"""
+    encontradas, faltantes, limitadas = await repositorio.obtener_varias([(nombre, None, None) for nombre in nombres])
+    valores = {nombre: resultado for (nombre, _, _), resultado in encontradas.items()}
+
+    # Con 429 no se buscan una a una: solo serían más peticiones rechazadas
+    for nombre, _, _ in limitadas:
+        valores[nombre] = {"error": "Límite de peticiones de Scryfall", "limite": True}
+
+    # Las cartas que /cards/collection no reconoce (o si Scryfall falla) se buscan una a una
+    if faltantes:
+        nombres_faltantes = [nombre for nombre, _, _ in faltantes]
+        resultados = await asyncio.gather(*(buscar_carta(nombre) for nombre in nombres_faltantes))
+        valores.update(zip(nombres_faltantes, resultados))
+
+    return valores
+
 async def informar_admin(context: ContextTypes.DEFAULT_TYPE, mensaje: str):
     admin_id = os.getenv("ADMIN_CHAT_ID")
     if not admin_id:
@@ -199,16 +285,21 @@ async def informar_admin(context: ContextTypes.DEFAULT_TYPE, mensaje: str):
 # Variables globales
 seguimiento_activo = False
 cartas_seguimiento = ["Black Knight", "Force of Will", "Ancestral Recall"]
-alertas_por_usuario = {}
 intervalo_alertas = 21600  # cada 6 horas
 intervalo_dias = 1
+hora_resumen_diario = datetime.strptime("09:00", "%H:%M").time()
+hora_snapshot_portafolio = datetime.strptime("23:30", "%H:%M").time()
+envios_por_segundo = 25  # por debajo del límite global de Telegram (~30 mensajes/s)
+intervalo_alertas_carta = 300  # revisar alertas por carta cada 5 minutos
+
+# Índice invertido de alertas por carta (impresión -> chats suscritos)
+indice_alertas = None
+ultima_revision_alertas_carta = int(time.time())
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     nombre_usuario = update.effective_user.username or f"user_{chat_id}"
-    if chat_id not in usuarios_registrados:
-        usuarios_registrados.add(chat_id)
-        guardar_usuarios()
+    if await db.escribir(usuarios_db.registrar_usuario, chat_id, nombre_usuario):
         print(f"🟢 Nuevo usuario detectado: {chat_id} ({nombre_usuario})")
         await informar_admin(context, f"🆕 Usuario nuevo: {chat_id} – @{nombre_usuario}")
 
@@ -221,12 +312,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto += "/seguimiento – Activar actualización automática diaria\n"
     texto += "/detener_seguimiento – Detener búsqueda automática\n"
     texto += "/editar_lista add/remove <nombre> – Editar lista de seguimiento\n"
-    texto += "/top_inversiones – Mejores 10 oportunidades esta semana\n"
+    texto += "/top_inversiones [24h|7d|30d] – Mejores 10 oportunidades del periodo\n"
     texto += "/ranking_semanal – Cartas con mayor movimiento en 7 días\n"
     texto += "/calendario_venta <nombre> – Detectar buen momento para vender\n"
     texto += "/alerta_carta <nombre> on/off – Recibir alertas personalizadas por carta\n"
     texto += "/notificaciones_diarias on/off – Resumen matutino de oportunidades\n"
-    texto += "/mi_portafolio – Ver valor total invertido\n"
+    texto += "/mi_portafolio – Ver valor, coste y ganancias de tus cartas\n"
+    texto += "/mi_portafolio comprar|vender <cantidad> <precio> <nombre> – Registrar una compra o una venta\n"
+    texto += "/mi_portafolio historial – Evolución diaria del valor de tu portafolio\n"
     texto += "/comparar <nombre1> <nombre2> – Gráfico comparativo lado a lado\n"
     texto += "/activar_alertas – Recibir alertas automáticas cada 6 horas\n"
     texto += "/desactivar_alertas – Dejar de recibir alertas\n"
@@ -240,79 +333,57 @@ async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     nombre_completo = " ".join(context.args).strip()
-    palabras = context.args
-    ediciones_clave = ["alpha", "beta", "unlimited", "promo", "foil", "modern", "commander", "standard"]
-    edicion_input = None
-    nombre = nombre_completo
-
-    for i in range(len(palabras), 0, -1):
-        posible_edicion = " ".join(palabras[i-1:])
-        if any(ed in posible_edicion.lower() for ed in ediciones_clave):
-            nombre = " ".join(palabras[:i-1]) or palabras[0]
-            edicion_input = posible_edicion
-            break
-
-    resultado = buscar_carta(nombre, edicion_input)
+
+    # Nombre exacto y edición de una carta guardada con el índice local; si no
+    # lo es, se busca tal cual en Scryfall y las erratas sólo se sugieren si no existe
+    carta = indice_nombres.resolver(nombre_completo)
+    if carta:
+        nombre, edicion_input, scryfall_id = carta["nombre"], carta["edicion"], carta["scryfall_id"]
+    else:
+        nombre, edicion_input, scryfall_id = nombre_completo, None, None
+
+    resultado = await buscar_carta(nombre, edicion_input, scryfall_id)
+    if resultado.get("limite"):
+        await update.message.reply_text(MENSAJE_LIMITE)
+        return
     if "error" in resultado or "nombre" not in resultado:
-        await update.message.reply_text("🚫 No se encontró la carta.")
+        sugerencias = indice_nombres.sugerencias(nombre_completo)
+        texto = "🚫 No se encontró la carta."
+        if sugerencias:
+            texto += "\n\n🤔 ¿Quizás buscabas...?\n" + "\n".join(f"- {s}" for s in sugerencias)
+        await update.message.reply_text(texto)
         return
 
     texto = f"🎴 *{resultado['nombre']}*\n"
     texto += f"📦 Edición: {resultado.get('edicion', 'No disponible')}\n"
-    texto += f"💰 Precio Actual: ${round(float(resultado['precio']), 2):.2f}\n"
-    texto += f"📊 RSI: {resultado['rsi']}\n"
-    texto += "\n🟢 Datos obtenidos desde mtg_cards.db"
+    texto += texto_precio(resultado)
+    texto += texto_indicadores(resultado)
+    texto += texto_frescura(resultado)
     await update.message.reply_text(texto, parse_mode="Markdown")
 
     # Mostrar imagen si hay
     if resultado.get("image_url"):
         try:
-            response = requests.get(resultado["image_url"])
-            image_data = BytesIO(response.content)
-            img = Image.open(image_data)
-            img.save("carta_actual.jpg", "JPEG")
-            await update.message.reply_photo(photo=open("carta_actual.jpg", "rb"), caption="🖼️ Imagen de la carta")
+            await enviar_imagen_carta(update.message.reply_photo, resultado["image_url"],
+                                      resultado.get("scryfall_id"), caption="🖼️ Imagen de la carta")
         except Exception as e:
             await update.message.reply_text(f"⚠️ No se pudo cargar la imagen: {str(e)}")
 
+    if resultado.get("sin_precio"):
+        return
+
     # Gráfico 1: Precios históricos
     fechas_grafico = [datetime.now() - timedelta(days=i*7) for i in range(6)]
     precios = [float(resultado["precio"]) * (1 + i*0.05) for i in range(6)]
+    await enviar_grafico(update.message.reply_photo, graficos.historial, fechas_grafico, precios, f"📈 Evolución de Precios - {nombre}")
 
-    plt.style.use('dark_background')
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(fechas_grafico, precios, label="Precio Real", marker='o', color="#00ffcc", linewidth=2, markersize=6)
-    ax.set_title(f"📈 Evolución de Precios - {nombre}", fontsize=14, pad=20)
-    ax.set_xlabel("Fecha", fontsize=12)
-    ax.set_ylabel("Precio USD", fontsize=12)
-    ax.grid(True, linestyle='--', alpha=0.5)
-    ax.legend(loc='upper left')
-    plt.xticks(rotation=45, fontsize=10)
-    plt.yticks(fontsize=10)
-    plt.tight_layout()
-    plt.savefig("grafico_historico_mejorado.png", dpi=150, bbox_inches='tight')
-    plt.close()
-    await update.message.reply_document(document=open("grafico_historico_mejorado.png", "rb"))
-
-    # Gráfico 2: Predicción futura
-    predicciones = resultado["predicciones"]
-    fechas_pred = [datetime.now() + timedelta(days=i*30) for i in range(1, 7)]
-    predicciones = resultado["predicciones"][:6]
-
-    plt.style.use('dark_background')
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(fechas_pred, predicciones, 'r--', label="Predicción", linewidth=2)
-    ax.set_title("🔮 Predicción de precios futuros (6 meses)", fontsize=14, pad=20)
-    ax.set_xlabel("Fecha", fontsize=12)
-    ax.set_ylabel("Precio Estimado", fontsize=12)
-    ax.grid(True, linestyle='--', alpha=0.5)
-    ax.legend(loc='upper left')
-    plt.xticks(rotation=45, fontsize=10)
-    plt.yticks(fontsize=10)
-    plt.tight_layout()
-    plt.savefig("grafico_prediccion_mejorado.png", dpi=150, bbox_inches='tight')
-    plt.close()
-    await update.message.reply_document(document=open("grafico_prediccion_mejorado.png", "rb"))
+    # Gráfico 2: Predicción futura (parámetros ya ajustados, sólo se evalúa la tendencia)
+    predicciones = resultado.get("predicciones")
+    if not predicciones:
+        await update.message.reply_text("📉 Aún no hay historial suficiente para predecir el precio.")
+        return
+    fechas_pred = [datetime.now() + timedelta(days=i*price_predictor.DIAS_HORIZONTE) for i in range(1, len(predicciones) + 1)]
+    await enviar_grafico(update.message.reply_photo, graficos.prediccion, fechas_pred, predicciones, "🔮 Predicción de precios futuros (6 meses)")
 
 async def listar_ediciones(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
@@ -321,7 +392,7 @@ async def listar_ediciones(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     nombre = " ".join(context.args).strip()
     try:
-        response = requests.get(f"https://api.scryfall.com/cards/search?q={nombre.replace(' ', '+')}")
+        response = await scryfall_client.buscar_cartas(nombre)
         if response.status_code != 200:
             await update.message.reply_text("🚫 No se encontraron ediciones.")
             return
@@ -333,53 +404,30 @@ async def listar_ediciones(update: Update, context: ContextTypes.DEFAULT_TYPE):
             texto += f"{idx}. {edicion} | ${precio:.2f}\n"
         texto += "\n👉 Usa `/buscar <nombre> <edición>` para ver detalles."
         await update.message.reply_text(texto, parse_mode="Markdown")
+    except LimiteExcedido:
+        await update.message.reply_text(MENSAJE_LIMITE)
     except Exception as e:
         await update.message.reply_text(f"⚠️ Error obteniendo ediciones: {str(e)}")
 
+# Títulos de cada ventana de /top_inversiones
+TITULOS_VENTANA = {
+    "24h": "últimas 24 horas",
+    "7d": "última semana",
+    "30d": "último mes"
+}
+
 async def top_inversiones(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    historial = cargar_historial()
-    if not historial:
-        await update.message.reply_text("📉 No hay datos suficientes para calcular inversiones.")
-        return
-
-    resultados_ascenso = []
-
-    for clave in historial:
-        registros = historial[clave]
-        if len(registros) >= 2:
-            primer_registro = registros[0]
-            ultimo_registro = registros[-1]
-            fecha_fin = datetime.strptime(ultimo_registro["fecha"], "%Y-%m-%d %H:%M")
-            dias_cambio = (datetime.now() - fecha_fin).days
-
-            if dias_cambio <= 7:
-                precio_inicio = float(primer_registro["precio"])
-                precio_fin = float(ultimo_registro["precio"])
-
-                if precio_inicio > 0 and precio_fin > 0:
-                    cambio_porcentaje = ((precio_fin - precio_inicio) / precio_inicio) * 100
-                    if cambio_porcentaje >= 0.5:
-                        resultados_ascenso.append({
-                            "nombre": clave.split(" - ")[0],
-                            "inicio": precio_inicio,
-                            "fin": precio_fin,
-                            "cambio": cambio_porcentaje
-                        })
+    ventana = context.args[0].lower() if context.args else "7d"
+    if ventana not in movers.VENTANAS:
+        await update.message.reply_text("Uso: `/top_inversiones [24h|7d|30d]`", parse_mode="Markdown")
+        return
 
+    resultados_ascenso = await db.leer(movers.calcular_movers, ventana, limite=10)
     if not resultados_ascenso:
-        await update.message.reply_text("🔍 No hay movimientos significativos esta semana.")
+        await update.message.reply_text("🔍 No hay movimientos significativos en este periodo.")
         return
 
-    # Eliminar duplicados por nombre 
-    resultados_unicos = {}
-    for item in resultados_ascenso:
-        key = item["nombre"]
-        if key not in resultados_unicos or item["cambio"] > resultados_unicos[key]["cambio"]:
-            resultados_unicos[key] = item
-
-    resultados_ascenso = sorted(resultados_unicos.values(), key=lambda x: x["cambio"], reverse=True)
-
-    texto = "*Top Inversiones MTG (última semana)*\n\n"
+    texto = f"*Top Inversiones MTG ({TITULOS_VENTANA[ventana]})*\n\n"
     for idx, item in enumerate(resultados_ascenso[:10], 1):
         texto += f"{idx}. {item['nombre']}\n"
         texto += f"   💸 De ${item['inicio']:.2f} → ${item['fin']:.2f} (+{item['cambio']:.2f}%)\n\n"
@@ -387,63 +435,141 @@ async def top_inversiones(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(texto, parse_mode="Markdown")
 
     # Gráfico opcional
-    nombres_graf = []
-    inicio_graf = []
-    fin_graf = []
-    porcentaje_graf = []
-
-    for item in resultados_ascenso[:10]:
-        nombres_graf.append(item["nombre"])
-        inicio_graf.append(item["inicio"])
-        fin_graf.append(item["fin"])
-        porcentaje_graf.append(item["cambio"])
-
-    plt.style.use('dark_background')
-    fig, ax = plt.subplots(figsize=(12, 6))
-    scatter = ax.scatter(inicio_graf, porcentaje_graf, s=100, c=porcentaje_graf, cmap="viridis", alpha=0.9)
-    ax.set_title("📊 Top Cartas – Porcentaje de Subida vs Precio Actual", fontsize=14, pad=20)
-    ax.set_xlabel("Precio Actual (USD)", fontsize=12)
-    ax.set_ylabel("Cambio (%)", fontsize=12)
-    ax.grid(True, linestyle='--', alpha=0.5)
-    for i, nombre in enumerate(nombres_graf):
-        ax.text(inicio_graf[i], porcentaje_graf[i], nombre, fontsize=9, ha='right')
-    plt.colorbar(scatter, label="Cambio (%)")
-    plt.tight_layout()
-    plt.savefig("grafico_top_inversiones.png", dpi=150, bbox_inches='tight')
-    plt.close()
-    await update.message.reply_document(document=open("grafico_top_inversiones.png", "rb"))
+    top = resultados_ascenso[:10]
+    await enviar_grafico(
+        update.message.reply_photo,
+        graficos.oportunidades,
+        [item["nombre"] for item in top],
+        [item["inicio"] for item in top],
+        [item["cambio"] for item in top],
+        "📊 Top Cartas – Porcentaje de Subida vs Precio Actual"
+    )
 
 async def ranking_semanal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await top_inversiones(update, context)
 
+# Cartas listadas en /mi_portafolio (los totales incluyen todas)
+MAX_CARTAS_PORTAFOLIO = 30
+
+def texto_importe(importe):
+    """Importe con signo explícito: +$1.50 / -$0.25"""
+    return f"{'-' if importe < 0 else '+'}${abs(importe):.2f}"
+
+def texto_porcentaje(porcentaje):
+    """Porcentaje con signo, o N/D si no tiene sentido (coste 0)"""
+    return "N/D" if porcentaje is None else f"{porcentaje:+.2f}%"
+
+async def valoracion_portafolio(chat_id):
+    """Valoración del portafolio desde la caché o con los precios guardados en SQLite"""
+    resumen = cache_portafolios.obtener(chat_id)
+    if resumen is not None:
+        return resumen
+    resumen = await db.leer(portafolio.valorar, chat_id)
+    if resumen["sin_precio"]:
+        # Cartas sin ningún precio guardado: pedirlas a Scryfall, guardarlas y volver a valorar
+        await valorar_cartas(resumen["sin_precio"])
+        await observaciones.vaciar()
+        resumen = await db.leer(portafolio.valorar, chat_id)
+    cache_portafolios.guardar(chat_id, resumen)
+    return resumen
+
+async def historial_portafolio(update: Update, chat_id):
+    """/mi_portafolio historial: curva del valor diario guardado frente a lo invertido"""
+    puntos = await db.leer(portafolio.historial, chat_id)
+    if len(puntos) < 2:
+        await update.message.reply_text("📉 Aún no hay historial suficiente: se guarda el valor de tu portafolio una vez al día.")
+        return
+
+    dias, valores, costes = (list(columna) for columna in zip(*puntos))
+    fechas = [datetime.fromtimestamp(dia * portafolio.DIA) for dia in dias]
+    await enviar_grafico(update.message.reply_photo, graficos.portafolio, fechas, valores, costes, "💼 Valor del portafolio")
+    cambio = valores[-1] - valores[0]
+    texto = f"📅 Desde {fechas[0].strftime('%Y-%m-%d')}: ${valores[0]:.2f} → ${valores[-1]:.2f} ({texto_importe(cambio)}"
+    texto += f", {cambio / valores[0] * 100:+.2f}%)" if valores[0] > 0 else ")"
+    await update.message.reply_text(texto)
+
+async def movimiento_portafolio(update: Update, chat_id, args):
+    """/mi_portafolio comprar|vender <cantidad> <precio> <nombre>"""
+    uso = "Uso: `/mi_portafolio comprar|vender <cantidad> <precio> <nombre>`"
+    if len(args) < 4:
+        await update.message.reply_text(uso, parse_mode="Markdown")
+        return
+    try:
+        cantidad = int(args[1])
+        precio = float(args[2].lstrip("$").replace(",", "."))
+    except ValueError:
+        await update.message.reply_text(uso, parse_mode="Markdown")
+        return
+    if cantidad <= 0 or precio < 0:
+        await update.message.reply_text("🚫 La cantidad debe ser positiva y el precio no puede ser negativo.")
+        return
+
+    nombre = " ".join(args[3:]).strip()
+    carta = indice_nombres.resolver(nombre)
+    if carta:
+        nombre = carta["nombre"]
+    elif args[0].lower() == "comprar":
+        # Carta aún no guardada: comprobar en Scryfall que existe antes de anotar el lote
+        resultado = await repositorio.obtener(nombre)
+        if resultado.get("limite"):
+            await update.message.reply_text(MENSAJE_LIMITE)
+            return
+        if "error" in resultado or "nombre" not in resultado:
+            texto = f"🚫 No se encontró la carta `{nombre}`."
+            sugerencias = indice_nombres.sugerencias(nombre)
+            if sugerencias:
+                texto += "\n\n🤔 ¿Quizás buscabas...?\n" + "\n".join(f"- {s}" for s in sugerencias)
+            await update.message.reply_text(texto, parse_mode="Markdown")
+            return
+        nombre = resultado["nombre"]
+    nombre = nombre.lower()
+    if args[0].lower() == "comprar":
+        await db.escribir(portafolio.comprar, chat_id, nombre, cantidad, precio)
+        texto = f"🛒 Añadidas {cantidad} × `{nombre}` a ${precio:.2f}"
+    else:
+        ganancia = await db.escribir(portafolio.vender, chat_id, nombre, cantidad, precio)
+        if ganancia is None:
+            await update.message.reply_text(f"🚫 No tienes {cantidad} unidades de `{nombre}`", parse_mode="Markdown")
+            return
+        texto = f"💵 Vendidas {cantidad} × `{nombre}` a ${precio:.2f}. Ganancia realizada: {texto_importe(ganancia)}"
+    cache_portafolios.invalidar(chat_id)
+    await update.message.reply_text(texto, parse_mode="Markdown")
+
 async def mi_portafolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    if str(chat_id) not in portafolios:
-        portafolios[str(chat_id)] = {}
-        guardar_portafolio()
+    if context.args and context.args[0].lower() in ("comprar", "vender"):
+        await movimiento_portafolio(update, chat_id, context.args)
+        return
+    if context.args and context.args[0].lower() == "historial":
+        await historial_portafolio(update, chat_id)
+        return
 
-    user_portfolio = portafolios.get(str(chat_id), {})
-    if not user_portfolio:
-        await update.message.reply_text("💼 Tu portafolio está vacío. Usa `/alerta_carta <nombre> on` para empezar.")
+    resumen = await valoracion_portafolio(chat_id)
+    if not resumen["cartas"] and not resumen["realizada"]:
+        await update.message.reply_text("💼 Tu portafolio está vacío. Usa `/mi_portafolio comprar <cantidad> <precio> <nombre>` "
+                                        "para empezar.", parse_mode="Markdown")
         return
 
     texto = "📦 *Tu Portafolio de Inversión*\n\n"
-    total_valor = 0
-    for nombre, datos in user_portfolio.items():
-        cantidad = datos.get("cantidad", 1)
-        precio_compra = datos.get("precio_compra", 0)
-        resultado = buscar_carta(nombre)
-        if "error" in resultado:
-            continue
-        precio_actual = float(resultado["precio"])
-        ganancia = ((precio_actual - precio_compra) / precio_compra) * 100
-        texto += f"{nombre}\n"
-        texto += f"   💰 Compraste a: ${precio_compra:.2f}\n"
-        texto += f"   💵 Valor actual: ${precio_actual:.2f} (+{ganancia:.2f}%)\n"
-        texto += f"   🔢 Cantidad: {cantidad}\n\n"
-        total_valor += precio_actual * cantidad
-
-    texto += f"💸 *Valor total*: ${total_valor:.2f}"
+    for carta in resumen["cartas"][:MAX_CARTAS_PORTAFOLIO]:
+        texto += f"{carta['nombre']}\n"
+        texto += f"   💰 Coste medio: ${carta['coste'] / carta['cantidad']:.2f}\n"
+        if carta["precio"] is None:
+            texto += "   💵 Valor actual: sin precio disponible\n"
+        else:
+            texto += f"   💵 Valor actual: ${carta['precio']:.2f} ({texto_porcentaje(carta['porcentaje'])})\n"
+        texto += f"   🔢 Cantidad: {carta['cantidad']}\n\n"
+    ocultas = len(resumen["cartas"]) - MAX_CARTAS_PORTAFOLIO
+    if ocultas > 0:
+        texto += f"… y {ocultas} cartas más\n\n"
+
+    porcentaje = resumen["no_realizada"] / resumen["coste"] * 100 if resumen["coste"] > 0 else None
+    texto += f"💸 *Valor total*: ${resumen['valor']:.2f}\n"
+    texto += f"🧾 Coste: ${resumen['coste']:.2f}\n"
+    texto += f"📈 Ganancia no realizada: {texto_importe(resumen['no_realizada'])} ({texto_porcentaje(porcentaje)})\n"
+    texto += f"✅ Ganancia realizada: {texto_importe(resumen['realizada'])}"
+    if resumen["sin_precio"]:
+        texto += f"\n⚠️ {len(resumen['sin_precio'])} cartas sin precio no cuentan en los totales"
     await update.message.reply_text(texto, parse_mode="Markdown")
 
 async def calendario_venta(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -452,63 +578,106 @@ async def calendario_venta(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     nombre = " ".join(context.args).strip()
-    resultado = buscar_carta(nombre)
+    resultado = await buscar_carta(nombre)
+    if resultado.get("limite"):
+        await update.message.reply_text(MENSAJE_LIMITE)
+        return
     if "error" in resultado:
         await update.message.reply_text(f"🚫 No se encontró `{nombre}`")
         return
 
     texto = f"📅 Calendario de venta óptimo para {nombre}\n"
     texto += f"📦 Edición: {resultado.get('edicion', 'No disponible')}\n"
-    texto += f"💰 Precio Actual: ${round(float(resultado['precio']), 2):.2f}\n"
-    if "rsi" in resultado and resultado["rsi"] is not None:
+    texto += texto_precio(resultado)
+    texto += texto_indicadores(resultado)
+    if resultado.get("rsi") is not None:
         rsi = float(resultado["rsi"])
-        texto += f"📊 RSI: {rsi}\n"
         if rsi < 30:
             texto += "🟢 Muy buena oportunidad de compra\n"
         elif 30 <= rsi <= 70:
             texto += "🟡 Precio estable – espera mejor momento\n"
         else:
             texto += "🔴 Buena oportunidad de venta\n"
+    else:
+        texto += "ℹ️ Aún no hay suficientes precios guardados para recomendar un momento de venta\n"
+    if resultado.get("sma") is not None:
+        tendencia = "por encima" if float(resultado["precio"]) >= resultado["sma"] else "por debajo"
+        texto += f"↕️ El precio está {tendencia} de su media de {indicadores.PERIODO_MEDIA} observaciones\n"
 
     await update.message.reply_text(texto, parse_mode="Markdown")
 
 async def alerta_carta(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    if not context.args:
+    if len(context.args) < 2:
         await update.message.reply_text("Uso: `/alerta_carta <nombre> on/off`", parse_mode="Markdown")
         return
 
-    nombre = context.args[0].strip().lower()
-    accion = context.args[1].strip().lower()
-
-    if str(chat_id) not in portafolios:
-        portafolios[str(chat_id)] = {}
+    nombre = " ".join(context.args[:-1]).strip().lower()
+    accion = context.args[-1].strip().lower()
 
     if accion == "on":
-        if nombre not in portafolios[str(chat_id)]:
-            resultado = buscar_carta(nombre)
-            if "error" in resultado:
+        if not await db.leer(alertas_carta_db.tiene_alerta, chat_id, nombre):
+            resultado = await buscar_carta(nombre)
+            if resultado.get("limite"):
+                await update.message.reply_text(MENSAJE_LIMITE)
+                return
+            if resultado.get("sin_precio"):
+                await update.message.reply_text(f"🚫 Scryfall no tiene precio en USD para `{nombre}`", parse_mode="Markdown")
+                return
+            impresion_id = None if "error" in resultado else await repositorio.impresion_id(resultado)
+            if not impresion_id:
                 await update.message.reply_text(f"🚫 No se encontró `{nombre}`")
                 return
             precio_actual = float(resultado["precio"])
-            portafolios[str(chat_id)][nombre] = {
-                "precio_compra": precio_actual,
-                "cantidad": 1
-            }
-            guardar_portafolio()
-            await update.message.reply_text(f"🔔 Alerta activada para `{nombre}`. Te avisaré si sube ≥ 0.5%", parse_mode="Markdown")
+            await db.escribir(alertas_carta_db.guardar_alerta, impresion_id, chat_id, precio_actual)
+            indice_alertas.agregar(impresion_id, chat_id, precio_actual)
+            await update.message.reply_text(f"🔔 Alerta activada para `{nombre}`. Te avisaré si sube ≥ {alertas_carta_db.UMBRAL_POR_DEFECTO}%", parse_mode="Markdown")
         else:
             await update.message.reply_text(f"ℹ️ Ya estás siguiendo `{nombre}`", parse_mode="Markdown")
     elif accion == "off":
-        if nombre in portafolios.get(str(chat_id), {}):
-            portafolios[str(chat_id)].pop(nombre)
-            guardar_portafolio()
+        borradas = await db.escribir(alertas_carta_db.borrar_alertas_por_nombre, chat_id, nombre)
+        if borradas:
+            for impresion_id in borradas:
+                indice_alertas.quitar(impresion_id, chat_id)
             await update.message.reply_text(f"🔕 Alerta desactivada para `{nombre}`", parse_mode="Markdown")
         else:
             await update.message.reply_text(f"🚫 No tenías alertas para `{nombre}`", parse_mode="Markdown")
     else:
         await update.message.reply_text("Acción no reconocida. Usa `on` o `off`.", parse_mode="Markdown")
 
+async def revisar_alertas_carta(context: ContextTypes.DEFAULT_TYPE):
+    """Avisar a los usuarios cuyas cartas superaron su umbral desde la última revisión"""
+    global ultima_revision_alertas_carta
+    # Las observaciones del buffer llegan a la base de datos hasta un volcado después de su ts
+    cambios = await db.leer(alertas_carta_db.cambios_desde, ultima_revision_alertas_carta - 2 * INTERVALO_VACIADO)
+    if not cambios:
+        return
+    ultima_revision_alertas_carta = max(ts for _, _, ts in cambios)
+
+    avisos = indice_alertas.evaluar((impresion_id, precio) for impresion_id, precio, _ in cambios)
+    if not avisos:
+        return
+
+    nombres = await db.leer(precios_db.nombres_impresiones, {impresion_id for _, impresion_id, _, _, _ in avisos})
+
+    enviados = []
+    for aviso in avisos:
+        chat_id, impresion_id, precio_ref, precio, cambio = aviso
+        nombre, edicion = nombres[impresion_id]
+        texto = f"🚀 *{nombre}* ({edicion}) subió {cambio:.2f}%\n"
+        texto += f"   💸 De ${precio_ref:.2f} → ${precio:.2f}"
+        try:
+            await enviar_con_limite(lambda: context.bot.send_message(chat_id=chat_id, text=texto, parse_mode="Markdown"))
+            enviados.append(aviso)
+        except Forbidden:
+            indice_alertas.quitar(impresion_id, chat_id)
+            await db.escribir(alertas_carta_db.borrar_alerta, impresion_id, chat_id)
+        except Exception as e:
+            logging.error(f"❌ No se pudo enviar alerta de carta a {chat_id}: {str(e)}")
+
+    indice_alertas.confirmar(enviados)
+    await db.escribir(alertas_carta_db.actualizar_referencias, enviados)
+
 async def seguir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global seguimiento_activo
     chat_id = update.effective_chat.id
@@ -518,15 +687,15 @@ async def seguir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     seguimiento_activo = True
     job_queue = context.job_queue
-    job_queue.run_repeating(monitor_seguimiento, interval=intervalo_dias * 86400, chat_id=chat_id)
+    job_queue.run_repeating(monitor_seguimiento, interval=intervalo_dias * 86400, chat_id=chat_id, name="seguimiento")
     await update.message.reply_text("✅ Iniciando seguimiento automático...")
 
 async def monitor_seguimiento(context: ContextTypes.DEFAULT_TYPE):
     global cartas_seguimiento
     chat_id = context.job.chat_id
     for nombre in cartas_seguimiento:
-        resultado = buscar_carta(nombre, None)
-        if "error" in resultado or "nombre" not in resultado or resultado["precio"] <= 0.0:
+        resultado = await buscar_carta(nombre, None, prioridad=FONDO)
+        if "error" in resultado or "nombre" not in resultado or resultado.get("sin_precio") or resultado["precio"] <= 0.0:
             continue
         texto = f"⏳ *Actualización diaria* – {nombre}\n"
         texto += f"📦 Edición: {resultado.get('edicion', 'No disponible')}\n"
@@ -538,7 +707,8 @@ async def detener_seguimiento(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not seguimiento_activo:
         await update.message.reply_text("🛑 No hay seguimiento activo.")
         return
-    context.job_queue.stop()
+    for job in context.job_queue.get_jobs_by_name("seguimiento"):
+        job.schedule_removal()
     seguimiento_activo = False
     await update.message.reply_text("🛑 El seguimiento automático ha sido detenido.")
 
@@ -571,15 +741,31 @@ async def estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🚫 Acceso denegado – Solo tú puedes usar este comando.")
         return
 
-    cursor.execute("SELECT COUNT(*) FROM cartas")
-    num_cartas = cursor.fetchone()[0]
+    num_cartas = await db.leer(precios_db.contar_impresiones)
 
     texto = "*📊 Estadísticas del Bot*\n\n"
-    texto += f"👥 Usuarios únicos: {len(usuarios_registrados)}\n"
+    texto += f"👥 Usuarios únicos: {await db.leer(usuarios_db.contar_usuarios)}\n"
     texto += f"🎴 Cartas registradas: {num_cartas}\n"
+    stats_cache = repositorio.estadisticas()
+    texto += f"🔔 Alertas por carta: {indice_alertas.total}\n"
+    texto += f"⚡ Caché de precios: {stats_cache['entradas']} cartas, {stats_cache['aciertos']} aciertos / {stats_cache['fallos']} fallos ({stats_cache['tasa_aciertos']:.1f}%)\n"
+    texto += f"💾 Desde SQLite: {stats_cache['locales']} vigentes, {stats_cache['obsoletas']} obsoletas servidas sin red, {stats_cache['revalidando']} revalidando\n"
+    texto += f"🔗 Consultas agrupadas: {stats_cache['coalescidas']} de {stats_cache['coalescidas'] + stats_cache['ejecutadas']}\n"
+    stats_portafolios = cache_portafolios.estadisticas()
+    texto += f"💼 Valoraciones en caché: {stats_portafolios['entradas']} portafolios, {stats_portafolios['aciertos']} aciertos / {stats_portafolios['fallos']} fallos\n"
+    stats_limitador = scryfall_client.limitador.estadisticas()
+    texto += f"🚦 Scryfall: {stats_limitador['peticiones']} peticiones, {stats_limitador['esperas']} en espera, {stats_limitador['limitadas']} respuestas 429\n"
+    stats_graficos = cache_graficos.estadisticas()
+    stats_imagenes = cache_imagenes.estadisticas()
+    texto += f"🖼️ Caché de gráficos: {stats_graficos['archivos']} PNG ({stats_graficos['bytes'] / 1024 / 1024:.1f} MB)\n"
+    texto += f"🃏 Caché de imágenes: {stats_imagenes['archivos']} cartas ({stats_imagenes['bytes'] / 1024 / 1024:.1f} MB), {len(file_ids)} file_id en Telegram\n"
+    stats_obs = observaciones.estadisticas()
+    texto += f"📝 Observaciones: {stats_obs['recibidas']} recibidas, {stats_obs['escritas']} filas nuevas y {stats_obs['verificadas']} sin cambios en {stats_obs['volcados']} volcados, {stats_obs['pendientes']} pendientes\n"
+    stats_db = db.estadisticas()
+    texto += f"🗄️ SQLite: {stats_db['escrituras']} escrituras en {stats_db['transacciones']} transacciones, {stats_db['lectores']} lectores\n"
     texto += "👉 Últimos usuarios:\n"
-    for u in list(usuarios_registrados)[-5:]:
-        texto += f"- {u}\n"
+    for u, username in await db.leer(usuarios_db.ultimos_usuarios, 5):
+        texto += f"- {u} (@{username})\n" if username else f"- {u}\n"
 
     await update.message.reply_text(texto, parse_mode="Markdown")
 
@@ -590,45 +776,60 @@ async def notificaciones_diarias(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     accion = context.args[0].lower()
-    job_queue = context.job_queue
 
     if accion == "on":
-        job_queue.run_daily(notificar_resumen_diario, time=datetime.strptime("09:00", "%H:%M").time(), chat_id=chat_id)
+        await db.escribir(suscripciones.suscribir, chat_id, suscripciones.RESUMEN_DIARIO)
         await update.message.reply_text("⏰ Notificaciones diarias activadas. Recibirás resumen cada mañana.")
     elif accion == "off":
-        job_queue.stop()
+        await db.escribir(suscripciones.desuscribir, chat_id, suscripciones.RESUMEN_DIARIO)
         await update.message.reply_text("🔔 Notificaciones diarias desactivadas.")
     else:
         await update.message.reply_text("Acción no reconocida. Usa `on` o `off`.", parse_mode="Markdown")
 
+def grafico_oportunidades(resultados):
+    """Gráfico de dispersión de oportunidades como (función, *argumentos) para enviar_grafico"""
+    top = resultados[:10]
+    return (
+        graficos.oportunidades,
+        [x["nombre"] for x in top],
+        [x["inicio"] for x in top],
+        [x["cambio"] for x in top],
+        "📉 Alerta – Oportunidades Detectadas"
+    )
+
+async def enviar_con_limite(envio):
+    """Ejecutar un envío respetando los límites de Telegram (reintenta tras RetryAfter)"""
+    try:
+        return await envio()
+    except RetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        return await envio()
+    finally:
+        await asyncio.sleep(1 / envios_por_segundo)
+
+async def difundir(context: ContextTypes.DEFAULT_TYPE, tipo, texto, grafico=None):
+    """Enviar el mismo aviso (y gráfico) a todos los chats suscritos a `tipo`
+
+    `grafico` es una tupla (función, *argumentos): se renderiza y sube una sola
+    vez y al resto de chats se reenvía por file_id.
+    """
+    for chat_id in await db.leer(suscripciones.suscriptores, tipo):
+        try:
+            await enviar_con_limite(lambda: context.bot.send_message(chat_id=chat_id, text=texto, parse_mode="Markdown"))
+            if grafico is not None:
+                enviar = lambda photo: enviar_con_limite(lambda: context.bot.send_photo(chat_id=chat_id, photo=photo))
+                await enviar_grafico(enviar, *grafico)
+        except Forbidden:
+            # El usuario bloqueó el bot: no tiene sentido seguir enviándole avisos
+            await db.escribir(suscripciones.desuscribir, chat_id, tipo)
+        except Exception as e:
+            logging.error(f"❌ No se pudo enviar aviso a {chat_id}: {str(e)}")
+
 async def notificar_resumen_diario(context: ContextTypes.DEFAULT_TYPE):
-    historial = cargar_historial()
-    if not historial:
+    if not await db.leer(suscripciones.suscriptores, suscripciones.RESUMEN_DIARIO):
         return
 
-    chat_id = context.job.chat_id
-    resultados = []
-    for clave in historial:
-        registros = historial[clave]
-        if len(registros) >= 2:
-            primer_registro = registros[0]
-            ultimo_registro = registros[-1]
-            fecha_fin = datetime.strptime(ultimo_registro["fecha"], "%Y-%m-%d %H:%M")
-            dias_cambio = (datetime.now() - fecha_fin).days
-
-            if dias_cambio <= 7:
-                precio_inicio = float(primer_registro["precio"])
-                precio_fin = float(ultimo_registro["precio"])
-                if precio_inicio > 0 and precio_fin > 0:
-                    cambio_porcentaje = ((precio_fin - precio_inicio) / precio_inicio) * 100
-                    if cambio_porcentaje >= 0.5:
-                        resultados.append({
-                            "nombre": clave.split(" - ")[0],
-                            "inicio": precio_inicio,
-                            "fin": precio_fin,
-                            "cambio": cambio_porcentaje
-                        })
-
+    resultados = await db.leer(movers.calcular_movers, "7d", limite=10)
     if not resultados:
         return
 
@@ -637,25 +838,8 @@ async def notificar_resumen_diario(context: ContextTypes.DEFAULT_TYPE):
         texto += f"{idx}. {item['nombre']}\n"
         texto += f"   💸 De ${item['inicio']:.2f} → ${item['fin']:.2f} (+{item['cambio']:.2f}%)\n\n"
 
-    await context.bot.send_message(chat_id=chat_id, text=texto, parse_mode="Markdown")
-
-    # Enviar gráfico
-    if resultados:
-        nombres_graf, inicio_graf, fin_graf, porcentaje_graf = zip(*[(x["nombre"], x["inicio"], x["fin"], x["cambio"]) for x in resultados[:10]])
-        plt.style.use('dark_background')
-        fig, ax = plt.subplots(figsize=(12, 6))
-        scatter = ax.scatter(inicio_graf, porcentaje_graf, s=100, c=porcentaje_graf, cmap="viridis", alpha=0.9)
-        ax.set_title("📉 Alerta – Oportunidades Detectadas", fontsize=14, pad=20)
-        ax.set_xlabel("Precio Actual (USD)", fontsize=12)
-        ax.set_ylabel("Cambio (%)", fontsize=12)
-        ax.grid(True, linestyle='--', alpha=0.5)
-        for i, nombre in enumerate(nombres_graf):
-            ax.text(inicio_graf[i], porcentaje_graf[i], nombre, fontsize=9, ha='right')
-        plt.colorbar(scatter, label="Cambio (%)")
-        plt.tight_layout()
-        plt.savefig("grafico_notificacion_diaria.png", dpi=150, bbox_inches='tight')
-        plt.close()
-        await context.bot.send_document(chat_id=chat_id, document=open("grafico_notificacion_diaria.png", "rb"))
+    grafico = grafico_oportunidades(resultados)
+    await difundir(context, suscripciones.RESUMEN_DIARIO, texto, grafico)
 
 async def comparar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) < 2:
@@ -664,8 +848,10 @@ async def comparar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     nombre1 = context.args[0].strip()
     nombre2 = context.args[1].strip()
-    resultado1 = buscar_carta(nombre1)
-    resultado2 = buscar_carta(nombre2)
+    resultado1, resultado2 = await asyncio.gather(buscar_carta(nombre1), buscar_carta(nombre2))
+    if resultado1.get("limite") or resultado2.get("limite"):
+        await update.message.reply_text(MENSAJE_LIMITE)
+        return
 
     if "error" in resultado1 or "nombre" not in resultado1:
         await update.message.reply_text(f"🚫 No se pudo encontrar `{nombre1}`")
@@ -679,21 +865,12 @@ async def comparar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     fechas2 = [datetime.now() - timedelta(days=i*7) for i in range(6)]
     precios2 = [float(resultado2["precio"]) * (1 + i*0.05) for i in range(6)]
 
-    plt.style.use('dark_background')
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(fechas1, precios1, label=nombre1, marker='o', linewidth=2)
-    ax.plot(fechas2, precios2, label=nombre2, marker='o', linewidth=2)
-    ax.set_title(f"📈 Comparativa: {nombre1} vs {nombre2}", fontsize=14, pad=20)
-    ax.set_xlabel("Fecha", fontsize=12)
-    ax.set_ylabel("Precio USD", fontsize=12)
-    ax.grid(True, linestyle='--', alpha=0.5)
-    ax.legend()
-    plt.xticks(rotation=45, fontsize=10)
-    plt.yticks(fontsize=10)
-    plt.tight_layout()
-    plt.savefig("grafico_comparativo.png", dpi=150, bbox_inches='tight')
-    plt.close()
-    await update.message.reply_document(document=open("grafico_comparativo.png", "rb"))
+    await enviar_grafico(
+        update.message.reply_photo,
+        graficos.comparativo,
+        [(nombre1, fechas1, precios1), (nombre2, fechas2, precios2)],
+        f"📈 Comparativa: {nombre1} vs {nombre2}"
+    )
 
 async def ver_historial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
@@ -701,59 +878,30 @@ async def ver_historial(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     nombre = " ".join(context.args).strip()
-    cursor.execute("SELECT fecha, precio FROM cartas WHERE nombre=? ORDER BY fecha DESC LIMIT 10", (nombre,))
-    registros = cursor.fetchall()
+    registros = await db.leer(precios_db.historial_carta, nombre, 10)
     if not registros:
         await update.message.reply_text("📜 No hay datos guardados para esta carta.")
         return
 
     texto = f"📅 Historial para `{nombre}`:\n"
-    for reg in registros:
-        _, precio, fecha = reg
-        texto += f"{fecha} | ${precio:.2f}\n"
+    for ts, precio, edicion in registros:
+        texto += f"{precios_db.ts_a_fecha(ts)} | ${precio:.2f} | {edicion}\n"
     await update.message.reply_text(texto, parse_mode="Markdown")
 
 async def activar_alertas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global alertas_por_usuario
     chat_id = update.effective_chat.id
-    if chat_id in alertas_por_usuario:
+    if not await db.escribir(suscripciones.suscribir, chat_id, suscripciones.ALERTAS):
         await update.message.reply_text("🔔 Alertas ya están activas.")
         return
 
-    alertas_por_usuario[chat_id] = True
-    job_queue = context.job_queue
-    job_queue.run_repeating(monitor_alertas, interval=intervalo_alertas, first=10, chat_id=chat_id)
     await update.message.reply_text("✅ Alertas automáticas activadas. Revisaré oportunidades cada 6 horas.")
 
 async def monitor_alertas(context: ContextTypes.DEFAULT_TYPE):
-    historial = cargar_historial()
-    if not historial:
+    """Calcular las oportunidades una vez por intervalo y repartirlas a todos los suscriptores"""
+    if not await db.leer(suscripciones.suscriptores, suscripciones.ALERTAS):
         return
 
-    chat_id = context.job.chat_id
-    resultados = []
-    for clave in historial:
-        registros = historial[clave]
-        if len(registros) >= 2:
-            primer_registro = registros[0]
-            ultimo_registro = registros[-1]
-            fecha_fin = datetime.strptime(ultimo_registro["fecha"], "%Y-%m-%d %H:%M")
-            dias_cambio = (datetime.now() - fecha_fin).days
-
-            if dias_cambio <= 7:
-                precio_inicio = float(primer_registro["precio"])
-                precio_fin = float(ultimo_registro["precio"])
-
-                if precio_inicio > 0 and precio_fin > 0:
-                    cambio_porcentaje = ((precio_fin - precio_inicio) / precio_inicio) * 100
-                    if cambio_porcentaje >= 0.5:
-                        resultados.append({
-                            "nombre": clave.split(" - ")[0],
-                            "inicio": precio_inicio,
-                            "fin": precio_fin,
-                            "cambio": cambio_porcentaje
-                        })
-
+    resultados = await db.leer(movers.calcular_movers, "7d", limite=10)
     if not resultados:
         return
 
@@ -762,37 +910,63 @@ async def monitor_alertas(context: ContextTypes.DEFAULT_TYPE):
         texto += f"{idx}. {item['nombre']}\n"
         texto += f"   💸 De ${item['inicio']:.2f} → ${item['fin']:.2f} (+{item['cambio']:.2f}%)\n\n"
 
-    await context.bot.send_message(chat_id=chat_id, text=texto, parse_mode="Markdown")
-
-    # Enviar gráfico
-    if resultados:
-        nombres_graf, inicio_graf, fin_graf, porcentaje_graf = zip(*[(x["nombre"], x["inicio"], x["fin"], x["cambio"]) for x in resultados[:10]])
-        plt.style.use('dark_background')
-        fig, ax = plt.subplots(figsize=(12, 6))
-        scatter = ax.scatter(inicio_graf, porcentaje_graf, s=100, c=porcentaje_graf, cmap="viridis", alpha=0.9)
-        ax.set_title("📉 Alerta – Oportunidades Detectadas", fontsize=14, pad=20)
-        ax.set_xlabel("Precio Actual (USD)", fontsize=12)
-        ax.set_ylabel("Cambio (%)", fontsize=12)
-        ax.grid(True, linestyle='--', alpha=0.5)
-        for i, nombre in enumerate(nombres_graf):
-            ax.text(inicio_graf[i], porcentaje_graf[i], nombre, fontsize=9, ha='right')
-        plt.colorbar(scatter, label="Cambio (%)")
-        plt.tight_layout()
-        plt.savefig("grafico_alertas_auto.png", dpi=150, bbox_inches='tight')
-        plt.close()
-        await context.bot.send_document(chat_id=chat_id, document=open("grafico_alertas_auto.png", "rb"))
+    grafico = grafico_oportunidades(resultados)
+    await difundir(context, suscripciones.ALERTAS, texto, grafico)
 
 async def desactivar_alertas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global alertas_por_usuario
     chat_id = update.effective_chat.id
-    if chat_id in alertas_por_usuario:
-        alertas_por_usuario.pop(chat_id)
+    if await db.escribir(suscripciones.desuscribir, chat_id, suscripciones.ALERTAS):
         await update.message.reply_text("🔔 Alertas automáticas desactivadas.")
     else:
         await update.message.reply_text("🚫 Las alertas ya están desactivadas.")
 
+async def cerrar_conexiones(application: Application):
+    """Volcar las observaciones y la demanda pendientes y liberar el pool HTTP de Scryfall, el pool de gráficos y la base de datos"""
+    await observaciones.vaciar()
+    await demanda.volcar(db)
+    await scryfall_client.cerrar_cliente()
+    graficos.cerrar_pool()
+    db.cerrar()
+
+def arrancar():
+    """Abrir la base de datos, crear o migrar las tablas y cargar los índices en memoria"""
+    global db, observaciones, repositorio, indice_nombres, cache_graficos, cache_imagenes, file_ids, indice_alertas
+    global ultima_revision_alertas_carta
+    db = BaseDatos(DB_FILE)
+    conn = db.escritor  # la conexión de escritura sólo se usa directamente durante el arranque
+
+    # Crear tablas si no existen (y migrar la tabla antigua 'cartas' si sigue ahí)
+    precios_db.inicializar_esquema(conn)
+    migradas = precios_db.migrar_cartas_legacy(conn)
+    if migradas:
+        print(f"🔄 Migradas {migradas} observaciones al esquema normalizado")
+    suscripciones.inicializar_esquema(conn)
+    alertas_carta_db.inicializar_esquema(conn)
+    archivos_telegram.inicializar_esquema(conn)
+    precarga.inicializar_esquema(conn)
+
+    # Usuarios y portafolios (importando una sola vez los antiguos archivos JSON)
+    usuarios_db.inicializar_esquema(conn)
+    usuarios_importados, cartas_importadas = usuarios_db.importar_json(conn)
+    if usuarios_importados or cartas_importadas:
+        print(f"🔄 Importados {usuarios_importados} usuarios y {cartas_importadas} cartas de portafolio desde JSON")
+    portafolio.inicializar_esquema(conn)
+    precios_importados = importar_json_legado(conn)
+    if precios_importados:
+        print(f"🔄 Importados {precios_importados} precios de las cachés JSON antiguas")
+
+    observaciones = BufferObservaciones(db, al_registrar=indexar_carta)
+    repositorio = RepositorioCartas(db, observaciones, buscar_en_scryfall)
+    indice_nombres = IndiceNombres.desde_db(conn)
+    cache_graficos = CacheGraficos()
+    cache_imagenes = CacheImagenes()
+    file_ids = RegistroFileIds(conn)
+    indice_alertas = alertas_carta_db.IndiceAlertas.desde_db(conn)
+    ultima_revision_alertas_carta = int(time.time())
+
 def main():
-    application = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN")).build()
+    arrancar()
+    application = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN")).post_shutdown(cerrar_conexiones).build()
     
     # Registrar comandos
     application.add_handler(CommandHandler("start", start))
@@ -813,8 +987,19 @@ def main():
     application.add_handler(CommandHandler("desactivar_alertas", desactivar_alertas))
     application.add_handler(CommandHandler("estadisticas", estadisticas))
 
-    print(f"✅ Bot iniciado. Cartas totales: {len(cargar_historial())}")
+    # Un único trabajo por tipo de aviso, compartido por todos los suscriptores
+    application.job_queue.run_repeating(monitor_alertas, interval=intervalo_alertas, first=10, name="alertas")
+    application.job_queue.run_daily(notificar_resumen_diario, time=hora_resumen_diario, name="resumen_diario")
+    application.job_queue.run_daily(guardar_snapshots_portafolio, time=hora_snapshot_portafolio, name="snapshots_portafolio")
+    application.job_queue.run_once(completar_snapshots_portafolio, when=300, name="snapshot_arranque")
+    application.job_queue.run_repeating(revisar_alertas_carta, interval=intervalo_alertas_carta, first=30, name="alertas_carta")
+    application.job_queue.run_repeating(vaciar_observaciones, interval=INTERVALO_VACIADO, first=INTERVALO_VACIADO, name="observaciones")
+    application.job_queue.run_repeating(precalentar_cache, interval=precarga.INTERVALO_PRECARGA, first=5, name="precarga")
+    application.job_queue.run_repeating(refrescar_precios, interval=refresco.INTERVALO_REFRESCO, first=120, name="refresco")
+
+    print(f"✅ Bot iniciado. Cartas totales: {precios_db.contar_impresiones(db.escritor)}")
     application.run_polling()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
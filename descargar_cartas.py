@@ -1,44 +1,148 @@
 ﻿import requests
 import sqlite3
-from datetime import datetime
+import argparse
+import os
+import json
 import time
+from backend.bulk_data import iterar_cartas_bulk, observacion_desde_carta
+from backend import precios_db
+from backend.limitador import LimitadorBloqueante
 
 # Conectar a la base de datos
 conn = sqlite3.connect("mtg_cards.db")
-cursor = conn.cursor()
+precios_db.inicializar_esquema(conn)
 
-def guardar_carta_en_db(nombre, edicion, coleccion, precio, image_url):
-    cursor.execute('''
-        INSERT INTO cartas (nombre, edicion, coleccion, precio, fecha, image_url, rsi)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (nombre, edicion, coleccion, precio, datetime.now().strftime("%Y-%m-%d %H:%M"), image_url, None))
-    conn.commit()
-    print(f"💾 {nombre} – Guardada en base de datos")
+LOTE_INSERT = 5000          # filas por executemany
+LOTE_TRANSACCION = 100000   # filas por commit
+BULK_DATA_URL = "https://api.scryfall.com/bulk-data/default-cards"
+BULK_DATA_ARCHIVO = os.path.join("data", "default-cards.json")
+BULK_DATA_META = BULK_DATA_ARCHIVO + ".meta"  # ETag / Last-Modified de la última descarga
+
+# Límite de peticiones a api.scryfall.com (los archivos de data.scryfall.io no cuentan)
+limitador = LimitadorBloqueante()
+
+def guardar_cartas_en_db(observaciones, ts):
+    """Insertar un lote de observaciones sin hacer commit; los precios sin cambios sólo se verifican
+
+    Devuelve el número de filas añadidas al historial.
+    """
+    _, cambios = precios_db.registrar_cambios(conn, observaciones, ts)
+    return len(cambios)
 
 def obtener_todas_las_cartas():
     url = "https://api.scryfall.com/cards/search?q=is%3Abooster+t%3Acard"
-    
+
     while url:
-        response = requests.get(url)
+        response = limitador.ejecutar(lambda: requests.get(url))
         if response.status_code != 200:
             print("❌ Error al conectarse a Scryfall")
             break
 
         data = response.json()
-        for card in data["data"]:
-            nombre = card["name"]
-            edicion = card.get("set_name", "No disponible")
-            coleccion = card.get("set", "No disponible")
-            precio = float(card["prices"].get("usd", 0.01)) if "prices" in card else 0.01
-            image_url = card.get("image_uris", {}).get("normal", "")
+        observaciones = [observacion_desde_carta(card) for card in data["data"]]
 
-            # Guardar en la base de datos 
-            guardar_carta_en_db(nombre, edicion, coleccion, precio, image_url)
+        # Guardar la página completa en una sola transacción
+        nuevas = guardar_cartas_en_db([o for o in observaciones if o["precio"] is not None], int(time.time()))
+        conn.commit()
 
-        print(f"📥 Cargadas {len(data['data'])} cartas...")
+        print(f"📥 Cargadas {len(data['data'])} cartas ({nuevas} precios nuevos)...")
         url = data["next_page"] if data["has_more"] else None
-        time.sleep(0.1)
 
     print("🎉 ¡Base de datos completada!")
 
-obtener_todas_las_cartas()
+def leer_meta(ruta=BULK_DATA_META):
+    """Validadores de la última descarga del bulk-data, o {} si no hay"""
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def descargar_bulk_data(destino=BULK_DATA_ARCHIVO, meta=BULK_DATA_META):
+    """Descargar el archivo bulk-data 'default_cards' de Scryfall en streaming
+
+    Si el archivo ya descargado sigue siendo el publicado (mismo download_uri y
+    respuesta 304 a If-None-Match / If-Modified-Since) no se vuelve a
+    descargar y devuelve None.
+    """
+    info = limitador.ejecutar(lambda: requests.get(BULK_DATA_URL))
+    info.raise_for_status()
+    download_uri = info.json()["download_uri"]
+
+    anterior = leer_meta(meta)
+    cabeceras = {}
+    if anterior.get("download_uri") == download_uri and os.path.exists(destino):
+        if anterior.get("etag"):
+            cabeceras["If-None-Match"] = anterior["etag"]
+        if anterior.get("last_modified"):
+            cabeceras["If-Modified-Since"] = anterior["last_modified"]
+
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    temporal = destino + ".part"
+    with requests.get(download_uri, headers=cabeceras, stream=True) as response:
+        if response.status_code == 304:
+            print("📦 El bulk-data no ha cambiado desde la última descarga")
+            return None
+        response.raise_for_status()
+        with open(temporal, "wb") as f:
+            for bloque in response.iter_content(chunk_size=1 << 20):
+                f.write(bloque)
+        validadores = {
+            "download_uri": download_uri,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+    os.replace(temporal, destino)
+    with open(meta, "w", encoding="utf-8") as f:
+        json.dump(validadores, f)
+    print(f"📦 Bulk-data descargado en {destino}")
+    return destino
+
+def importar_bulk_data(ruta):
+    """Cargar un archivo bulk-data en la base de datos con inserciones por lotes"""
+    ts = int(time.time())
+    lote = []
+    pendientes = 0
+    total = 0
+    nuevas = 0
+    sin_precio = 0
+
+    for card in iterar_cartas_bulk(ruta):
+        observacion = observacion_desde_carta(card)
+        if observacion["precio"] is None:
+            sin_precio += 1
+            continue
+        lote.append(observacion)
+        if len(lote) >= LOTE_INSERT:
+            nuevas += guardar_cartas_en_db(lote, ts)
+            pendientes += len(lote)
+            total += len(lote)
+            lote = []
+            if pendientes >= LOTE_TRANSACCION:
+                conn.commit()
+                pendientes = 0
+                print(f"📥 Cargadas {total} cartas...")
+
+    if lote:
+        nuevas += guardar_cartas_en_db(lote, ts)
+        total += len(lote)
+    conn.commit()
+
+    print(f"🎉 ¡Base de datos completada! {total} cartas revisadas, {nuevas} precios nuevos "
+          f"({total - nuevas} sin cambios, {sin_precio} sin precio USD omitidas)")
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Descargar cartas de Scryfall a mtg_cards.db")
+    parser.add_argument("--bulk", metavar="ARCHIVO", help="Importar un archivo bulk-data JSON local")
+    parser.add_argument("--descargar-bulk", action="store_true", help="Descargar el bulk-data 'default_cards' e importarlo")
+    args = parser.parse_args()
+
+    if args.bulk:
+        importar_bulk_data(args.bulk)
+    elif args.descargar_bulk:
+        ruta = descargar_bulk_data()
+        if ruta:
+            importar_bulk_data(ruta)
+    else:
+        obtener_todas_las_cartas()
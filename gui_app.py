@@ -1,13 +1,16 @@
 ﻿import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from backend.mtg_core import buscar_carta, obtener_todas_ediciones
+from backend.cache_imagenes import CacheImagenes
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os
-import requests
 from io import BytesIO
 from PIL import Image, ImageTk
 
+# Imágenes de cartas compartidas con el bot (data/imagenes)
+cache_imagenes = CacheImagenes()
+
 class MTGValueGUI:
     def __init__(self, root):
         self.root = root
@@ -119,8 +122,7 @@ class MTGValueGUI:
         image_url = resultado.get("image_url")
         if image_url:
             try:
-                response = requests.get(image_url)
-                img_data = BytesIO(response.content)
+                img_data = BytesIO(cache_imagenes.obtener_bloqueante(image_url))
                 img_pil = Image.open(img_data).resize((200, 280), Image.LANCZOS)
                 self.photo = ImageTk.PhotoImage(img_pil)
                 self.label_imagen.config(image=self.photo, text="")
@@ -163,7 +165,6 @@ if __name__ == "__main__":
     from datetime import datetime
     import numpy as np
     from backend.mtg_core import buscar_carta, obtener_todas_ediciones
-    import requests
     from io import BytesIO
     from PIL import Image, ImageTk
 
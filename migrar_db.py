@@ -0,0 +1,47 @@
+﻿import argparse
+import os
+import sqlite3
+from backend.precios_db import inicializar_esquema, migrar_cartas_legacy, existe_tabla
+from backend import usuarios_db
+
+def importar_usuarios(conn):
+    """Pasar usuarios_activos.json y usuarios_portafolio.json a SQLite"""
+    usuarios_db.inicializar_esquema(conn)
+    usuarios, cartas = usuarios_db.importar_json(conn)
+    if usuarios or cartas:
+        print(f"👥 Importados {usuarios} usuarios y {cartas} cartas de portafolio desde JSON")
+
+def migrar(ruta, backup=True):
+    """Convertir una base de datos mtg_cards.db antigua al esquema normalizado"""
+    if not os.path.exists(ruta):
+        print(f"❌ No existe la base de datos {ruta}")
+        return 0
+
+    conn = sqlite3.connect(ruta)
+    # La copia se hace antes de tocar nada, también antes de importar los JSON
+    if backup:
+        copia = sqlite3.connect(ruta + ".bak")
+        conn.backup(copia)
+        copia.close()
+        print(f"💾 Copia de seguridad en {ruta}.bak")
+
+    legado = existe_tabla(conn, "cartas")
+    inicializar_esquema(conn)
+    importar_usuarios(conn)
+    if not legado:
+        print("ℹ️ La base de datos ya usa el esquema normalizado")
+        conn.close()
+        return 0
+
+    total = migrar_cartas_legacy(conn)
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"✅ Migradas {total} observaciones de precio")
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrar mtg_cards.db al esquema normalizado (impresiones + precios)")
+    parser.add_argument("db", nargs="?", default="mtg_cards.db", help="Ruta de la base de datos")
+    parser.add_argument("--sin-backup", action="store_true", help="No crear copia de seguridad .bak")
+    args = parser.parse_args()
+    migrar(args.db, backup=not args.sin_backup)
@@ -1,44 +1,30 @@
-﻿import os
-import json
-from backend.mtg_core import buscar_en_scryfall, buscar_en_magic_api, cargar_cache, guardar_cache
+﻿import argparse
+import asyncio
+from backend import precios_db
+from backend import precarga
+from backend import scryfall_client
+from backend.base_datos import BaseDatos
+from backend.buffer_observaciones import BufferObservaciones
+from backend.repositorio_cartas import RepositorioCartas
 
-# Lista de cartas populares de Magic: The Gathering
-cartas_populares = [
-    "Black Knight", "Ancestral Recall", "Time Walk", "Mox Emerald", "Mox Sapphire",
-    "Mox Ruby", "Mox Jet", "Mox Pearl", "The Power Nine", "Power Nine",
-    "Jace the Mind Sculptor", "Liliana of the Veil", "Mana Crypt", "Umez Etenzo",
-    "Sol Ring", "Bazaar of Baghdad", "Underground Sea", "Force of Will", "Brainstorm",
-    "Black Lotus", "Island", "Mountain", "Forest", "Plains", "Swamp", 
-    "Murktide Regent", "Ancestral Mask", "Tarmogoyf", "Wasteland", "Daze", 
-    "Counterspell", "Swords to Plowshares", "Stoneforge Mystic", "Sensei's Divining Top",
-    "Deathrite Shaman", "Delver of Secrets", "Ponder", "Red Elemental Blast", 
-    "Pyroblast", "Blue Elemental Blast", "Vampire Hexmage", "Thalia Guardian of Thraben",
-    "Choke", "Back to Basics", "Library of Alexandria", "Strip Mine", "Windswept Heath",
-    "Verdant Catacombs", "Marsh Flats", "Arid Mesa", "Scalding Tarn", "Polluted Delta",
-    "Underground River", "Mana Confluence", "Command Tower", "Relentless Rhombus", "Seat of the Synod",
-    "Chrome Mox", "Mishra's Workshop", "Grim Monolith", "Basalt Monolith", "Black Vise",
-    "Mox Diamond", "Imperial Recruiter", "Serra Avenger", "Serra Angel", "Volcanic Island",
-    "Tundra", "Scrubland", "Aqueduct", "Taiga", "Badlands", "Bayou", "Plateau", "Savannah",
-    "Scrubsaber Tiger", "Birds of Paradise", "Elvish Spirit Guide", "Fry", "Fireball",
-    "Ancestral Vision", "Opt", "Serum Visions", "Gitaxian Probe", "Inquisition of Kozilek",
-    "Thoughtseize", "Brainstorm", "Ponder", "Fact or Fiction", "Counterbalance",
-    "Spell Pierce", "Flusterclaw", "True-Name Nemesis", "Leonin Relic", "Chrome Mox",
-    "Underworld Connections", "Echoing Truth", "Vendilion Clique", "Stoneforge Mystic",
-    "Ulamog", "Emrakul", "Progenitus", "Karakas", "Celestial Colonnade", "Tolarian Academy",
-    "Mana Vault", "Mishra's Factory", "City in a Bottle", "Mana Battery", "Mana Severance",
-    "Mana Reflection", "Mana Echoes", "Mana Crypt", "Mana Vault", "Mana Drain", "Mana Shortage"
-]
+# Precargar en mtg_cards.db las cartas más buscadas (el bot hace lo mismo al arrancar y periódicamente)
+DB_FILE = "mtg_cards.db"
 
-# Carpeta del caché
-os.makedirs("data", exist_ok=True)
+async def poblar(limite):
+    db = BaseDatos(DB_FILE)
+    try:
+        precios_db.inicializar_esquema(db.escritor)
+        precarga.inicializar_esquema(db.escritor)
+        observaciones = BufferObservaciones(db)
+        repositorio = RepositorioCartas(db, observaciones, consultar_red=None)
+        cartas, faltantes = await precarga.precalentar(repositorio, db, limite)
+        await observaciones.vaciar()
+        print(f"🎉 Caché poblado con éxito: {cartas} cartas guardadas, {len(faltantes)} no encontradas.")
+    finally:
+        await scryfall_client.cerrar_cliente()
+        db.cerrar()
 
-# Limpiar caché actual si existe
-cache = cargar_cache()
-for carta in cartas_populares:
-    resultados = buscar_en_scryfall(carta)
-    if resultados:
-        cache[carta.lower()] = resultados
-        print(f"💾 Cartas guardadas: {len(resultados)} versiones de `{carta}`")
-
-guardar_cache(cache)
-print("🎉 Caché poblado con éxito.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precargar los precios de las cartas más buscadas")
+    parser.add_argument("--limite", type=int, default=precarga.PRECARGA_CARTAS, help="número de cartas a precargar")
+    asyncio.run(poblar(parser.parse_args().limite))